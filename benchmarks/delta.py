@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark pushing a large, slightly changed file whole and as a block delta.
+
+The remote host is simulated by a :class:`confab.transport.LocalTransport`;
+the number of bytes uploaded stands in for the time spent on the link.
+
+Usage: python benchmarks/delta.py [megabytes] [changes]
+"""
+import sys
+from os import makedirs
+from os.path import getsize, join
+from random import Random
+from shutil import copyfile, rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from mock import patch
+
+from confab.options import options
+from confab.transport import LocalTransport
+
+
+def make_files(directory, size, changes):
+    """
+    Create a remote file and a local copy with scattered in-place changes.
+    """
+    random = Random(0)
+    remote = join(directory, 'remote', 'table')
+    local = join(directory, 'table')
+    with open(local, 'wb') as file_:
+        for index in xrange(size // 32):
+            file_.write('{:08x} {:022x}\n'.format(index, random.getrandbits(88)))
+    copyfile(local, remote)
+    with open(local, 'r+b') as file_:
+        for _ in xrange(changes):
+            file_.seek(random.randrange(size // 32) * 32 + 9)
+            file_.write('{:022x}'.format(random.getrandbits(88)))
+    return local
+
+
+def measure(transport, push):
+    uploaded = []
+    upload = transport.upload
+
+    def counting_upload(local_path):
+        uploaded.append(getsize(local_path))
+        return upload(local_path)
+
+    start = default_timer()
+    with patch.object(transport, 'upload', counting_upload):
+        push()
+    return default_timer() - start, sum(uploaded)
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 * 1024 if len(sys.argv) > 1 else 64 * 1024 * 1024
+    changes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    directory = mkdtemp()
+    try:
+        makedirs(join(directory, 'remote'))
+        local = make_files(directory, size, changes)
+        transport = LocalTransport(join(directory, 'remote'))
+
+        whole_time, whole_bytes = measure(transport,
+                                          lambda: transport.push([(local, '/table')], True))
+        # restore the old remote content
+        make_files(directory, size, changes)
+        delta_time, delta_bytes = measure(transport,
+                                          lambda: transport.push_delta(local, '/table',
+                                                                       options.delta_block_size))
+        print('{} MiB, {} changes: whole {:.2f}s {} bytes, delta {:.2f}s {} bytes'
+              .format(size // (1024 * 1024), changes, whole_time, whole_bytes,
+                      delta_time, delta_bytes))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmark line diff engines on configuration file shapes.
+
+Compares :func:`difflib.unified_diff` with :func:`confab.linediff.histogram_diff`
+on large hosts files, access lists, zone files and web server configurations
+with scattered edits: 1% of lines, 10% of lines and every other line.
+
+Usage: python benchmarks/diff.py [lines]
+"""
+import sys
+from difflib import unified_diff
+from random import Random
+from timeit import default_timer
+
+from confab.linediff import histogram_diff
+
+
+def hosts_file(random, lines):
+    return ['10.{}.{}.{} host{}.example.com\n'.format(i >> 16 & 255, i >> 8 & 255, i & 255, i)
+            for i in xrange(lines)]
+
+
+def access_list(random, lines):
+    # many repeated lines: rules and separators
+    rules = ['permit tcp any any eq 443\n', 'deny ip any any log\n', '!\n', 'remark ---\n']
+    return ['permit ip host 10.0.{}.{} any\n'.format(i >> 8 & 255, i & 255)
+            if random.random() < 0.3 else random.choice(rules)
+            for i in xrange(lines)]
+
+
+def zone_file(random, lines):
+    return ['h{} IN A 192.0.{}.{}\n'.format(i, i >> 8 & 255, i & 255) if i % 3
+            else '  IN TXT "v=spf1 -all"\n'
+            for i in xrange(lines)]
+
+
+def server_blocks(random, lines):
+    # blocks of mostly repeated lines, each with one unique line
+    blocks = []
+    for i in xrange(lines // 7 + 1):
+        blocks.extend(['server {\n',
+                       '    listen 80;\n',
+                       '    server_name h{}.example.com;\n'.format(i),
+                       '    root /srv/www;\n',
+                       '    access_log off;\n',
+                       '}\n',
+                       '\n'])
+    return blocks[:lines]
+
+
+def edit(random, lines, rate=0.01):
+    """
+    Return a copy of lines with scattered insertions, deletions and changes
+    of a ``rate`` of the lines.
+    """
+    lines = list(lines)
+    edits = int(len(lines) * rate)
+    for _ in xrange(edits):
+        index = random.randrange(len(lines))
+        kind = random.randrange(3)
+        if kind == 0:
+            del lines[index]
+        elif kind == 1:
+            lines.insert(index, 'added {}\n'.format(index))
+        else:
+            lines[index] = 'changed {}\n'.format(index)
+    return lines
+
+
+def alternate(lines):
+    """
+    Return a copy of lines with every other line changed.
+    """
+    return [line if i % 2 else 'changed {}\n'.format(i) for i, line in enumerate(lines)]
+
+
+def measure(diff, a, b):
+    start = default_timer()
+    count = sum(1 for _ in diff(a, b, fromfile='remote', tofile='generated'))
+    return default_timer() - start, count
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    random = Random(0)
+
+    edits = [('1%', lambda a: edit(random, a, 0.01)),
+             ('10%', lambda a: edit(random, a, 0.1)),
+             ('alternate', alternate)]
+
+    print('{:<14} {:<10} {:>8} {:>12} {:>12}'.format('shape', 'edits', 'lines',
+                                                     'difflib', 'histogram'))
+    for shape in (hosts_file, access_list, zone_file, server_blocks):
+        a = shape(random, lines)
+        for name, edit_func in edits:
+            b = edit_func(a)
+            difflib_time, _ = measure(unified_diff, a, b)
+            histogram_time, _ = measure(histogram_diff, a, b)
+            print('{:<14} {:<10} {:>8} {:>11.3f}s {:>11.3f}s'.format(shape.__name__,
+                                                                     name,
+                                                                     lines,
+                                                                     difflib_time,
+                                                                     histogram_time))
+
+
+if __name__ == '__main__':
+    main()
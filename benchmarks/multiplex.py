@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark checksumming files on many hosts one after another and multiplexed,
+as ``apply`` does when checking for drift.
+
+Each host is a local directory; every command waits for a fixed latency
+first, standing in for an SSH round-trip.
+
+Usage: python benchmarks/multiplex.py [hosts] [latency]
+"""
+import sys
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from confab.multiplex import Multiplexer, MultiplexedTransport, ProcessChannel, checksums_all
+from confab.transport import LocalTransport
+
+
+def make_channel_class(latency):
+    class SlowChannel(ProcessChannel):
+        def __init__(self, host, command, stdin=None):
+            super(SlowChannel, self).__init__(host,
+                                              'sleep {}; {}'.format(latency, command),
+                                              stdin)
+    return SlowChannel
+
+
+def make_roots(directory, hosts, files=20):
+    for host in hosts:
+        makedirs(join(directory, host, 'etc'))
+        for index in xrange(files):
+            with open(join(directory, host, 'etc', 'file{}.conf'.format(index)), 'w') as file_:
+                file_.write('host = {}\nindex = {}\n'.format(host, index))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+    hosts = ['host{}'.format(index) for index in xrange(count)]
+    paths = ['/etc/file{}.conf'.format(index) for index in xrange(20)]
+    directory = mkdtemp()
+    try:
+        make_roots(directory, hosts)
+
+        start = default_timer()
+        for host in hosts:
+            LocalTransport(join(directory, host), latency).checksums(paths)
+        serial_time = default_timer() - start
+
+        multiplexer = Multiplexer(make_channel_class(latency))
+        start = default_timer()
+        checksums_all((MultiplexedTransport(host, multiplexer,
+                                            use_sudo=False,
+                                            root=join(directory, host)), paths)
+                      for host in hosts)
+        multiplexed_time = default_timer() - start
+
+        print('{} hosts, {:.0f} ms latency: serial {:.2f}s, multiplexed {:.2f}s'
+              .format(count, latency * 1000, serial_time, multiplexed_time))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmark serial and parallel diffs across hosts.
+
+Each host is simulated by a :class:`confab.transport.LocalTransport` with a
+fixed latency per operation, standing in for SSH round-trips.
+
+Usage: python benchmarks/parallel.py [hosts] [latency] [parallel]
+"""
+import sys
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from timeit import default_timer
+
+from fabric.api import settings
+from mock import patch
+
+from confab.definitions import Settings
+from confab.diff import diff
+from confab.options import Options
+from confab.transport import LocalTransport
+
+
+def make_tree(directory, hosts, files=20):
+    """
+    Create templates and remote roots with one changed file per host.
+    """
+    makedirs(join(directory, 'templates', 'role', 'etc'))
+    makedirs(join(directory, 'data'))
+    for index in xrange(files):
+        with open(join(directory, 'templates', 'role', 'etc', 'file{}.conf'.format(index)),
+                  'w') as file_:
+            file_.write('host = {{ confab.host }}\nindex = %d\n' % index)
+
+    for host in hosts:
+        makedirs(join(directory, 'roots', host, 'etc'))
+        for index in xrange(files):
+            with open(join(directory, 'roots', host, 'etc', 'file{}.conf'.format(index)),
+                      'w') as file_:
+                file_.write('host = {}\nindex = {}\n'.format(host, index if index else 'old'))
+
+
+def measure(directory, settings_, latency, parallel):
+    get_transport = lambda host: LocalTransport(join(directory, 'roots', host), latency)
+    start = default_timer()
+    with settings(environmentdef=settings_.for_env('any')):
+        with Options(get_transport=get_transport, checksum_remotes=True):
+            with patch('sys.stdout'):
+                diff(directory, parallel=parallel)
+    return default_timer() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    parallel = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    hosts = ['host{}'.format(index) for index in xrange(count)]
+    settings_ = Settings.load_from_dict(dict(environmentdefs={'any': hosts},
+                                             roledefs={'role': hosts}))
+    directory = mkdtemp()
+    try:
+        settings_.directory = directory
+        make_tree(directory, hosts)
+
+        serial_time = measure(directory, settings_, latency, 1)
+        parallel_time = measure(directory, settings_, latency, parallel)
+        print('{} hosts, {:.0f} ms latency: serial {:.2f}s, parallel ({}) {:.2f}s'
+              .format(count, latency * 1000, serial_time, parallel, parallel_time))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Remote agent for configuration file operations.
+
+This module is uploaded to a :term:`host` and run there with elevated
+privileges, once per batch of operations (see
+:class:`confab.transport.AgentTransport`). It must therefore be
+self-contained: it only uses the standard library of Python 2.6+ or 3 and
+never imports confab.
+
+The agent reads a JSON manifest from stdin and writes a JSON result to
+stdout. Paths are relative to the working directory (the transport's root).
+The manifest may contain:
+
+``checksums``
+    paths to report as ``[digest, mode, owner]`` (or null for missing files)
+``fetch``
+    paths of files whose base64-encoded contents to return
+``fetch_changed``
+    lists of known digests by path: reports the paths as ``checksums`` and
+    returns the contents of files whose digest is not known, as ``fetch``
+``write``
+    files to write, as objects with ``path``, ``mode`` and either
+    base64-encoded ``content`` or the ``source`` path of an uploaded file,
+    which is removed; missing directories are created, existing owners are
+    kept and each file is replaced atomically
+``compress``
+    whether contents are zlib-compressed before base64 encoding
+"""
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+
+try:
+    import pwd
+except ImportError:
+    pwd = None
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _owner(stat_):
+    try:
+        return pwd.getpwuid(stat_.st_uid).pw_name
+    except (AttributeError, KeyError):
+        return str(stat_.st_uid)
+
+
+def checksum(path):
+    """
+    Return the digest, mode and owner of a file, or None if it is missing.
+    """
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_:
+        for chunk in iter(lambda: file_.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    stat_ = os.stat(path)
+    return [digest.hexdigest(), stat_.st_mode & 4095, _owner(stat_)]
+
+
+def _encode(content, compress):
+    if compress:
+        content = zlib.compress(content)
+    return base64.b64encode(content).decode('ascii')
+
+
+def _decode(content, compress):
+    content = base64.b64decode(content.encode('ascii'))
+    if compress:
+        content = zlib.decompress(content)
+    return content
+
+
+def fetch(path, compress=False):
+    """
+    Return the encoded content of a file, or None if it is missing.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as file_:
+        return _encode(file_.read(), compress)
+
+
+def _replace(path, mode, write_content):
+    """
+    Atomically replace a file with content written by ``write_content`` and
+    the given mode, keeping the owner of an existing file.
+    """
+    directory = os.path.dirname(path) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    handle, tmp_path = tempfile.mkstemp(dir=directory, prefix='.confab-')
+    replaced = False
+    try:
+        with os.fdopen(handle, 'wb') as file_:
+            write_content(file_)
+        os.chmod(tmp_path, mode)
+        if os.path.isfile(path):
+            stat_ = os.stat(path)
+            os.chown(tmp_path, stat_.st_uid, stat_.st_gid)
+        os.rename(tmp_path, path)
+        replaced = True
+    finally:
+        if not replaced:
+            os.remove(tmp_path)
+
+
+def write(path, mode, content):
+    """
+    Atomically replace a file with the given content and mode, keeping the
+    owner of an existing file.
+    """
+    _replace(path, mode, lambda file_: file_.write(content))
+
+
+def move(source, path, mode):
+    """
+    Atomically replace a file with the content of another file, which is
+    removed, as :func:`write`.
+    """
+    try:
+        with open(source, 'rb') as source_file:
+            _replace(path, mode, lambda file_: shutil.copyfileobj(source_file, file_, CHUNK_SIZE))
+    finally:
+        os.remove(source)
+
+
+def run(manifest):
+    """
+    Carry out the operations of a manifest and return the result.
+    """
+    compress = manifest.get('compress', False)
+    result = {}
+    if 'checksums' in manifest:
+        result['checksums'] = dict((path, checksum(path)) for path in manifest['checksums'])
+    if 'fetch' in manifest:
+        result['fetch'] = dict((path, fetch(path, compress)) for path in manifest['fetch'])
+    if 'fetch_changed' in manifest:
+        known_digests = manifest['fetch_changed']
+        result['checksums'] = dict((path, checksum(path)) for path in known_digests)
+        result['fetch'] = dict((path, fetch(path, compress))
+                               for path, state in result['checksums'].items()
+                               if state is not None and state[0] not in known_digests[path])
+    if 'write' in manifest:
+        for entry in manifest['write']:
+            if 'source' in entry:
+                move(entry['source'], entry['path'], entry['mode'])
+            else:
+                write(entry['path'], entry['mode'], _decode(entry['content'], compress))
+        result['written'] = [entry['path'] for entry in manifest['write']]
+    return result
+
+
+def main():
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    manifest = json.loads(stdin.read().decode('utf-8'))
+    json.dump(run(manifest), sys.stdout)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
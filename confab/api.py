@@ -3,7 +3,7 @@ Non-init module for doing convenient * imports from.
 """
 
 # core
-from confab.conffiles import ConfFiles
+from confab.conffiles import ConfFiles, HostConfFiles
 
 # settings
 from confab.definitions import Settings
@@ -17,6 +17,9 @@ from confab.loaders import FileSystemEnvironmentLoader, PackageEnvironmentLoader
 # jinja2 filters
 from confab.jinja_filters import add_jinja_filter, remove_jinja_filter, JinjaFilters
 
+# template dependencies
+from confab.dependencies import TemplateDependencies
+
 # data loading
 from confab.data import DataLoader
 
@@ -27,11 +30,13 @@ from confab.hooks import Hook, add_data_hook, remove_data_hook
 from confab.options import assume_yes, Options
 
 # iterations
-from confab.iter import iter_hosts_and_roles, iter_hosts, iter_conffiles, make_conffiles
+from confab.iter import (iter_hosts_and_roles, iter_hosts, iter_conffiles, iter_host_conffiles,
+                         make_conffiles, make_host_conffiles, make_dependencies)
 
 # fabric tasks
 from confab.diff import diff
 from confab.generate import generate
+from confab.plan import apply, plan
 from confab.pull import pull
 from confab.push import push
 
@@ -39,6 +44,7 @@ __ignore__ = [
     assume_yes,
     generate_tasks,
     ConfFiles,
+    HostConfFiles,
     FileSystemEnvironmentLoader,
     PackageEnvironmentLoader,
     DataLoader,
@@ -47,6 +53,8 @@ __ignore__ = [
     remove_data_hook,
     diff,
     generate,
+    apply,
+    plan,
     pull,
     push,
     Options,
@@ -54,7 +62,11 @@ __ignore__ = [
     iter_hosts_and_roles,
     iter_hosts,
     iter_conffiles,
+    iter_host_conffiles,
     make_conffiles,
+    make_host_conffiles,
+    make_dependencies,
+    TemplateDependencies,
     add_jinja_filter,
     remove_jinja_filter,
     JinjaFilters,
@@ -1,39 +1,115 @@
 """
 Configuration file template object model.
 """
-from os.path import dirname, exists, join
-from hashlib import sha1
+from collections import OrderedDict
+from itertools import chain, islice
+from os.path import dirname, exists, getsize, join
 from warnings import warn
-from fabric.api import get, put, sudo
+from fabric.api import abort
 from fabric.colors import blue, red, green, magenta
-from fabric.contrib.files import exists as exists_remote
 from fabric.contrib.console import confirm
 from gusset.output import debug, status
 
-from confab.files import _clear_dir, _clear_file, _ensure_dir
+from confab.dedup import deduplicator
+from confab.fileindex import file_index
+from confab.files import (_atomic_replace, _clear_dir, _clear_file, _copy_file, _ensure_dir,
+                          _files_equal, _get_umask, _hash_file, _is_archived, _prune_dirs,
+                          _read_lines, _sniff_binary)
 from confab.options import options
+from confab.rendercache import render_cache
 from confab.validate import assert_may_be_created
 from confab.jinja_filters import jinja_filters
+from confab.manifest import (get_manifest_file, list_manifest_roles, load_manifest,
+                             save_manifest, make_entry, matches_entry)
+from confab.remotestate import (get_remote_state_file, load_remote_state, save_remote_state,
+                                make_remote_entry, is_cached)
+from confab.transport import AgentTransport
 
 import os
 import shutil
 
 
+# Compiled code for templated file names, per name and compile settings.
+_name_code = {}
+
+
+def _compile_settings(environment):
+    """
+    Return the settings of a Jinja environment that compiled code depends on.
+
+    Environments are created per host and role; those with the same settings
+    can share compiled names.
+    """
+    return (environment.block_start_string,
+            environment.block_end_string,
+            environment.variable_start_string,
+            environment.variable_end_string,
+            environment.comment_start_string,
+            environment.comment_end_string,
+            environment.line_statement_prefix,
+            environment.line_comment_prefix,
+            environment.trim_blocks,
+            environment.lstrip_blocks,
+            environment.newline_sequence,
+            environment.keep_trailing_newline,
+            environment.optimized,
+            environment.autoescape,
+            environment.finalize is not None,
+            frozenset(environment.extensions),
+            frozenset(environment.filters),
+            frozenset(environment.tests))
+
+
+def _render_name(template, data):
+    """
+    Render the (possibly templated) name of a template.
+
+    Names without template syntax are returned as is; other names are
+    compiled once for all environments with the same settings, and rendered
+    with the template's own environment.
+    """
+    environment = template.environment
+    delimiters = (environment.variable_start_string,
+                  environment.block_start_string,
+                  environment.comment_start_string)
+    if not any(delimiter in template.name for delimiter in delimiters):
+        return unicode(template.name)
+
+    key = (template.name, _compile_settings(environment))
+    code = _name_code.get(key)
+    if code is None:
+        code = _name_code[key] = environment.compile(template.name)
+    name_template = environment.template_class.from_code(environment, code,
+                                                         environment.make_globals(None))
+    return name_template.render(**data)
+
+
 class ConfFileDiff(object):
     """
     Encapsulation of the differences between the (locally copied) remote and
     generated versions of a configuration file.
+
+    Whether the files differ is decided from their sizes and digests; diff
+    lines are only computed when shown, and binary files are compared by
+    digest only.
     """
 
-    def __init__(self, remote_file_name, generated_file_name, conffile_name):
+    def __init__(self, remote_file_name, generated_file_name, conffile_name,
+                 generated_digest=None, binary=False):
         """
         Compute whether the conffile with the given name has changed given
         a remote and generate file copy.
+
+        If known, ``generated_digest`` saves hashing the generated file.
         """
         self.missing_generated = False
         self.missing_remote = False
+        self.changed = False
+        self.binary = binary
         self.conffile_name = conffile_name
-        self.diff_lines = []
+        self.remote_file_name = remote_file_name
+        self.generated_file_name = generated_file_name
+        self._diff_lines = None
 
         if not exists(generated_file_name):
             self.missing_generated = True
@@ -42,30 +118,64 @@ class ConfFileDiff(object):
             self.missing_remote = True
 
         if not self.missing_generated and not self.missing_remote:
-            diff_iter = options.diff(open(remote_file_name).readlines(),
-                                     open(generated_file_name).readlines(),
-                                     fromfile='{file_name} (remote)'.format(file_name=conffile_name),
-                                     tofile='{file_name} (generated)'.format(file_name=conffile_name))
+            self.changed = not _same_content(remote_file_name,
+                                             generated_file_name,
+                                             generated_digest)
+            if self.changed and not self.binary:
+                self.binary = _sniff_binary(remote_file_name) or _sniff_binary(generated_file_name)
 
-            # unified_diff returns a generator
-            self.diff_lines = list(diff_iter)
+    def iter_diff_lines(self):
+        """
+        Generate the lines of the diff between the remote and generated files.
+        """
+        if not self.changed or self.binary:
+            return iter([])
+        return options.diff(_read_lines(self.remote_file_name),
+                            _read_lines(self.generated_file_name),
+                            fromfile='{file_name} (remote)'.format(file_name=self.conffile_name),
+                            tofile='{file_name} (generated)'.format(file_name=self.conffile_name))
+
+    @property
+    def diff_lines(self):
+        """
+        The diff lines, up to ``options.max_diff_lines``; computed once.
+        """
+        if self._diff_lines is None:
+            self._diff_lines = list(islice(self.iter_diff_lines(), options.max_diff_lines))
+        return self._diff_lines
 
     def show(self):
         """
         Print the diff using pretty colors.
 
-        If confab is used on binary files, diffs are likely to render poorly.
+        At most ``options.max_diff_lines`` lines are shown, followed by a summary
+        of the rest.
         """
         if self.missing_generated:
             if not self.missing_remote:
                 print(red('Only in remote: {file_name}'.format(file_name=self.conffile_name)))
         elif self.missing_remote:
             print(blue(('Only in generated: {file_name}'.format(file_name=self.conffile_name))))
+        elif self.changed and self.binary:
+            print(magenta('Binary files differ: {file_name}'.format(file_name=self.conffile_name)))
         else:
-            for diff_line in self.diff_lines:
+            diff_iter = self.iter_diff_lines()
+            for diff_line in islice(diff_iter, options.max_diff_lines):
                 color = red if diff_line.startswith('-') else blue if diff_line.startswith('+') else green
+                if isinstance(diff_line, unicode):
+                    diff_line = diff_line.encode('utf-8')
                 print(color(diff_line.strip()))
 
+            removed = added = 0
+            for diff_line in diff_iter:
+                if diff_line.startswith('-'):
+                    removed += 1
+                elif diff_line.startswith('+'):
+                    added += 1
+            if removed or added:
+                print(magenta('... diff truncated; {removed} more lines removed '
+                              'and {added} added'.format(removed=removed, added=added)))
+
     def __nonzero__(self):
         """
         Evaluate to ``True`` if there is a diff.
@@ -75,7 +185,102 @@ class ConfFileDiff(object):
         elif self.missing_remote:
             return True
         else:
-            return len(self.diff_lines)
+            return self.changed
+
+
+def _same_content(remote_file_name, generated_file_name, generated_digest=None):
+    """
+    Return whether two files have the same content, comparing sizes first.
+
+    With a known digest, only the remote file is read; otherwise, the files
+    are compared chunk by chunk.
+    """
+    if generated_digest is None:
+        return _files_equal(remote_file_name, generated_file_name)
+    if os.path.getsize(remote_file_name) != os.path.getsize(generated_file_name):
+        return False
+    return _hash_file(remote_file_name) == generated_digest
+
+
+def _should_push_delta(generated_file_name):
+    """
+    Return whether a generated file is large enough to push as a block delta.
+    """
+    return (options.delta_threshold is not None and
+            getsize(generated_file_name) >= options.delta_threshold)
+
+
+def _remove_generated(host_generated_dir, name, entry):
+    """
+    Remove a file that is no longer generated, and the directories it leaves
+    empty, unless it changed since its manifest entry was made.
+    """
+    generated_file_name = join(host_generated_dir, name)
+    # another role may have generated the same file since
+    if matches_entry(generated_file_name, entry):
+        status('Removing {file_name}', file_name=os.sep + name)
+        _clear_file(generated_file_name)
+        _prune_dirs(dirname(generated_file_name), host_generated_dir)
+
+
+def prepare_generated_dir(directory, host, roles):
+    """
+    Prepare the generated directory of a host for generating the
+    configuration files of its roles, once per run.
+
+    If no role of the host has a manifest (e.g. the files were generated by
+    an older version), the directory is cleared and empty manifests are
+    saved, so that roles generated concurrently do not clear it again.
+    Otherwise, the files last generated for roles that the host no longer
+    has are removed, along with their manifests.
+
+    :param directory: base path of the generated and cache directories
+    """
+    host_generated_dir = join(directory, options.get_generated_dir(), host)
+    saved_roles = list_manifest_roles(directory, host)
+
+    if not saved_roles:
+        _clear_dir(host_generated_dir)
+        for role in roles:
+            save_manifest(get_manifest_file(directory, host, role), {})
+        return
+
+    # files also generated by a current role are left to that role
+    current = set()
+    for role in set(saved_roles).intersection(roles):
+        current.update(load_manifest(get_manifest_file(directory, host, role)))
+
+    for role in sorted(set(saved_roles).difference(roles)):
+        manifest_file = get_manifest_file(directory, host, role)
+        for name, entry in sorted(load_manifest(manifest_file).iteritems()):
+            if name not in current:
+                _remove_generated(host_generated_dir, name, entry)
+        _clear_file(manifest_file)
+
+
+def _make_transport(host):
+    """
+    Return a transport to a host, using the remote agent if enabled.
+    """
+    transport = options.get_transport(host)
+    return AgentTransport(transport) if options.use_agent else transport
+
+
+def _push_files(transport, files):
+    """
+    Push local files to their remote paths: large files that exist remotely
+    as block deltas and the rest as a single archive.
+
+    :param files: ``(local_path, remote_path)`` pairs
+    """
+    remaining = []
+    for local_file_name, remote_file_name in files:
+        if not (_should_push_delta(local_file_name) and
+                transport.push_delta(local_file_name,
+                                     remote_file_name,
+                                     options.delta_block_size)):
+            remaining.append((local_file_name, remote_file_name))
+    transport.push(remaining, options.compress_transfers)
 
 
 class ConfFile(object):
@@ -90,24 +295,66 @@ class ConfFile(object):
         self.role = component.role
         self.component = component.name
         self.environment = component.environment
-        self.mime_type = options.get_mime_type(template.filename)
-        self.name = template.environment.from_string(template.name).render(**self.data)
+        self.mime_type = file_index.mime_type(template.filename)
+        self.name = _render_name(template, self.data)
         self.remote = os.sep + self.name
+        self._rendered = None
+        self._verbatim_digest = None
+
+    def render(self):
+        """
+        Return the rendered content of the configuration file as bytes.
+
+        Content is rendered at most once while it remains in the run's
+        :data:`~confab.rendercache.render_cache`.
+        """
+        return self._render().read()
+
+    def _render(self):
+        """
+        Return the rendered content, rendering it again if it was evicted.
+
+        The content returned stays readable even if another thread evicts it
+        from the cache meanwhile.
+        """
+        while True:
+            if self._rendered is not None:
+                rendered = render_cache.get(self._rendered)
+                if rendered is not None:
+                    return rendered
+
+            self.close()
+            if options.dedup_renders:
+                rendered = deduplicator.render(self.template, self.data, self._render_new)
+            else:
+                rendered = self._render_new()
+            self._rendered = render_cache.acquire(rendered)
+
+    def close(self):
+        """
+        Release the rendered content, deleting it if no other conffile uses it.
+        """
+        if self._rendered is not None:
+            render_cache.release(self._rendered)
+            self._rendered = None
+
+    def _render_new(self):
+        return render_cache.add_stream(chain(self.template.generate(**self.data), [u'\n']))
 
     def _write_verbatim(self, generated_file_name):
         """
         Write the configuration file without templating.
         """
-        shutil.copy2(self.template.filename, generated_file_name)
+        _copy_file(self.template.filename, generated_file_name)
+        if not _is_archived(self.template.filename):
+            shutil.copystat(self.template.filename, generated_file_name)
 
     def _write_template(self, generated_file_name):
         """
         Write the configuration file as a template.
         """
-        with open(generated_file_name, 'w') as generated_file:
-            rendered = self.template.render(**self.data).encode('utf-8')
-            generated_file.write(rendered)
-            generated_file.write(u'\n')
+        self._render().write_to(generated_file_name)
+        if not _is_archived(self.template.filename):
             shutil.copystat(self.template.filename, generated_file_name)
 
     def diff(self, generated_dir, remotes_dir, output=False):
@@ -124,7 +371,11 @@ class ConfFile(object):
 
         status('Computing diff for {file_name}', file_name=self.remote)
 
-        return ConfFileDiff(remote_file_name, generated_file_name, self.remote)
+        return ConfFileDiff(remote_file_name,
+                            generated_file_name,
+                            self.remote,
+                            generated_digest=self.hexdigest(),
+                            binary=not self.should_render() and not self.is_empty())
 
     def should_render(self):
         return options.should_render(self.mime_type)
@@ -134,33 +385,62 @@ class ConfFile(object):
 
     def hexdigest(self):
         """
-        Return a hex digest of conffile content.
+        Return a hex digest of conffile content, as generated.
         """
         if self.should_render():
-            content = self.template.render(**self.data).encode('utf-8')
-        else:
-            with open(self.template.filename) as file_:
-                content = file_.read()
-        return sha1(content).hexdigest()
+            if self._rendered is None:
+                self._render()
+            return self._rendered.digest
 
-    def generate(self, directory):
+        if self._verbatim_digest is None:
+            self._verbatim_digest = _hash_file(self.template.filename)
+        return self._verbatim_digest
+
+    def generate(self, directory, previous=None):
         """
         Write the configuration file.
+
+        If ``previous`` (the manifest entry returned by an earlier call) shows
+        that the generated file is unchanged, it is left untouched. Otherwise
+        the file is replaced atomically.
+
+        Returns the manifest entry for the generated file.
         """
         generated_file_name = join(directory, self.name)
         assert_may_be_created(generated_file_name)
 
-        status('Generating {file_name}', file_name=self.remote)
-
         # ensure that destination directory exists
         _ensure_dir(directory)
 
-        if self.should_render():
-            self._write_template(generated_file_name)
-        else:
-            self._write_verbatim(generated_file_name)
+        digest = self.hexdigest()
+        if (previous is not None and previous['digest'] == digest and
+                matches_entry(generated_file_name, previous)):
+            debug('Unchanged {}'.format(self.remote))
+            mode = self._template_mode()
+            if mode != previous['mode']:
+                os.chmod(generated_file_name, mode)
+                return make_entry(generated_file_name, digest)
+            return previous
+
+        status('Generating {file_name}', file_name=self.remote)
+
+        with _atomic_replace(generated_file_name) as tmp_file_name:
+            if self.should_render():
+                self._write_template(tmp_file_name)
+            else:
+                self._write_verbatim(tmp_file_name)
 
-    def pull(self, directory):
+        return make_entry(generated_file_name, digest)
+
+    def _template_mode(self):
+        """
+        Return the mode that a generated file takes from its template.
+        """
+        if _is_archived(self.template.filename):
+            return 0666 & ~_get_umask()
+        return os.stat(self.template.filename).st_mode & 07777
+
+    def pull(self, directory, transport=None):
         """
         Pull remote configuration file to local file.
         """
@@ -171,33 +451,28 @@ class ConfFile(object):
                file_name=self.remote,
                host=self.host)
 
-        _ensure_dir(directory)
+        transport = transport or options.get_transport(self.host)
+
         _clear_file(local_file_name)
 
-        if exists_remote(self.remote, use_sudo=True):
-            get(self.remote, local_file_name)
-        else:
+        if not transport.fetch([self.remote], directory):
             status('Not found: {file_name}',
                    file_name=self.remote)
 
-    def push(self, directory):
+    def push(self, directory, transport=None):
         """
         Push the generated configuration file to the remote host.
         """
         generated_file_name = join(directory, self.name)
         assert_may_be_created(generated_file_name)
-        remote_dir = dirname(self.remote)
 
         status('Pushing {file_name} to {host}',
                file_name=self.remote,
                host=self.host)
 
-        sudo('mkdir -p {dir_name}'.format(dir_name=remote_dir))
+        transport = transport or options.get_transport(self.host)
 
-        put(generated_file_name,
-            self.remote,
-            use_sudo=True,
-            mirror_local_mode=True)
+        _push_files(transport, [(generated_file_name, self.remote)])
 
 
 class ConfFiles(object):
@@ -207,8 +482,8 @@ class ConfFiles(object):
 
     def __init__(self,
                  host_and_role,
-                 environment_loader,
-                 data_loader):
+                 environment_loader=None,
+                 data_loader=None):
         """
         A set of templated configuration files.
 
@@ -222,9 +497,12 @@ class ConfFiles(object):
         underlying loader that supports :meth:`jinja2.Environment.list_templates`.
         On init, ``ConfFiles`` will load all :term:`templates<template>` in the
         :term:`environment` for the specified :term:`host` and :term:`role`
-        (including any role components).
+        (including any role components). Without an environment loader, no
+        templates are loaded (see :class:`HostConfFiles`).
         """
         self.conffiles = []
+        self.remote_files = {}
+        self.host_and_role = host_and_role
         self.host = host_and_role.host
         self.role = host_and_role.role
         self.environment = host_and_role.environment
@@ -232,6 +510,15 @@ class ConfFiles(object):
         # default base path for generated and remotes directories
         self.directory = host_and_role.environmentdef.directory or os.getcwd()
 
+        self._transport = None
+
+        if environment_loader is not None:
+            self._load_templates(host_and_role, environment_loader, data_loader)
+
+    def _load_templates(self, host_and_role, environment_loader, data_loader):
+        """
+        Add the templates of the host and role's components.
+        """
         for component in host_and_role.components():
             debug("Processing: {}".format(component.name))
 
@@ -252,6 +539,16 @@ class ConfFiles(object):
                          host=self.host,
                          environment=self.environment))
 
+    def affected_by(self, dependencies, component, template_names):
+        """
+        Return the conffiles affected by changes to templates of a component.
+
+        :param dependencies: a :class:`confab.dependencies.TemplateDependencies` graph
+        """
+        affected = dependencies.dependents(component, template_names)
+        return [conffile for conffile in self.conffiles
+                if conffile.component == component and conffile.template.name in affected]
+
     def _get_host_generated_dir(self, directory):
         return join(directory or self.directory,
                     options.get_generated_dir(),
@@ -262,39 +559,184 @@ class ConfFiles(object):
                     options.get_remotes_dir(),
                     self.host)
 
-    def generate(self, directory=None):
+    def generate(self, directory=None, exclude=()):
         """
         Write all configuration files to ``generated_dir``.
+
+        Only files whose content or metadata changed since the last run are
+        written; files that are no longer generated are removed. If no role
+        of the host has a manifest yet, the host's directory is cleared
+        first, as before manifests existed.
+
+        Files named in ``exclude`` are left to another role of the host.
         """
         host_generated_dir = self._get_host_generated_dir(directory)
+        manifest_file = get_manifest_file(directory or self.directory, self.host, self.role)
 
-        _clear_dir(host_generated_dir)
+        if not list_manifest_roles(directory or self.directory, self.host):
+            _clear_dir(host_generated_dir)
         _ensure_dir(host_generated_dir)
 
+        previous = load_manifest(manifest_file)
+        manifest = {}
         for conffile in self.conffiles:
-            conffile.generate(host_generated_dir)
+            if conffile.name in exclude:
+                continue
+            manifest[conffile.name] = conffile.generate(host_generated_dir,
+                                                        previous.get(conffile.name))
+
+        for name in sorted(set(previous) - set(manifest) - set(exclude)):
+            _remove_generated(host_generated_dir, name, previous[name])
+
+        save_manifest(manifest_file, manifest)
+
+    def _get_transport(self):
+        if self._transport is None:
+            self._transport = _make_transport(self.host)
+        return self._transport
+
+    def close(self):
+        """
+        Release the rendered content of the configuration files and the
+        transport to the host, if any.
+        """
+        for conffile in self.conffiles:
+            conffile.close()
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    def _clear_remotes(self, host_remotes_dir):
+        for conffile in self.conffiles:
+            local_file_name = join(host_remotes_dir, conffile.name)
+            assert_may_be_created(local_file_name)
+            _clear_file(local_file_name)
+
+    def _fetch(self, conffiles, host_remotes_dir):
+        """
+        Fetch the remote versions of conffiles with a single transfer.
+        """
+        if not conffiles:
+            return
+
+        status('Pulling {count} file(s) from {host}',
+               count=len(conffiles),
+               host=self.host)
+
+        fetched = self._get_transport().fetch([conffile.remote for conffile in conffiles],
+                                              host_remotes_dir,
+                                              options.compress_transfers)
+        for conffile in conffiles:
+            if conffile.remote not in fetched:
+                status('Not found: {file_name}',
+                       file_name=conffile.remote)
 
     def pull(self, directory=None):
         """
         Pull remote versions of files into ``remotes_dir``.
+
+        All files are fetched with a single transfer; files that are missing
+        remotely have no local copy.
         """
         host_remotes_dir = self._get_host_remotes_dir(directory)
 
-        for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
-
-    def diff(self, directory=None):
+        self._clear_remotes(host_remotes_dir)
+        self._fetch(self.conffiles, host_remotes_dir)
+
+        if options.cache_remotes:
+            remote_state_file = get_remote_state_file(directory or self.directory, self.host)
+            remote_state = load_remote_state(remote_state_file)
+            for conffile in self.conffiles:
+                local_file_name = join(host_remotes_dir, conffile.name)
+                if exists(local_file_name):
+                    remote_state[conffile.remote] = make_remote_entry(local_file_name)
+                else:
+                    remote_state.pop(conffile.remote, None)
+            save_remote_state(remote_state_file, remote_state)
+
+    def pull_changed(self, directory=None):
         """
-        Show diffs for all configuration files.
+        Pull remote versions of files into ``remotes_dir``, fetching only the
+        files whose remote checksums differ from the generated files.
+
+        Remote files that match their generated versions are copied from
+        ``generated_dir``. Unless ``options.cache_remotes`` is disabled, local
+        copies that match the remote state recorded by a previous run (or
+        :meth:`pull`) are kept as well.
+        The state of each remote file (digest, mode and owner) is kept in
+        :attr:`remote_files`.
         """
         host_generated_dir = self._get_host_generated_dir(directory)
         host_remotes_dir = self._get_host_remotes_dir(directory)
+        remote_state_file = get_remote_state_file(directory or self.directory, self.host)
+        remote_state = load_remote_state(remote_state_file) if options.cache_remotes else {}
 
+        # remote files need not be fetched if they match their generated
+        # version or an unmodified local copy from a previous run
+        known_digests = OrderedDict()
         for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
+            local_file_name = join(host_remotes_dir, conffile.name)
+            assert_may_be_created(local_file_name)
+            known_digests[conffile.remote] = [conffile.hexdigest()]
+            entry = remote_state.get(conffile.remote)
+            if entry is not None and matches_entry(local_file_name, entry):
+                known_digests[conffile.remote].append(entry['digest'])
+
+        status('Checksumming remote files on {host}', host=self.host)
+        self.remote_files, fetched = self._get_transport().fetch_changed(
+            known_digests, host_remotes_dir, options.compress_transfers)
 
         for conffile in self.conffiles:
-            conffile.generate(host_generated_dir)
+            remote_file = self.remote_files[conffile.remote]
+            local_file_name = join(host_remotes_dir, conffile.name)
+            if conffile.remote in fetched:
+                debug('Pulled: {}'.format(conffile.remote))
+                remote_state[conffile.remote] = make_remote_entry(local_file_name, remote_file)
+                continue
+            if is_cached(local_file_name, remote_state.get(conffile.remote), remote_file):
+                debug('Cached: {}'.format(conffile.remote))
+                remote_state[conffile.remote].update(mode=remote_file.mode,
+                                                     owner=remote_file.owner)
+                continue
+
+            _clear_file(local_file_name)
+            remote_state.pop(conffile.remote, None)
+
+            if remote_file is not None and remote_file.digest == conffile.hexdigest():
+                debug('Unchanged: {}'.format(conffile.remote))
+                _ensure_dir(dirname(local_file_name))
+                _copy_file(join(host_generated_dir, conffile.name), local_file_name)
+                remote_state[conffile.remote] = make_remote_entry(local_file_name, remote_file)
+            else:
+                status('Not found: {file_name}',
+                       file_name=conffile.remote)
+
+        if options.cache_remotes:
+            save_remote_state(remote_state_file, remote_state)
+
+    def pull_remotes(self, directory=None):
+        """
+        Pull the remote files needed to compare against generated files.
+        """
+        if options.checksum_remotes:
+            self.pull_changed(directory)
+        else:
+            self.pull(directory)
+
+    def diff(self, directory=None):
+        """
+        Show diffs for all configuration files.
+        """
+        self.generate(directory)
+        self.pull_remotes(directory)
+        self.show_diffs(directory)
+
+    def show_diffs(self, directory=None):
+        """
+        Show diffs between generated and pulled remote files.
+        """
+        host_generated_dir = self._get_host_generated_dir(directory)
+        host_remotes_dir = self._get_host_remotes_dir(directory)
 
         for conffile in self.conffiles:
             conffile.diff(host_generated_dir, host_remotes_dir).show()
@@ -303,15 +745,18 @@ class ConfFiles(object):
         """
         Push configuration files that have changes, given user confirmation.
         """
+        self.generate(directory)
+        self.pull_remotes(directory)
+        self.push_diffs(directory)
+
+    def push_diffs(self, directory=None):
+        """
+        Push generated files that differ from pulled remote files, given user
+        confirmation.
+        """
         host_generated_dir = self._get_host_generated_dir(directory)
         host_remotes_dir = self._get_host_remotes_dir(directory)
 
-        for conffile in self.conffiles:
-            conffile.pull(host_remotes_dir)
-
-        for conffile in self.conffiles:
-            conffile.generate(host_generated_dir)
-
         has_diff = lambda conffile: conffile.diff(host_generated_dir, host_remotes_dir, True)
         with_diffs = filter(has_diff, self.conffiles)
 
@@ -330,4 +775,139 @@ class ConfFiles(object):
                                          .format(host=self.host),
                                          default=False):
             for conffile in with_diffs:
-                conffile.push(host_generated_dir)
+                generated_file_name = join(host_generated_dir, conffile.name)
+                assert_may_be_created(generated_file_name)
+                status('Pushing {file_name} to {host}',
+                       file_name=conffile.remote,
+                       host=self.host)
+
+            files = [(join(host_generated_dir, conffile.name), conffile.remote)
+                     for conffile in with_diffs]
+            _push_files(self._get_transport(), files)
+
+    def plan(self, directory=None):
+        """
+        Return the changes that pushing would make, as a list of dictionaries
+        with the remote path, name, generated and remote digests (None for
+        missing remote files) and diff lines of each file to push.
+
+        Remote files must have been pulled.
+        """
+        host_generated_dir = self._get_host_generated_dir(directory)
+        host_remotes_dir = self._get_host_remotes_dir(directory)
+
+        changes = []
+        for conffile in self.conffiles:
+            diff = conffile.diff(host_generated_dir, host_remotes_dir)
+            if not diff or diff.missing_generated:
+                continue
+
+            remote_file_name = join(host_remotes_dir, conffile.name)
+            if conffile.remote in self.remote_files:
+                remote_file = self.remote_files[conffile.remote]
+                remote_digest = remote_file.digest if remote_file is not None else None
+            else:
+                remote_digest = _hash_file(remote_file_name) if exists(remote_file_name) else None
+
+            changes.append(dict(remote=conffile.remote,
+                                name=conffile.name,
+                                generated_digest=conffile.hexdigest(),
+                                remote_digest=remote_digest,
+                                binary=diff.binary,
+                                diff=diff.diff_lines))
+        return changes
+
+
+class HostConfFiles(ConfFiles):
+    """
+    Encapsulation of the configuration files of all :term:`roles<role>` of a
+    :term:`host`.
+
+    Remote files are pulled and pushed (after a single confirmation) for the
+    host as a whole, rather than once per role. A file generated by more than
+    one role is generated, diffed and planned from the first of them; it must
+    be generated identically by all of them to be pushed.
+    """
+
+    def __init__(self, conffiles_by_role):
+        """
+        Combine the configuration files of a host's roles.
+
+        :param conffiles_by_role: :class:`ConfFiles` for each role of the same host
+        """
+        super(HostConfFiles, self).__init__(conffiles_by_role[0].host_and_role)
+
+        self.conffiles_by_role = conffiles_by_role
+        self.role = ', '.join(conffiles.role for conffiles in conffiles_by_role)
+        self.duplicates = []
+
+        conffiles_by_name = {}
+        for conffiles in conffiles_by_role:
+            for conffile in conffiles.conffiles:
+                if conffile.name in conffiles_by_name:
+                    self.duplicates.append((conffiles_by_name[conffile.name], conffile))
+                    continue
+                conffiles_by_name[conffile.name] = conffile
+                self.conffiles.append(conffile)
+
+    def check_duplicates(self, fatal=True):
+        """
+        Abort (or only warn, unless ``fatal``) if roles generate the same
+        file with different content.
+        """
+        for conffile, duplicate in self.duplicates:
+            if conffile.hexdigest() != duplicate.hexdigest():
+                message = ("'{file_name}' is generated differently for roles '{role}' and "
+                           "'{other}' on '{host}'".format(file_name=conffile.remote,
+                                                          role=conffile.role,
+                                                          other=duplicate.role,
+                                                          host=self.host))
+                if fatal:
+                    abort(message)
+                warn("{message}; using the file of role '{role}'".format(message=message,
+                                                                         role=conffile.role))
+                continue
+            debug('Generated identically for roles {} and {}: {}'
+                  .format(conffile.role, duplicate.role, conffile.remote))
+
+    def generate(self, directory=None):
+        """
+        Write the configuration files of all roles to ``generated_dir``; the
+        first role that generates a file writes it.
+        """
+        prepare_generated_dir(directory or self.directory,
+                              self.host,
+                              [conffiles.role for conffiles in self.conffiles_by_role])
+        generated = set()
+        for conffiles in self.conffiles_by_role:
+            conffiles.generate(directory, generated)
+            generated.update(conffile.name for conffile in conffiles.conffiles)
+
+    def show_diffs(self, directory=None):
+        """
+        Show diffs between generated and pulled remote files, warning about
+        files that roles generate differently.
+        """
+        self.check_duplicates(fatal=False)
+        super(HostConfFiles, self).show_diffs(directory)
+
+    def push_diffs(self, directory=None):
+        """
+        Push generated files that differ from pulled remote files, given user
+        confirmation; aborts if roles generate a file differently.
+        """
+        self.check_duplicates()
+        super(HostConfFiles, self).push_diffs(directory)
+
+    def plan(self, directory=None):
+        """
+        Return the changes that pushing would make (see
+        :meth:`ConfFiles.plan`); aborts if roles generate a file differently.
+        """
+        self.check_duplicates()
+        return super(HostConfFiles, self).plan(directory)
+
+    def close(self):
+        for conffiles in self.conffiles_by_role:
+            conffiles.close()
+        super(HostConfFiles, self).close()
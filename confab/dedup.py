@@ -0,0 +1,224 @@
+"""
+Render deduplication across hosts.
+
+Many templates only read data that is the same on every host of a role, so
+they render identically on each of those hosts. Each template's data reads
+are determined from its AST (and those of the templates it includes, imports
+or extends) as a set of paths such as ``('confab', ('attr', 'role'))``. When a
+host's values for all of these paths match those of an earlier render, the
+earlier output is reused.
+
+The paths cover every branch of a template, so reuse remains correct when
+the data that a template reads depends on the data itself. Templates whose
+references cannot be determined statically (dynamic includes) or whose data
+contains values other than plain Python data are always rendered. Custom
+filters and functions must not read the template context directly.
+
+The deduplicator is shared by the threads of :func:`confab.pipeline.pipeline`;
+its tables and counters are guarded by a lock, which is not held while
+rendering.
+"""
+from hashlib import sha1
+from threading import RLock
+
+from jinja2 import meta, nodes
+from gusset.output import debug
+
+from confab.rendercache import render_cache
+
+
+# Signature for paths that are not present in the data.
+MISSING = ('missing',)
+
+
+class Untrackable(Exception):
+    """
+    Raised when data cannot be compared between renders.
+    """
+    pass
+
+
+def _chain(node):
+    """
+    Return the data path for a chain of constant attribute and item lookups
+    on a variable, or None if node is not such a chain.
+    """
+    elements = []
+    while True:
+        if isinstance(node, nodes.Getattr):
+            elements.append(('attr', node.attr))
+        elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+            elements.append(('item', node.arg.value))
+        else:
+            break
+        node = node.node
+
+    if isinstance(node, nodes.Name) and node.ctx == 'load':
+        return (node.name,) + tuple(reversed(elements))
+    return None
+
+
+def find_paths(ast):
+    """
+    Return the data paths read by a template AST.
+
+    Variables used other than through constant lookups are read as a whole.
+    """
+    paths = set()
+
+    def visit(node):
+        path = _chain(node)
+        if path is not None:
+            paths.add(path)
+            return
+        if isinstance(node, nodes.Name) and node.ctx == 'load':
+            paths.add((node.name,))
+            return
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    visit(ast)
+    return paths
+
+
+def _signature(value):
+    """
+    Return a comparable signature for plain Python data.
+    """
+    if isinstance(value, dict):
+        return ('dict', tuple(sorted((key, _signature(item)) for key, item in value.iteritems())))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, tuple(_signature(item) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return (type(value).__name__, tuple(sorted(_signature(item) for item in value)))
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return (type(value).__name__, value)
+    raise Untrackable(type(value).__name__)
+
+
+def _value_signature(data, path):
+    """
+    Return the signature of the data read through a path.
+
+    Lookups follow Jinja's semantics: attribute lookups prefer attributes of
+    the value, so a path stops at values that are not dictionaries or that
+    have an attribute of the looked-up name; such values are read as a whole.
+    """
+    if path[0] not in data:
+        return MISSING
+
+    value = data[path[0]]
+    for kind, key in path[1:]:
+        if not isinstance(value, dict):
+            break
+        if kind == 'attr' and hasattr(value, key):
+            break
+        try:
+            if key in value:
+                value = value[key]
+                continue
+        except TypeError:
+            break  # unhashable key
+        if isinstance(key, basestring) and hasattr(value, key):
+            break
+        return MISSING
+    return _signature(value)
+
+
+class RenderDeduplicator(object):
+    """
+    Reuses rendered content between renders with the same data reads.
+    """
+    def __init__(self):
+        self._paths = {}
+        self._rendered = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = RLock()
+
+    def _find_template_paths(self, environment, template_name, seen):
+        """
+        Return the data paths of a template and the templates it references,
+        or None if its references cannot be determined.
+        """
+        if template_name in seen:
+            return set()
+        seen.add(template_name)
+
+        source, _, _ = environment.loader.get_source(environment, template_name)
+        ast = environment.parse(source, template_name)
+
+        paths = find_paths(ast)
+        for referenced in meta.find_referenced_templates(ast):
+            if referenced is None:
+                return None
+            referenced_paths = self._find_template_paths(environment, referenced, seen)
+            if referenced_paths is None:
+                return None
+            paths.update(referenced_paths)
+        return paths
+
+    def get_paths(self, template):
+        """
+        Return the sorted data paths read by a template, or None.
+        """
+        with self._lock:
+            if template.filename in self._paths:
+                return self._paths[template.filename]
+
+        paths = self._find_template_paths(template.environment, template.name, set())
+        paths = sorted(paths) if paths is not None else None
+        debug("Template {} reads: {}".format(template.name, paths))
+        with self._lock:
+            return self._paths.setdefault(template.filename, paths)
+
+    def render(self, template, data, render_func):
+        """
+        Return rendered content for template and data, calling ``render_func``
+        only if no earlier render read the same values.
+
+        ``render_func`` must return a :class:`~confab.rendercache.Rendered`.
+        """
+        paths = self.get_paths(template)
+        if paths is None:
+            self._count_miss()
+            return render_func()
+
+        try:
+            signature = tuple(_value_signature(data, path) for path in paths)
+        except Untrackable as e:
+            debug("Not deduplicating {}: untrackable {}".format(template.name, e))
+            self._count_miss()
+            return render_func()
+
+        key = (template.filename, sha1(repr(signature)).digest())
+        with self._lock:
+            rendered = self._rendered.get(key)
+            if rendered is not None and rendered.is_available():
+                self.hits += 1
+                render_cache.touch(rendered)
+                return rendered
+            self.misses += 1
+
+        rendered = render_func()
+        with self._lock:
+            self._rendered[key] = rendered
+        return rendered
+
+    def _count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._rendered.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+deduplicator = RenderDeduplicator()
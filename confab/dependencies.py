@@ -0,0 +1,113 @@
+"""
+Dependencies between templates.
+
+Templates may pull in other templates via ``include``, ``import`` and
+``extends``; these are often internal (``_``-prefixed) templates that are
+never generated themselves. The dependency graph records these references
+per :term:`component` so that tooling can determine which generated
+configuration files are affected by a change to any template.
+"""
+import json
+from os.path import dirname, join
+
+from jinja2 import meta
+from gusset.output import debug
+
+from confab.files import _ensure_dir
+from confab.options import options
+
+# Reference recorded for templates whose name is computed at render time;
+# such templates may depend on any template of their component.
+DYNAMIC = None
+
+
+def get_dependencies_file(directory=None):
+    """
+    Return the path to the persisted dependency graph.
+    """
+    return join(directory or options.get_base_dir(),
+                options.get_cache_dir(),
+                'dependencies.json')
+
+
+class TemplateDependencies(object):
+    """
+    Graph of references between templates, by component.
+    """
+
+    def __init__(self, dependencies=None):
+        # {component: {template: [referenced template or DYNAMIC, ...]}}
+        self.dependencies = dependencies or {}
+
+    def add_environment(self, component, environment):
+        """
+        Record the references of every template in a component's environment,
+        including internal templates.
+        """
+        references = self.dependencies[component] = {}
+        for template_name in environment.list_templates():
+            source, _, _ = environment.loader.get_source(environment, template_name)
+            ast = environment.parse(source, template_name)
+            references[template_name] = sorted(set(meta.find_referenced_templates(ast)))
+            debug("Template {} references: {}".format(template_name, references[template_name]))
+
+    @classmethod
+    def build(cls, environment_loader, components):
+        """
+        Build the dependency graph for the given component names.
+        """
+        dependencies = cls()
+        for component in sorted(set(components)):
+            dependencies.add_environment(component, environment_loader(component))
+        return dependencies
+
+    def references(self, component, template_name):
+        """
+        Return the templates directly referenced by a template.
+        """
+        return self.dependencies.get(component, {}).get(template_name, [])
+
+    def dependents(self, component, template_names):
+        """
+        Return the templates that (transitively) reference any of the given
+        templates, including the given templates themselves.
+        """
+        references = self.dependencies.get(component, {})
+        found = set(template_names)
+
+        changed = True
+        while changed:
+            changed = False
+            for template_name, referenced in references.iteritems():
+                if template_name in found:
+                    continue
+                if DYNAMIC in referenced or found.intersection(referenced):
+                    found.add(template_name)
+                    changed = True
+        return found
+
+    def affected(self, component, template_names, filter_func=None):
+        """
+        Return the names of generated templates that are affected by changes
+        to the given templates.
+
+        :param filter_func: filter for generated templates; defaults to ``options.filter_func``
+        """
+        filter_func = filter_func or options.filter_func
+        return sorted(filter(filter_func, self.dependents(component, template_names)))
+
+    def save(self, file_name):
+        """
+        Persist the dependency graph as JSON.
+        """
+        _ensure_dir(dirname(file_name))
+        with open(file_name, 'w') as file_:
+            json.dump(self.dependencies, file_, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Load a persisted dependency graph.
+        """
+        with open(file_name) as file_:
+            return cls(json.load(file_))
@@ -8,8 +8,9 @@ from gusset.colortable import ColorTable
 from gusset.output import configure_output
 
 from confab.definitions import Settings
-from confab.iter import iter_conffiles
+from confab.iter import iter_conffiles, map_conffiles
 from confab.main import add_core_options
+from confab.options import Options
 
 
 def parse_options():
@@ -37,12 +38,22 @@ def make_row(conffile):
     }
 
 
+def make_rows(conffiles):
+    """
+    Generate dictionaries describing a set of conffiles.
+    """
+    return [make_row(conffile) for conffile in conffiles.conffiles]
+
+
 def make_table(settings_,
                environment,
                hosts,
-               roles):
+               roles,
+               jobs=1):
     """
     Transform command line arguments into a table.
+
+    Conffiles are hashed using ``jobs`` processes.
     """
     sort_key = lambda description: (description["environment"],
                                     description["host"],
@@ -66,9 +77,13 @@ def make_table(settings_,
         environmentdef = environmentdef.with_hosts(*hosts).with_roles(*roles)
 
         with settings(environmentdef=environmentdef):
-            for conffiles in iter_conffiles(settings_.directory):
-                for conffile in conffiles.conffiles:
-                    row = make_row(conffile)
+            if jobs > 1:
+                rows = (rows for _, rows in map_conffiles(make_rows, jobs, settings_.directory))
+            else:
+                rows = (make_rows(conffiles) for conffiles in iter_conffiles(settings_.directory))
+
+            for rows_ in rows:
+                for row in rows_:
                     table.add(**row)
     return table
 
@@ -88,8 +103,10 @@ def main():
     except Exception as e:
         parser.error(e)
 
-    table = make_table(settings,
-                       options.environment,
-                       options.hosts.split(",") if options.hosts else [],
-                       options.roles.split(",") if options.roles else [])
+    with Options(dedup_renders=options.dedup_renders):
+        table = make_table(settings,
+                           options.environment,
+                           options.hosts.split(",") if options.hosts else [],
+                           options.roles.split(",") if options.roles else [],
+                           options.jobs)
     print(table)
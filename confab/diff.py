@@ -5,18 +5,36 @@ from fabric.api import task
 from gusset.output import status
 from gusset.validation import with_validation
 
-from confab.iter import iter_conffiles
+from confab.iter import iter_generated_conffiles, map_hosts
+from confab.options import options
+
+
+def _diff(conffiles, directory=None):
+    status("Computing template diffs for '{environment}' and '{role}'",
+           environment=conffiles.environment,
+           role=conffiles.role)
+
+    conffiles.diff(directory)
 
 
 @task
 @with_validation
-def diff(directory=None):
+def diff(directory=None, parallel=None):
     """
     Show configuration file diffs.
+
+    :param parallel: number of hosts to diff at a time; defaults to ``options.parallel``
     """
-    for conffiles in iter_conffiles(directory):
+    parallel = int(parallel or options.parallel)
+    if parallel > 1:
+        list(map_hosts(lambda conffiles: _diff(conffiles, directory), parallel, directory))
+        return
+
+    # remote transfers for each host overlap with rendering for the next ones
+    for conffiles in iter_generated_conffiles(directory):
         status("Computing template diffs for '{environment}' and '{role}'",
                environment=conffiles.environment,
                role=conffiles.role)
 
-        conffiles.diff(directory)
+        conffiles.pull_remotes(directory)
+        conffiles.show_diffs(directory)
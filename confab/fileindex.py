@@ -0,0 +1,127 @@
+"""
+Index of template file properties.
+
+Whether a template file is binary and what its mime type is depend only on
+the file's content, so both are cached per ``(path, size, mtime)`` and shared
+between the template loaders and :class:`~confab.conffiles.ConfFile`.
+
+The index is shared by the threads of :func:`confab.pipeline.pipeline`, so
+its entries are guarded by a lock.
+"""
+import json
+from os import stat
+from os.path import dirname, exists, join
+from threading import RLock
+
+from confab.files import _ensure_dir, _is_archived, _sniff_binary
+from confab.options import _get_mime_type, options
+
+
+def get_file_index_file(directory=None):
+    """
+    Return the path to the persisted file index.
+    """
+    return join(directory or options.get_base_dir(),
+                options.get_cache_dir(),
+                'files.json')
+
+
+class FileIndex(object):
+    """
+    Cache of per-file properties keyed by path, size and modification time.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = RLock()
+
+    def _stat_key(self, file_name):
+        if _is_archived(file_name):
+            # archives are not modified during a run
+            return None
+        stat_ = stat(file_name)
+        return (stat_.st_size, stat_.st_mtime)
+
+    def _entry(self, file_name):
+        """
+        Return the (possibly new) cache entry for the current version of a file.
+        """
+        key = self._stat_key(file_name)
+        cached_key, entry = self._entries.get(file_name, (None, None))
+        if entry is None or cached_key != key:
+            entry = {}
+            self._entries[file_name] = (key, entry)
+        return entry
+
+    def is_binary(self, file_name):
+        """
+        Return whether a file is binary.
+        """
+        with self._lock:
+            entry = self._entry(file_name)
+            if 'binary' not in entry:
+                entry['binary'] = _sniff_binary(file_name)
+            return entry['binary']
+
+    def mime_type(self, file_name):
+        """
+        Return the mime type of a file, as computed by ``options.get_mime_type``.
+
+        Only the default detector's results are indexed (and persisted); a
+        custom ``get_mime_type`` may depend on more than the file's content
+        and is called every time.
+        """
+        if options.get_mime_type is not _get_mime_type:
+            return options.get_mime_type(file_name)
+        # also serializes calls to the shared libmagic handle
+        with self._lock:
+            entry = self._entry(file_name)
+            if 'mime_type' not in entry:
+                entry['mime_type'] = options.get_mime_type(file_name)
+            return entry['mime_type']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def dump(self):
+        """
+        Return entries for files on disk, as ``[path, key, entry]`` lists.
+        """
+        with self._lock:
+            return [[file_name, key, dict(entry)]
+                    for file_name, (key, entry) in sorted(self._entries.iteritems())
+                    if key is not None]
+
+    def merge(self, entries):
+        """
+        Add entries returned by :meth:`dump`, keeping properties already known.
+        """
+        with self._lock:
+            for file_name, key, entry in entries:
+                key = tuple(key)
+                cached_key, cached = self._entries.get(file_name, (None, None))
+                if cached is None:
+                    self._entries[file_name] = (key, entry)
+                elif cached_key == key:
+                    for name, value in entry.iteritems():
+                        cached.setdefault(name, value)
+
+    def save(self, file_name):
+        """
+        Persist entries for files on disk as JSON.
+        """
+        _ensure_dir(dirname(file_name))
+        with open(file_name, 'w') as file_:
+            json.dump(self.dump(), file_)
+
+    def load(self, file_name):
+        """
+        Load persisted entries, if any; entries for modified files are ignored on use.
+        """
+        if not exists(file_name):
+            return
+        with open(file_name) as file_:
+            self.merge(json.load(file_))
+
+
+file_index = FileIndex()
@@ -2,15 +2,91 @@
 File options.
 """
 
+import errno
 import imp
 import os
 import shutil
 import sys
-from hashlib import md5
-from fabric.api import runs_once
+from contextlib import contextmanager
+from hashlib import md5, sha1
+from io import BytesIO
+from tempfile import mkstemp
+
+
+# Files that live inside zipped packages have no path on disk; map their
+# (pseudo) file names to a function returning the file's content.
+_archived = {}
+
+# How many bytes to read at a time when streaming files.
+CHUNK_SIZE = 64 * 1024
+
+# How many leading bytes to inspect when deciding whether a file is binary.
+SNIFF_SIZE = 8192
+
+
+def _sniff_binary(file_name):
+    """
+    Return whether a file looks binary, based on a prefix of its content.
+
+    A file is binary if its prefix contains NUL bytes; text in any encoding
+    without them (e.g. latin-1) is not.
+    """
+    with _open_file(file_name) as file_:
+        prefix = file_.read(SNIFF_SIZE)
+
+    return b'\0' in prefix
+
+
+def _read_lines(file_name, encoding='utf-8', fallback='latin-1'):
+    """
+    Return the lines of a text file as unicode, decoded from ``encoding``
+    or, if the file is not valid in it, from ``fallback``.
+    """
+    with open(file_name, 'rb') as file_:
+        lines = file_.readlines()
+    try:
+        return [line.decode(encoding) for line in lines]
+    except UnicodeDecodeError:
+        return [line.decode(fallback) for line in lines]
+
+
+def _hash_file(file_name):
+    """
+    Return the sha1 hex digest of a file's content, reading it in chunks.
+    """
+    digest = sha1()
+    with _open_file(file_name) as file_:
+        for chunk in iter(lambda: file_.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _files_equal(file_name, other_file_name):
+    """
+    Return whether two files have the same content, comparing sizes first
+    and then chunks, stopping at the first difference.
+    """
+    if os.path.getsize(file_name) != os.path.getsize(other_file_name):
+        return False
+    with open(file_name, 'rb') as file_:
+        with open(other_file_name, 'rb') as other_file:
+            while True:
+                chunk = file_.read(CHUNK_SIZE)
+                if chunk != other_file.read(CHUNK_SIZE):
+                    return False
+                if not chunk:
+                    return True
+
+
+def _copy_file(file_name, other_file_name):
+    """
+    Copy a file's content in chunks.
+    """
+    with _open_file(file_name) as file_:
+        with open(other_file_name, 'wb') as other_file:
+            shutil.copyfileobj(file_, other_file, CHUNK_SIZE)
 
 
-@runs_once
 def _clear_dir(dir_name):
     """
     Remove an entire directory tree.
@@ -27,12 +103,84 @@ def _clear_file(file_name):
         os.remove(file_name)
 
 
+def _prune_dirs(dir_name, root):
+    """
+    Remove a directory and its parents, up to but excluding ``root``, while
+    they are empty.
+    """
+    while dir_name != root and dir_name.startswith(root + os.sep):
+        try:
+            os.rmdir(dir_name)
+        except OSError:
+            # not empty, or already removed
+            return
+        dir_name = os.path.dirname(dir_name)
+
+
 def _ensure_dir(dir_name):
     """
     Ensure that a directory exists.
     """
-    if not os.path.exists(dir_name):
+    try:
         os.makedirs(dir_name)
+    except OSError as error:
+        # another process or thread may have created it in the meantime
+        if error.errno != errno.EEXIST or not os.path.isdir(dir_name):
+            raise
+
+
+def _register_archived(file_name, read_func):
+    """
+    Register a file that can only be read from within an archive.
+    """
+    _archived[file_name] = read_func
+
+
+def _is_archived(file_name):
+    """
+    Return whether a file name refers to a file within an archive.
+    """
+    return file_name in _archived
+
+
+def _open_file(file_name):
+    """
+    Open a file for binary reading, including files within archives.
+    """
+    read_func = _archived.get(file_name)
+    if read_func is not None:
+        return BytesIO(read_func())
+    return open(file_name, 'rb')
+
+
+def _get_umask():
+    """
+    Return the process umask.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def _atomic_replace(file_name):
+    """
+    Yield a temporary file name in the same directory as ``file_name``; once
+    the caller has written it, rename it over ``file_name``.
+
+    Readers see either the old or the new file, never a partial one.
+    """
+    dir_name, base_name = os.path.split(file_name)
+    fd, tmp_name = mkstemp(dir=dir_name, prefix='.' + base_name + '.')
+    os.close(fd)
+    try:
+        # mkstemp creates private files; use the mode of a newly created file
+        os.chmod(tmp_name, 0666 & ~_get_umask())
+        yield tmp_name
+        os.rename(tmp_name, file_name)
+    except:
+        _clear_file(tmp_name)
+        raise
 
 
 def _import(module_name, dir_name):
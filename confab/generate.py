@@ -5,18 +5,46 @@ from fabric.api import task
 from gusset.output import status
 from gusset.validation import with_validation
 
-from confab.iter import iter_conffiles
+from confab.dedup import deduplicator
+from confab.iter import iter_conffiles, map_conffiles, prepare_generated_dirs
+from confab.options import options
+
+
+def _generate(conffiles):
+    """
+    Generate configuration files for one host and role.
+
+    Returns the number of reused and new renders.
+    """
+    status("Generating templates for '{environment}' and '{role}'",
+           environment=conffiles.environment,
+           role=conffiles.role)
+
+    hits, misses = deduplicator.hits, deduplicator.misses
+    conffiles.generate()
+    return deduplicator.hits - hits, deduplicator.misses - misses
 
 
 @task
 @with_validation
-def generate(directory=None):
+def generate(directory=None, jobs=None):
     """
     Generate configuration files.
+
+    :param jobs: number of processes to generate with; defaults to ``options.jobs``
     """
-    for conffiles in iter_conffiles(directory):
-        status("Generating templates for '{environment}' and '{role}'",
-               environment=conffiles.environment,
-               role=conffiles.role)
+    jobs = int(jobs or options.jobs)
+
+    prepare_generated_dirs(directory)
+    if jobs > 1:
+        results = [result for _, result in map_conffiles(_generate, jobs, directory)]
+    else:
+        results = [_generate(conffiles) for conffiles in iter_conffiles(directory)]
 
-        conffiles.generate()
+    if options.dedup_renders:
+        hits = sum(hits for hits, _ in results)
+        total = sum(hits + misses for hits, misses in results)
+        status("Reused {hits} of {total} rendered templates ({rate:.0%})",
+               hits=hits,
+               total=total,
+               rate=float(hits) / total if total else 0.0)
@@ -3,7 +3,10 @@ Iterations over :term:`hosts<host>`, :term:`roles<role>`,
 :term:`components<component>` and config files.
 """
 
+from collections import OrderedDict
 from fabric.api import env, settings, abort
+from fabric.network import disconnect_all
+from os import getcwd
 from os.path import join
 from pkg_resources import iter_entry_points
 from warnings import warn
@@ -11,8 +14,12 @@ from warnings import warn
 from confab.options import options
 from confab.validate import assert_exists
 from confab.loaders import FileSystemEnvironmentLoader
+from confab.parallel import map_units
+from confab.pipeline import pipeline
 from confab.data import DataLoader
-from confab.conffiles import ConfFiles
+from confab.conffiles import ConfFiles, HostConfFiles, prepare_generated_dir
+from confab.dependencies import TemplateDependencies
+from confab.fileindex import file_index, get_file_index_file
 
 
 def _get_environmentdef():
@@ -64,10 +71,173 @@ def iter_conffiles(directory=None):
     Uses the default :class:`~confab.loaders.FileSystemEnvironmentLoader` and
     :class:`~confab.data.DataLoader`.
 
+    The :data:`~confab.fileindex.file_index` is loaded from and saved to
+    the cache directory, so that file types carry over between runs.
+
+    :param directory: Path to templates and data directories.
+    """
+    index_file = get_file_index_file(directory)
+    file_index.load(index_file)
+    try:
+        for host_and_role in iter_hosts_and_roles():
+            conffiles = make_conffiles(host_and_role, directory)
+            try:
+                yield conffiles
+            finally:
+                conffiles.close()
+    finally:
+        file_index.save(index_file)
+
+
+def iter_host_conffiles(directory=None):
+    """
+    Generate :class:`~confab.conffiles.HostConfFiles` objects, combining the
+    configuration files of all roles, for each :term:`host` in an
+    :term:`environment`.
+
     :param directory: Path to templates and data directories.
     """
-    for host_and_role in iter_hosts_and_roles():
-        yield make_conffiles(host_and_role, directory)
+    index_file = get_file_index_file(directory)
+    file_index.load(index_file)
+    try:
+        for host, hosts_and_roles in _get_hosts_and_roles().iteritems():
+            # fabric needs the host_string if we're calling from main()
+            with settings(host_string=host):
+                conffiles = make_host_conffiles(hosts_and_roles, directory)
+                try:
+                    yield conffiles
+                finally:
+                    conffiles.close()
+    finally:
+        file_index.save(index_file)
+
+
+def iter_generated_conffiles(directory=None):
+    """
+    Generate :class:`~confab.conffiles.HostConfFiles` objects for each
+    :term:`host` in an :term:`environment`, with their configuration files
+    already generated.
+
+    Loading and generation run ahead in background threads, by up to
+    ``options.pipeline_depth`` hosts, so that they overlap with the caller's
+    (remote) work on each object; see :func:`confab.pipeline.pipeline`.
+
+    :param directory: Path to templates and data directories.
+    """
+    def load(hosts_and_roles):
+        return make_host_conffiles(hosts_and_roles, directory)
+
+    def generate(conffiles):
+        conffiles.generate(directory)
+        return conffiles
+
+    units = _get_hosts_and_roles().values()
+
+    index_file = get_file_index_file(directory)
+    file_index.load(index_file)
+    try:
+        for conffiles in pipeline(units, [load, generate], options.pipeline_depth):
+            # fabric needs the host_string if we're calling from main()
+            with settings(host_string=conffiles.host):
+                try:
+                    yield conffiles
+                finally:
+                    conffiles.close()
+    finally:
+        file_index.save(index_file)
+
+
+def map_conffiles(func, jobs, directory=None):
+    """
+    Call ``func`` with a :class:`~confab.conffiles.ConfFiles` object for each
+    ``host_and_role`` in an :term:`environment`, using ``jobs`` worker processes.
+
+    Yields ``(host_and_role, result)`` in the same order as
+    :func:`iter_conffiles`; see :func:`confab.parallel.map_units`.
+
+    The :data:`~confab.fileindex.file_index` is loaded before the workers
+    start and the entries they add are saved once all units are done.
+
+    :param directory: Path to templates and data directories.
+    """
+    def run(host_and_role):
+        # fabric needs the host_string if we're calling from main()
+        with settings(host_string=host_and_role.host):
+            conffiles = make_conffiles(host_and_role, directory)
+            try:
+                result = func(conffiles)
+            finally:
+                conffiles.close()
+            return result, file_index.dump()
+
+    index_file = get_file_index_file(directory)
+    file_index.load(index_file)
+    try:
+        for host_and_role, (result, entries) in map_units(run,
+                                                          _get_environmentdef().all(),
+                                                          jobs):
+            file_index.merge(entries)
+            yield host_and_role, result
+    finally:
+        file_index.save(index_file)
+
+
+def map_hosts(func, parallel, directory=None):
+    """
+    Call ``func`` with a :class:`~confab.conffiles.HostConfFiles` object for
+    each :term:`host` in an :term:`environment`, working on up to ``parallel``
+    hosts at a time.
+
+    Each host is handled by one worker process (and therefore over its own
+    connection). Yields ``(host, result)`` in host order; see
+    :func:`confab.parallel.map_units`.
+
+    Workers cannot prompt, since their output is buffered: Fabric aborts
+    instead of asking for a password, so hosts need key authentication and
+    passwordless ``sudo``.
+
+    :param directory: Path to templates and data directories.
+    """
+    hosts_and_roles = _get_hosts_and_roles()
+
+    def run(host):
+        # fabric needs the host_string if we're calling from main()
+        with settings(host_string=host, abort_on_prompts=True):
+            try:
+                conffiles = make_host_conffiles(hosts_and_roles[host], directory)
+                try:
+                    return func(conffiles)
+                finally:
+                    conffiles.close()
+            finally:
+                disconnect_all()
+
+    return map_units(run, hosts_and_roles.keys(), parallel)
+
+
+def prepare_generated_dirs(directory=None):
+    """
+    Prepare the generated directory of each :term:`host` in an
+    :term:`environment` before generating the configuration files of its
+    roles one by one; see :func:`confab.conffiles.prepare_generated_dir`.
+
+    :param directory: Path to templates and data directories.
+    """
+    for host, hosts_and_roles in _get_hosts_and_roles().iteritems():
+        # the default base path of ConfFiles
+        prepare_generated_dir(directory or hosts_and_roles[0].environmentdef.directory or getcwd(),
+                              host,
+                              [host_and_role.role for host_and_role in hosts_and_roles])
+
+
+def _get_hosts_and_roles():
+    """
+    Return the ``host_and_role`` definitions of the environment by host.
+    """
+    hosts_and_roles = OrderedDict()
+    for host_and_role in _get_environmentdef().all():
+        hosts_and_roles.setdefault(host_and_role.host, []).append(host_and_role)
+    return hosts_and_roles
 
 
 def make_conffiles(host_and_role, directory=None):
@@ -80,6 +250,42 @@ def make_conffiles(host_and_role, directory=None):
 
     :param directory: Path to templates and data directories.
     """
+    templates_dirs, data_dirs = _get_dirs(directory)
+
+    return ConfFiles(host_and_role,
+                     FileSystemEnvironmentLoader(*templates_dirs),
+                     DataLoader(data_dirs))
+
+
+def make_host_conffiles(hosts_and_roles, directory=None):
+    """
+    Create a :class:`~confab.conffiles.HostConfFiles` object for the
+    ``host_and_role`` definitions of one :term:`host`.
+
+    :param directory: Path to templates and data directories.
+    """
+    return HostConfFiles([make_conffiles(host_and_role, directory)
+                          for host_and_role in hosts_and_roles])
+
+
+def make_dependencies(directory=None):
+    """
+    Create a :class:`~confab.dependencies.TemplateDependencies` graph for
+    all :term:`components<component>` in an :term:`environment`.
+
+    :param directory: Path to templates and data directories.
+    """
+    templates_dirs, _ = _get_dirs(directory)
+    components = [componentdef.name for componentdef in _get_environmentdef().components()]
+
+    return TemplateDependencies.build(FileSystemEnvironmentLoader(*templates_dirs),
+                                      components)
+
+
+def _get_dirs(directory=None):
+    """
+    Return the templates and data directories, including extension paths.
+    """
     directories = [directory or options.get_base_dir()]
     directories.extend(iter_extension_paths())
 
@@ -89,9 +295,7 @@ def make_conffiles(host_and_role, directory=None):
     data_dirs = map(lambda dir: join(dir, options.get_data_dir()), directories)
     assert_exists(*data_dirs)
 
-    return ConfFiles(host_and_role,
-                     FileSystemEnvironmentLoader(*templates_dirs),
-                     DataLoader(data_dirs))
+    return templates_dirs, data_dirs
 
 
 def iter_extension_paths():
@@ -0,0 +1,203 @@
+"""
+Fast line diffs for large configuration files.
+
+:func:`difflib.unified_diff` degrades badly on large files with many repeated
+lines (access lists, hosts files, zone files). :func:`histogram_diff` produces
+the same unified diff format using a histogram diff over hashed lines: each
+region is split on the longest increasing sequence of its least frequent
+common lines (as in patience diff), which is close to linear for typical
+configuration files, even with many scattered edits.
+
+To use it, set ``options.diff``::
+
+    from confab.linediff import histogram_diff
+    from confab.options import Options
+
+    with Options(diff=histogram_diff):
+        ...
+"""
+from bisect import bisect_left
+from difflib import SequenceMatcher
+
+# Lines occurring more often than this in a region are not used as anchors.
+MAX_CHAIN = 64
+
+
+def _hash_lines(a, b):
+    """
+    Map the lines of both sequences to integers, so that lines are compared once.
+    """
+    ids = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return a_ids, b_ids
+
+
+def _longest_increasing(pairs):
+    """
+    Return the longest subsequence of ``(i, j)`` pairs, sorted by j, whose
+    i are increasing (patience sorting).
+    """
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(pairs)
+    for index, (i, _) in enumerate(pairs):
+        position = bisect_left(tails, i)
+        if position:
+            previous[index] = tail_indexes[position - 1]
+        if position == len(tails):
+            tails.append(i)
+            tail_indexes.append(index)
+        else:
+            tails[position] = i
+            tail_indexes[position] = index
+
+    result = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def _find_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    """
+    Return the lines to split a region on, as ``(i, j)`` pairs increasing in
+    both sequences.
+
+    Anchors are the lines occurring equally often, and least often (at most
+    ``MAX_CHAIN`` times), in both ranges; usually lines that are unique in
+    both. The occurrences of each line are paired in order and the longest
+    increasing sequence of pairs is kept.
+    """
+    a_positions = {}
+    for i in xrange(a_lo, a_hi):
+        a_positions.setdefault(a[i], []).append(i)
+    b_positions = {}
+    for j in xrange(b_lo, b_hi):
+        b_positions.setdefault(b[j], []).append(j)
+
+    count = MAX_CHAIN + 1
+    for line, positions in b_positions.iteritems():
+        if len(positions) < count and len(a_positions.get(line, ())) == len(positions):
+            count = len(positions)
+            if count == 1:
+                break
+    if count > MAX_CHAIN:
+        return []
+
+    pairs = []
+    for line, positions in b_positions.iteritems():
+        if len(positions) == count and len(a_positions.get(line, ())) == count:
+            pairs.extend(zip(a_positions[line], positions))
+    pairs.sort(key=lambda pair: pair[1])
+    return _longest_increasing(pairs)
+
+
+def histogram_matching_blocks(a, b):
+    """
+    Return the matching blocks of two sequences of lines, in the format of
+    :meth:`difflib.SequenceMatcher.get_matching_blocks`.
+
+    Each region is split on all of its anchors at once (see
+    :func:`_find_anchors`), so every level of splitting takes time linear in
+    the size of the inputs, however scattered the edits are.
+    """
+    a, b = _hash_lines(a, b)
+    matches = []
+    pending = [(0, len(a), 0, len(b))]
+
+    while pending:
+        a_lo, a_hi, b_lo, b_hi = pending.pop()
+
+        # common prefix and suffix
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo, 1))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            matches.append((a_hi, b_hi, 1))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+
+        anchors = _find_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+        if not anchors:
+            # only very frequent lines remain; fall back to difflib for this range
+            matcher = SequenceMatcher(None, a[a_lo:a_hi], b[b_lo:b_hi], autojunk=False)
+            matches.extend((a_lo + i, b_lo + j, size)
+                           for i, j, size in matcher.get_matching_blocks() if size)
+            continue
+
+        for i, j in anchors:
+            matches.append((i, j, 1))
+            pending.append((a_lo, i, b_lo, j))
+            a_lo, b_lo = i + 1, j + 1
+        pending.append((a_lo, a_hi, b_lo, b_hi))
+
+    # merge adjacent matches into blocks
+    blocks = []
+    for i, j, size in sorted(matches):
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + size)
+        else:
+            blocks.append((i, j, size))
+    blocks.append((len(a), len(b), 0))
+    return blocks
+
+
+class _HistogramMatcher(SequenceMatcher):
+    """
+    A :class:`difflib.SequenceMatcher` with precomputed matching blocks, so that
+    difflib's opcode grouping can be reused.
+    """
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+        self.matching_blocks = histogram_matching_blocks(a, b)
+        self.opcodes = None
+
+
+def _format_range(start, stop):
+    """
+    Convert a range to the unified diff "start,length" format.
+    """
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '{}'.format(beginning)
+    if not length:
+        beginning -= 1
+    return '{},{}'.format(beginning, length)
+
+
+def histogram_diff(a, b, fromfile='', tofile='', n=3, lineterm='\n'):
+    """
+    Return a unified diff of two sequences of lines using histogram diff.
+
+    Accepts the same arguments as :func:`difflib.unified_diff`.
+    """
+    started = False
+    for group in _HistogramMatcher(a, b).get_grouped_opcodes(n):
+        if not started:
+            started = True
+            yield '--- {}{}'.format(fromfile, lineterm)
+            yield '+++ {}{}'.format(tofile, lineterm)
+
+        first, last = group[0], group[-1]
+        yield '@@ -{} +{} @@{}'.format(_format_range(first[1], last[2]),
+                                       _format_range(first[3], last[4]),
+                                       lineterm)
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in b[j1:j2]:
+                    yield '+' + line
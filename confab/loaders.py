@@ -8,10 +8,80 @@ Note that the default Jinja2 Loaders assume a charset (default: utf-8).
 """
 from jinja2 import (Environment, FileSystemLoader, PackageLoader, BaseLoader,
                     StrictUndefined, TemplateNotFound)
-from os.path import join, exists
-from pkg_resources import get_provider
+from jinja2.loaders import split_template_path
+from os.path import join, exists, getmtime
+from os import sep, walk
+from pkg_resources import get_provider, ZipProvider
 from gusset.output import debug
 
+from confab.fileindex import file_index
+from confab.files import _register_archived
+
+
+# Package resource lookups are expensive (especially for zipped eggs) and
+# packages do not change during a run, so cache them by package and path.
+_providers = {}
+_resource_dirs = {}
+_package_templates = {}
+
+# Template listings for template directories, keyed by directory. Listings are
+# revalidated against the modification times of every directory walked.
+_directory_templates = {}
+
+
+def _get_provider(package_name):
+    """
+    Return the (cached) resource provider for a package.
+    """
+    if package_name not in _providers:
+        _providers[package_name] = get_provider(package_name)
+    return _providers[package_name]
+
+
+def _resource_isdir(package_name, path):
+    """
+    Return whether a package resource is a directory, caching the result.
+    """
+    key = (package_name, path)
+    if key not in _resource_dirs:
+        _resource_dirs[key] = _get_provider(package_name).resource_isdir(path)
+    return _resource_dirs[key]
+
+
+def _walk_templates(searchpath):
+    """
+    Return the templates under a directory and the modification times
+    of the directories walked.
+    """
+    mtimes, templates = {}, []
+    for dirpath, dirnames, filenames in walk(searchpath):
+        mtimes[dirpath] = getmtime(dirpath)
+        for filename in filenames:
+            template = join(dirpath, filename)[len(searchpath):].strip(sep).replace(sep, '/')
+            templates.append(template)
+    return mtimes, templates
+
+
+def _is_unchanged(mtimes):
+    """
+    Return whether none of the given directories has been modified.
+    """
+    try:
+        return all(getmtime(dirpath) == mtime for dirpath, mtime in mtimes.iteritems())
+    except OSError:
+        return False
+
+
+def _list_directory_templates(searchpath):
+    """
+    Return the (cached) templates under a directory.
+    """
+    cached = _directory_templates.get(searchpath)
+    if cached is None or not _is_unchanged(cached[0]):
+        debug("Listing templates in {}".format(searchpath))
+        cached = _directory_templates[searchpath] = _walk_templates(searchpath)
+    return cached[1]
+
 
 class FileSystemEnvironmentLoader(object):
     """Loads Jinja2 environments from directories."""
@@ -48,16 +118,61 @@ class PackageEnvironmentLoader(object):
         """
         package_path = join(self.templates_path, subdir)
 
-        provider = get_provider(self.package_name)
-        if not provider.resource_isdir(package_path):
+        if not _resource_isdir(self.package_name, package_path):
             debug("Using EmptyLoader for {}; no such directory".format(package_path))
             return Environment(loader=EmptyLoader())
 
-        debug("Creating PackageLoader for {}".format(package_path))
-        return Environment(loader=PackageLoader(self.package_name, package_path),
+        debug("Creating ConfabPackageLoader for {}".format(package_path))
+        return Environment(loader=ConfabPackageLoader(self.package_name, package_path),
                            undefined=StrictUndefined)
 
 
+class ConfabPackageLoader(PackageLoader):
+    """Adds cached listings and zip-aware loading to Jinja's PackageLoader.
+
+    The resource provider and template listing are shared by every loader for
+    the same package and path, so they are computed once per run.
+
+    Templates in zipped packages are read straight from the archive rather than
+    being extracted to a temporary directory. Their file names point inside the
+    archive and are registered with :py:func:`confab.files._register_archived`
+    so that they may still be read (see :py:func:`confab.files._open_file`).
+    """
+
+    def __init__(self, package_name, package_path='templates', encoding='utf-8'):
+        super(ConfabPackageLoader, self).__init__(package_name, package_path, encoding)
+        self.provider = _get_provider(package_name)
+        self.archived = isinstance(self.provider, ZipProvider)
+        self.package_name = package_name
+
+    def get_source(self, environment, template):
+        if not self.archived:
+            return super(ConfabPackageLoader, self).get_source(environment, template)
+
+        pieces = split_template_path(template)
+        resource_name = '/'.join((self.package_path,) + tuple(pieces))
+        if not self.provider.has_resource(resource_name):
+            raise TemplateNotFound(template)
+
+        filename = join(self.provider.module_path, *resource_name.split('/'))
+        read_func = lambda: self.provider.get_resource_string(self.manager, resource_name)
+        _register_archived(filename, read_func)
+
+        try:
+            source = read_func().decode(self.encoding)
+        except UnicodeDecodeError:
+            source = ""  # not a text file
+
+        # archives are not modified during a run
+        return source, filename, lambda: True
+
+    def list_templates(self):
+        key = (self.package_name, self.package_path)
+        if key not in _package_templates:
+            _package_templates[key] = super(ConfabPackageLoader, self).list_templates()
+        return list(_package_templates[key])
+
+
 class ConfabFileSystemLoader(FileSystemLoader):
     """Adds support for binary templates when loading an environment from the file system.
 
@@ -71,21 +186,42 @@ class ConfabFileSystemLoader(FileSystemLoader):
     with the appropriate metadata. When generating the configuration, confab,
     instead of rendering the template, will just copy the template file
     (the binary config file) verbatim to the generated folder.
+
+    Binary files are detected by sniffing a prefix of the file (see
+    :py:mod:`confab.fileindex`), so large binary files are never read in full.
+
+    Template listings are cached per directory and shared between loaders;
+    a listing is walked again only when one of its directories is modified.
     """
 
     def get_source(self, environment, template):
+        pieces = split_template_path(template)
+        filename = next(iter(filter(exists, [join(searchpath, *pieces)
+                                             for searchpath in self.searchpath])), None)
+        if filename is None:
+            raise TemplateNotFound(template)
 
-        try:
-            return super(ConfabFileSystemLoader, self).get_source(environment, template)
-        except UnicodeDecodeError:
-            pass  # not a text file
+        if not file_index.is_binary(filename):
+            try:
+                return super(ConfabFileSystemLoader, self).get_source(environment, template)
+            except UnicodeDecodeError:
+                pass  # not a text file beyond the sniffed prefix
 
-        for searchpath in self.searchpath:
-            filename = join(searchpath, template)
-            if exists(filename):
-                return "", filename, True
+        mtime = getmtime(filename)
+
+        def uptodate():
+            try:
+                return getmtime(filename) == mtime
+            except OSError:
+                return False
 
-        raise TemplateNotFound(template)
+        return "", filename, uptodate
+
+    def list_templates(self):
+        found = set()
+        for searchpath in self.searchpath:
+            found.update(_list_directory_templates(searchpath))
+        return sorted(found)
 
 
 class EmptyLoader(BaseLoader):
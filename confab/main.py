@@ -14,6 +14,7 @@ For more complex invocation, a custom fabfile may be more appropriate.
 """
 import getpass
 import sys
+from difflib import unified_diff
 from optparse import OptionParser
 from os import getcwd
 from fabric.api import env, settings
@@ -23,16 +24,27 @@ from gusset.output import configure_output
 from confab.definitions import Settings
 from confab.diff import diff
 from confab.generate import generate
+from confab.linediff import histogram_diff
+from confab.multiplex import multiplexed_transports
 from confab.options import Options
+from confab.plan import apply, plan
 from confab.pull import pull
 from confab.push import push
 
 
-_tasks = {"diff":     (diff,     True,  True),
+_tasks = {"apply":    (apply,    False, True),
+          "diff":     (diff,     True,  True),
           "generate": (generate, True,  False),
+          "plan":     (plan,     True,  True),
           "pull":     (pull,     False, True),
           "push":     (push,     True,  True)}
 
+# Tasks that take a plan file argument.
+_plan_tasks = ("apply", "plan")
+
+_diffs = {"difflib":   unified_diff,
+          "histogram": histogram_diff}
+
 
 def parse_options():
     """
@@ -42,7 +54,7 @@ def parse_options():
     working directory.
     """
 
-    usage = "confab [options] {tasks}".format(tasks="|".join(_tasks.keys()))
+    usage = "confab [options] {tasks} [plan_file]".format(tasks="|".join(_tasks.keys()))
     parser = OptionParser(usage=usage)
 
     add_core_options(parser)
@@ -51,6 +63,42 @@ def parse_options():
                       default=getpass.getuser(),
                       help="username to use when connecting to remote hosts")
 
+    parser.add_option("--checksum", dest="checksum_remotes",
+                      action="store_true",
+                      default=False,
+                      help="compare remote checksums and only fetch files that differ")
+
+    parser.add_option("--agent", dest="use_agent",
+                      action="store_true",
+                      default=False,
+                      help="run remote operations through an agent uploaded to each host")
+
+    parser.add_option("--multiplex", dest="multiplex",
+                      action="store_true",
+                      default=False,
+                      help="with apply, check all hosts for drift at once over SSH channels "
+                           "multiplexed in a single thread (sudo must not prompt for a "
+                           "password); other tasks reach hosts one at a time")
+
+    parser.add_option("--no-remote-cache", dest="cache_remotes",
+                      action="store_false",
+                      default=True,
+                      help="with --checksum, fetch remote files even if local copies from a "
+                           "previous run match")
+
+    parser.add_option("--diff", dest="diff",
+                      type="choice",
+                      choices=sorted(_diffs.keys()),
+                      default="difflib",
+                      help="diff algorithm to use ({choices}) [default: %default]"
+                      .format(choices=", ".join(sorted(_diffs.keys()))))
+
+    parser.add_option("-P", "--parallel", dest="parallel",
+                      type="int",
+                      default=1,
+                      help="number of hosts to diff, pull or push at a time; more than one "
+                      "requires key authentication and passwordless sudo [default: %default]")
+
     parser.add_option("-y", "--yes", dest="assume_yes",
                       action="store_true",
                       default=False,
@@ -81,6 +129,11 @@ def add_core_options(parser):
                       default="",
                       help="comma-separated list of hosts to operate on")
 
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      type="int",
+                      default=1,
+                      help="number of processes to render templates with [default: %default]")
+
     parser.add_option("-q", "--quiet", dest="quiet",
                       action="store_true",
                       default=False,
@@ -90,6 +143,11 @@ def add_core_options(parser):
                       default="",
                       help="comma-separated list of roles to operate on")
 
+    parser.add_option("--dedup-renders", dest="dedup_renders",
+                      action="store_true",
+                      default=False,
+                      help="reuse rendered templates between hosts whose data reads match")
+
     parser.add_option("-v", "--verbose", dest="verbosity",
                       action="count",
                       default=0,
@@ -137,6 +195,12 @@ def get_task(parser, options, arguments):
         parser.error("Specified task must be one of: {tasks}"
                      .format(tasks=", ".join(_tasks.keys())))
 
+    if len(arguments) > (2 if task_name in _plan_tasks else 1):
+        parser.error("Too many arguments for task '{task}'".format(task=task_name))
+
+    if options.multiplex and task_name != "apply":
+        parser.error("--multiplex is only supported by the apply task")
+
     return task_func
 
 
@@ -160,10 +224,22 @@ def main():
 
         task_func = get_task(parser, options, arguments)
 
+        transport_options = {}
+        if options.multiplex:
+            transport_options['get_transport'] = multiplexed_transports()
+
         with settings(user=options.user,
                       use_ssh_config=options.use_ssh_config):
-            with Options(assume_yes=options.assume_yes):
-                task_func(options.directory)
+            with Options(assume_yes=options.assume_yes,
+                         cache_remotes=options.cache_remotes,
+                         checksum_remotes=options.checksum_remotes,
+                         dedup_renders=options.dedup_renders,
+                         diff=_diffs[options.diff],
+                         jobs=options.jobs,
+                         parallel=options.parallel,
+                         use_agent=options.use_agent,
+                         **transport_options):
+                task_func(options.directory, *arguments[1:])
 
     except SystemExit:
         raise
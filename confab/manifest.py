@@ -0,0 +1,84 @@
+"""
+Manifests of generated configuration files.
+
+A manifest records, per :term:`host` and :term:`role`, the digest and file
+metadata of every configuration file generated by the previous run. It lets
+generation skip files that are unchanged and remove files that are no
+longer generated.
+"""
+import json
+import os
+from os.path import dirname, exists, isdir, join
+
+from confab.files import _atomic_replace, _ensure_dir
+from confab.options import options
+
+
+def get_manifests_dir(directory, host):
+    """
+    Return the path to the manifests of a host.
+    """
+    return join(directory,
+                options.get_cache_dir(),
+                'manifests',
+                host)
+
+
+def get_manifest_file(directory, host, role):
+    """
+    Return the path to the manifest of a host and role.
+    """
+    return join(get_manifests_dir(directory, host), role + '.json')
+
+
+def list_manifest_roles(directory, host):
+    """
+    Return the roles of a host that have a manifest.
+    """
+    manifests_dir = get_manifests_dir(directory, host)
+    if not isdir(manifests_dir):
+        return []
+    return sorted(file_name[:-len('.json')] for file_name in os.listdir(manifests_dir)
+                  if file_name.endswith('.json'))
+
+
+def load_manifest(file_name):
+    """
+    Load a manifest; a missing manifest is empty.
+    """
+    if not exists(file_name):
+        return {}
+    with open(file_name) as file_:
+        return json.load(file_)
+
+
+def save_manifest(file_name, manifest):
+    """
+    Save a manifest.
+    """
+    _ensure_dir(dirname(file_name))
+    with _atomic_replace(file_name) as tmp_name:
+        with open(tmp_name, 'w') as file_:
+            json.dump(manifest, file_, indent=2, sort_keys=True)
+
+
+def make_entry(file_name, digest):
+    """
+    Create a manifest entry for a generated file.
+    """
+    stat_ = os.stat(file_name)
+    return dict(digest=digest,
+                size=stat_.st_size,
+                mtime=stat_.st_mtime,
+                mode=stat_.st_mode & 07777)
+
+
+def matches_entry(file_name, entry):
+    """
+    Return whether a file is unmodified since its manifest entry was made.
+    """
+    try:
+        stat_ = os.stat(file_name)
+    except OSError:
+        return False
+    return (stat_.st_size, stat_.st_mtime) == (entry['size'], entry['mtime'])
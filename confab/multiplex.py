@@ -0,0 +1,272 @@
+"""
+Multiplexed remote commands for many hosts in a single thread.
+
+A :class:`Multiplexer` starts commands on any number of :term:`hosts<host>`
+at once and collects their output in one ``select`` loop, so that fleet
+operations wait for the slowest host rather than for the sum of all hosts,
+without a thread or process per host.
+
+SSH channels are opened on Fabric's cached connections (with Fabric's user,
+key and password settings). Commands can also run as local processes, for
+tests and benchmarks.
+
+:class:`MultiplexedTransport` is a :class:`~confab.transport.Transport` on
+a shared multiplexer; :func:`checksums_all` probes files on all hosts of
+such transports at once. Other transport methods still wait for one host at
+a time, so only ``apply``'s drift check gains from multiplexing.
+"""
+import errno
+import os
+from pipes import quote
+from select import PIPE_BUF, select
+from subprocess import PIPE, Popen
+
+from fabric.api import abort, env
+from fabric.state import connections
+
+from confab.transport import _MKTEMP, Transport
+
+
+# Bytes to read from a channel at a time.
+_READ_SIZE = 32 * 1024
+
+
+class SSHChannel(object):
+    """
+    A command running on a host over an SSH channel.
+    """
+    def __init__(self, host, command, stdin=None):
+        self.channel = connections[host].get_transport().open_session()
+        self.channel.exec_command(command)
+        if stdin:
+            self.channel.sendall(stdin)
+        self.channel.shutdown_write()
+        self.stdout = []
+        self.stderr = []
+
+    def filenos(self):
+        return [self.channel.fileno()]
+
+    def write_filenos(self):
+        return []
+
+    def write(self, ready):
+        pass
+
+    def read(self, ready):
+        while self.channel.recv_ready():
+            self.stdout.append(self.channel.recv(_READ_SIZE))
+        while self.channel.recv_stderr_ready():
+            self.stderr.append(self.channel.recv_stderr(_READ_SIZE))
+
+    def done(self):
+        return (self.channel.exit_status_ready() and
+                not self.channel.recv_ready() and
+                not self.channel.recv_stderr_ready())
+
+    def status(self):
+        return self.channel.recv_exit_status()
+
+
+class ProcessChannel(object):
+    """
+    A command running as a local process, standing in for a host.
+
+    Input is written as the process reads it, from the multiplexer's loop,
+    so that processes producing output before consuming all of their input
+    cannot block on a full pipe.
+    """
+    def __init__(self, host, command, stdin=None):
+        self.process = Popen(['sh', '-c', command], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self.stdin = stdin or ''
+        if not self.stdin:
+            self.process.stdin.close()
+        self.outputs = {self.process.stdout.fileno(): [],
+                        self.process.stderr.fileno(): []}
+        self.stdout = self.outputs[self.process.stdout.fileno()]
+        self.stderr = self.outputs[self.process.stderr.fileno()]
+        self.open = set(self.outputs)
+
+    def filenos(self):
+        return list(self.open)
+
+    def write_filenos(self):
+        return [self.process.stdin.fileno()] if self.stdin else []
+
+    def write(self, ready):
+        if not self.stdin or self.process.stdin.fileno() not in ready:
+            return
+        try:
+            # at most PIPE_BUF bytes can be written to a ready pipe without blocking
+            written = os.write(self.process.stdin.fileno(), self.stdin[:PIPE_BUF])
+        except OSError as error:
+            if error.errno != errno.EPIPE:
+                raise
+            # the process exited without reading all of its input
+            written = len(self.stdin)
+        self.stdin = self.stdin[written:]
+        if not self.stdin:
+            self.process.stdin.close()
+
+    def read(self, ready):
+        for fileno in self.open.intersection(ready):
+            data = os.read(fileno, _READ_SIZE)
+            if data:
+                self.outputs[fileno].append(data)
+            else:
+                self.open.discard(fileno)
+
+    def done(self):
+        return not self.open and not self.stdin
+
+    def status(self):
+        return self.process.wait()
+
+
+class Multiplexer(object):
+    """
+    Runs commands on many hosts at once in the calling thread.
+    """
+    def __init__(self, channel_class=SSHChannel):
+        self.channel_class = channel_class
+
+    def run_all(self, commands):
+        """
+        Run commands on hosts at the same time and return their output by
+        host. Aborts, once all commands finished, if any of them failed.
+
+        :param commands: ``(command, stdin)`` pairs by host; stdin may be None
+        """
+        channels = dict((host, self.channel_class(host, command, stdin))
+                        for host, (command, stdin) in commands.iteritems())
+
+        pending = set(channels.itervalues())
+        while pending:
+            filenos = [fileno for channel in pending for fileno in channel.filenos()]
+            write_filenos = [fileno for channel in pending for fileno in channel.write_filenos()]
+            if filenos or write_filenos:
+                ready, writable, _ = select(filenos, write_filenos, [], 1)
+            else:
+                ready, writable = [], []
+            for channel in list(pending):
+                channel.write(writable)
+                channel.read(ready)
+                if channel.done():
+                    pending.discard(channel)
+
+        failures = []
+        for host, channel in sorted(channels.iteritems()):
+            if channel.status():
+                failures.append('{host}: {stderr}'.format(host=host,
+                                                          stderr=''.join(channel.stderr).strip()))
+        if failures:
+            abort('Commands failed on {count} host(s):\n{failures}'
+                  .format(count=len(failures), failures='\n'.join(failures)))
+
+        return dict((host, ''.join(channel.stdout)) for host, channel in channels.iteritems())
+
+    def run(self, host, command, stdin=None):
+        """
+        Run a command on a single host and return its output.
+        """
+        return self.run_all({host: (command, stdin)})[host]
+
+
+class MultiplexedTransport(Transport):
+    """
+    Transport for a host on a shared :class:`Multiplexer`.
+
+    Commands run with ``sudo`` (unless ``use_sudo`` is false), taking the
+    password from Fabric's ``env.password`` if set; otherwise, ``sudo``
+    must not need one. Files are transferred with SFTP, on one session per
+    transport that :meth:`close` ends.
+    """
+    def __init__(self, host, multiplexer, use_sudo=True, root='/'):
+        self.host = host
+        self.multiplexer = multiplexer
+        self.use_sudo = use_sudo
+        self.root = root
+        self._sftp_client = None
+
+    def _sudo(self, command):
+        """
+        Return a command and its stdin to run a command with elevated privileges.
+        """
+        if not self.use_sudo:
+            return command, None
+        if env.password:
+            return 'sudo -S -p "" sh -c {command}'.format(command=quote(command)), env.password + '\n'
+        return 'sudo -n sh -c {command}'.format(command=quote(command)), None
+
+    def run(self, command):
+        return self.multiplexer.run(self.host, *self._sudo(command))
+
+    def _sftp(self):
+        if self._sftp_client is None:
+            self._sftp_client = connections[self.host].open_sftp()
+        return self._sftp_client
+
+    def close(self):
+        if self._sftp_client is not None:
+            self._sftp_client.close()
+            self._sftp_client = None
+
+    def get(self, remote_path, local_path):
+        self._sftp().get(remote_path, local_path)
+
+    def put(self, local_path, remote_path):
+        uploaded = self.upload(local_path)
+        self.run('install -m {mode:o} {source} {target}; status=$?; rm -f {source}; exit $status'
+                 .format(mode=os.stat(local_path).st_mode & 07777,
+                         source=quote(uploaded),
+                         target=quote(remote_path)))
+
+    def upload(self, local_path):
+        # created without sudo, so that the connecting user can write to it
+        remote_path = self.multiplexer.run(self.host, _MKTEMP).strip()
+        self._sftp().put(local_path, remote_path)
+        return remote_path
+
+
+def multiplexed_transports(channel_class=SSHChannel):
+    """
+    Return a function creating transports to hosts on one shared
+    :class:`Multiplexer`, suitable for ``options.get_transport``.
+    """
+    multiplexer = Multiplexer(channel_class)
+    return lambda host: MultiplexedTransport(host, multiplexer)
+
+
+def checksums_all(transports_and_paths):
+    """
+    Return the states of remote files on several hosts, as
+    :meth:`~confab.transport.Transport.checksums` for each transport.
+
+    Transports on the same :class:`Multiplexer` are probed at the same time;
+    other transports one after another.
+
+    :param transports_and_paths: ``(transport, remote_paths)`` pairs
+    :return: a list of dictionaries of states by path, in the same order
+    """
+    transports_and_paths = [(transport, list(remote_paths))
+                            for transport, remote_paths in transports_and_paths]
+
+    commands_by_multiplexer = {}
+    for transport, remote_paths in transports_and_paths:
+        if isinstance(transport, MultiplexedTransport) and remote_paths:
+            commands = commands_by_multiplexer.setdefault(transport.multiplexer, {})
+            commands[transport.host] = transport._sudo(transport._checksums_command(remote_paths))
+
+    outputs = {}
+    for multiplexer, commands in commands_by_multiplexer.iteritems():
+        for host, output in multiplexer.run_all(commands).iteritems():
+            outputs[multiplexer, host] = output
+
+    results = []
+    for transport, remote_paths in transports_and_paths:
+        if isinstance(transport, MultiplexedTransport) and remote_paths:
+            results.append(transport._parse_checksums(
+                remote_paths, outputs[transport.multiplexer, transport.host]))
+        else:
+            results.append(transport.checksums(remote_paths))
+    return results
@@ -7,6 +7,9 @@ from os.path import basename
 from fabric.api import env, task
 from fabric.utils import _AttributeDict
 
+from confab.files import _is_archived, _open_file
+from confab.transport import FabricTransport
+
 from difflib import unified_diff
 from magic import Magic
 from re import match
@@ -58,13 +61,36 @@ def _filter_func(file_name):
     return _is_not_temporary(file_name) and _is_not_internal(file_name)
 
 
+# libmagic handle, shared for the life of the process; loading the magic
+# database is far more expensive than a lookup.
+_magic = None
+
+# libmagic inspects at most this many leading bytes of a file.
+_MAGIC_BUFFER_SIZE = 1024 * 1024
+
+
+def _get_magic():
+    """
+    Return the shared libmagic handle.
+    """
+    global _magic
+    if _magic is None:
+        _magic = Magic(mime=True)
+    return _magic
+
+
 def _get_mime_type(file_name):
     """
     Return the mime type of a file.
 
     The mime_type will be used to determine if a configuration file is text.
+    Results are kept per path, size and modification time by
+    :data:`confab.fileindex.file_index`.
     """
-    return Magic(mime=True).from_file(file_name)
+    if _is_archived(file_name):
+        with _open_file(file_name) as file_:
+            return _get_magic().from_buffer(file_.read(_MAGIC_BUFFER_SIZE))
+    return _get_magic().from_file(file_name)
 
 
 def _diff(a, b, fromfile=None, tofile=None):
@@ -114,9 +140,52 @@ options = _AttributeDict({
     # How do filter available templates within the jinja environment?
     'filter_func': _filter_func,
 
-    # How to determine diffs?
+    # How to determine diffs? (see also confab.linediff.histogram_diff)
     'diff': _diff,
 
+    # How many lines of a diff to show per file?
+    'max_diff_lines': 1000,
+
+    # How many bytes of rendered templates to keep in memory during a run?
+    'render_cache_size': 64 * 1024 * 1024,
+
+    # Above how many bytes should rendered templates be kept on disk instead? (None: never)
+    'render_spill_size': 8 * 1024 * 1024,
+
+    # Should rendered templates be reused for hosts whose data reads match?
+    'dedup_renders': False,
+
+    # How many processes should generate configuration files?
+    'jobs': 1,
+
+    # How many hosts should diff, pull and push work on at a time?
+    'parallel': 1,
+
+    # How many hosts and roles may diff and push render ahead of remote transfers?
+    'pipeline_depth': 2,
+
+    # How to reach a host? (returns a confab.transport.Transport)
+    'get_transport': FabricTransport,
+
+    # Should diff and push compare remote checksums and fetch only files that differ?
+    'checksum_remotes': False,
+
+    # With checksum_remotes, should local copies of remote files be kept between runs
+    # while their checksums match?
+    'cache_remotes': True,
+
+    # Should checksums, fetches and pushes run through an uploaded agent (confab.agent)?
+    'use_agent': False,
+
+    # Should files be compressed when transferred?
+    'compress_transfers': True,
+
+    # Above how many bytes should changed files be pushed as block deltas? (None: never)
+    'delta_threshold': 16 * 1024 * 1024,
+
+    # How many bytes are compared at a time by block deltas?
+    'delta_block_size': 128 * 1024,
+
     # How to get dictionary configuration from module data?
     'module_as_dict': _as_dict,
 
@@ -134,6 +203,9 @@ options = _AttributeDict({
 
     # What is the name of the remotes directory?
     'get_remotes_dir': lambda: 'remotes',
+
+    # What is the name of the directory for persisted run state?
+    'get_cache_dir': lambda: 'cache',
 })
 
 
@@ -0,0 +1,104 @@
+"""
+Parallel execution of per-host work.
+
+Work is sharded across a pool of worker processes, one unit (usually a
+``host_and_role``) at a time. Workers are forked from the calling process
+and receive its :data:`~confab.options.options`, Jinja filters and data
+hooks, so callables registered through the API behave as they do serially.
+
+Output produced by each unit is captured in the worker and printed by the
+calling process in the order of the units, so output is the same
+regardless of scheduling. Failures are reported per unit and summarized
+once all units are done.
+
+Workers exit without running ``atexit`` handlers, so they spill rendered
+content to a directory of the calling process, removed once the pool is
+done.
+"""
+import sys
+import traceback
+from cStringIO import StringIO
+from itertools import izip
+from multiprocessing import Pool
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from fabric.api import abort
+from fabric.colors import red
+
+from confab.hooks import hooks
+from confab.jinja_filters import jinja_filters
+from confab.options import options
+from confab.rendercache import render_cache
+
+
+# The work for forked workers: (func, units).
+_work = None
+
+
+def _init_worker(func, units, options_, filters, hooks_, spill_dir):
+    """
+    Install the work and registries of the parent process in a worker.
+    """
+    global _work
+    _work = (func, units)
+    options.update(options_)
+    jinja_filters._filters = set(filters)
+    hooks._hooks = hooks_
+    render_cache.set_spill_dir(spill_dir)
+
+
+def _run_unit(index):
+    """
+    Run the work for one unit, capturing its output and any failure.
+    """
+    func, units = _work
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = buffer_ = StringIO()
+    try:
+        result, error = func(units[index]), None
+    except (Exception, SystemExit):
+        # Fabric's abort() raises SystemExit
+        result, error = None, traceback.format_exc()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+    return result, buffer_.getvalue(), error
+
+
+def map_units(func, units, jobs):
+    """
+    Call ``func`` for each unit in a pool of ``jobs`` processes and yield
+    ``(unit, result)`` in the order of ``units``.
+
+    Results must be picklable. Aborts after all units have run if any failed.
+    """
+    units = list(units)
+    spill_dir = mkdtemp(prefix='confab-')
+    pool = Pool(min(jobs, len(units)) or 1,
+                _init_worker,
+                (func,
+                 units,
+                 dict(options),
+                 list(jinja_filters._filters),
+                 dict(hooks._hooks),
+                 spill_dir))
+    failures = []
+    try:
+        for unit, (result, output, error) in izip(units, pool.imap(_run_unit,
+                                                                   range(len(units)))):
+            sys.stdout.write(output)
+            if error is not None:
+                print(red('Failed for {unit}:\n{error}'.format(unit=unit, error=error)))
+                failures.append(unit)
+                continue
+            yield unit, result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        rmtree(spill_dir, True)
+
+    if failures:
+        abort('{failed} of {total} failed: {units}'.format(failed=len(failures),
+                                                           total=len(units),
+                                                           units=', '.join(map(str, failures))))
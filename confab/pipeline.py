@@ -0,0 +1,144 @@
+"""
+Pipelined execution of per-host work.
+
+Work for each unit (usually a ``host_and_role``) passes through a sequence of
+stages, each running in its own thread and connected to the next by a
+bounded queue. Stages therefore work on different units at the same time:
+for example, templates for the next host are rendered while the calling
+thread transfers files for the current one. The queues bound how far stages
+can run ahead, and with it the memory held by units in flight.
+
+Fabric's ``env`` is shared by all threads, so stages must not use it;
+remote operations belong in the calling thread, which consumes the results.
+Output from stages is captured per unit and printed by the calling thread
+when it receives the unit, so that it does not interleave with the caller's
+prompts and diffs for another unit. It is prefixed with the calling thread's
+host at the time it was produced.
+"""
+import sys
+from cStringIO import StringIO
+from Queue import Empty, Full, Queue
+from threading import Event, Thread, local
+
+
+# How long to wait on a queue before checking whether the pipeline was stopped.
+_POLL_INTERVAL = 0.1
+
+# Marks the end of the units.
+_DONE = object()
+
+
+class _Item(object):
+    """
+    A unit passing through the stages: the result of the last stage, or the
+    failure of a stage (passed through the remaining stages), and the output
+    of the stages so far.
+    """
+    def __init__(self, value=None, exc_info=None):
+        self.value = value
+        self.exc_info = exc_info
+        self.output = []
+
+
+class _ThreadOutput(object):
+    """
+    A stream writing to the current thread's buffer, if it has one, and
+    otherwise to the stream it replaces.
+    """
+    def __init__(self, stream, buffers):
+        self.stream = stream
+        self.buffers = buffers
+
+    def write(self, data):
+        buffer_ = getattr(self.buffers, 'buffer', None)
+        (buffer_ if buffer_ is not None else self.stream).write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _put(queue, item, stopped):
+    while not stopped.is_set():
+        try:
+            queue.put(item, timeout=_POLL_INTERVAL)
+            return
+        except Full:
+            continue
+
+
+def _get(queue, stopped):
+    while not stopped.is_set():
+        try:
+            return queue.get(timeout=_POLL_INTERVAL)
+        except Empty:
+            continue
+    return _DONE
+
+
+def _feed(units, output_queue, stopped):
+    try:
+        for unit in units:
+            _put(output_queue, _Item(unit), stopped)
+    except (Exception, SystemExit):
+        _put(output_queue, _Item(exc_info=sys.exc_info()), stopped)
+    _put(output_queue, _DONE, stopped)
+
+
+def _run_stage(func, input_queue, output_queue, stopped, buffers):
+    while True:
+        item = _get(input_queue, stopped)
+        if item is _DONE:
+            _put(output_queue, _DONE, stopped)
+            return
+        if item.exc_info is None:
+            buffers.buffer = StringIO()
+            try:
+                item.value = func(item.value)
+            except (Exception, SystemExit):
+                # Fabric's abort() raises SystemExit
+                item.exc_info = sys.exc_info()
+            finally:
+                item.output.append(buffers.buffer.getvalue())
+                buffers.buffer = None
+        _put(output_queue, item, stopped)
+
+
+def pipeline(units, stages, depth=1):
+    """
+    Pass each unit through ``stages`` (functions of the previous stage's
+    result) and yield the results in the order of ``units``.
+
+    Each stage runs in its own thread; at most ``depth`` results wait
+    between two stages. Output of the stages (to ``sys.stdout`` and
+    ``sys.stderr``) is printed just before their result is yielded. The
+    first failure is raised in the calling thread, which stops the pipeline.
+    """
+    stopped = Event()
+    buffers = local()
+    queues = [Queue(max(depth, 1)) for _ in range(len(stages) + 1)]
+
+    threads = [Thread(target=_feed, args=(units, queues[0], stopped))]
+    for func, input_queue, output_queue in zip(stages, queues, queues[1:]):
+        threads.append(Thread(target=_run_stage,
+                              args=(func, input_queue, output_queue, stopped, buffers)))
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ThreadOutput(stdout, buffers), _ThreadOutput(stderr, buffers)
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while True:
+            item = _get(queues[-1], stopped)
+            if item is _DONE:
+                return
+            stdout.write(''.join(item.output))
+            if item.exc_info is not None:
+                raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+            yield item.value
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
+        sys.stdout, sys.stderr = stdout, stderr
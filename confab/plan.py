@@ -0,0 +1,227 @@
+"""
+Plan configuration file changes and apply them later.
+
+:func:`plan` generates configuration files, pulls remote files and saves a
+plan: for each :term:`host`, the files that pushing would change, with their
+generated and remote digests and their diffs. :func:`apply` then pushes the
+planned files as generated, without generating or pulling again, once a
+single checksum command per host confirms that no remote file changed since.
+"""
+import json
+import time
+from os.path import exists, join
+from fabric.api import abort, env, settings, task
+from fabric.colors import magenta
+from fabric.contrib.console import confirm
+from gusset.output import status
+from gusset.validation import with_validation
+
+from confab.conffiles import _make_transport, _push_files
+from confab.files import _atomic_replace, _hash_file
+from confab.iter import iter_generated_conffiles, iter_hosts
+from confab.multiplex import checksums_all
+from confab.options import options
+
+
+# Format of saved plans.
+PLAN_VERSION = 1
+
+
+def get_plan_file(directory=None):
+    """
+    Return the default path of the plan file.
+    """
+    return join(directory or options.get_base_dir(), 'plan.json')
+
+
+def load_plan(file_name):
+    """
+    Load a plan.
+    """
+    if not exists(file_name):
+        abort("No plan found at '{file_name}'".format(file_name=file_name))
+    with open(file_name) as file_:
+        plan_ = json.load(file_)
+    if plan_.get('version') != PLAN_VERSION:
+        abort("Unsupported plan version in '{file_name}'".format(file_name=file_name))
+    return plan_
+
+
+def save_plan(file_name, plan_):
+    """
+    Save a plan.
+    """
+    with _atomic_replace(file_name) as tmp_name:
+        with open(tmp_name, 'w') as file_:
+            json.dump(plan_, file_, indent=2, sort_keys=True)
+
+
+def _get_host_generated_dir(directory, host):
+    return join(directory or options.get_base_dir(), options.get_generated_dir(), host)
+
+
+def _get_drifted(changes, remote_files, host_generated_dir):
+    """
+    Return the remote paths of planned files whose remote or generated
+    version changed since planning.
+    """
+    drifted = []
+    for change in changes:
+        remote_file = remote_files[change['remote']]
+        remote_digest = remote_file.digest if remote_file is not None else None
+        generated_file_name = join(host_generated_dir, change['name'])
+        if (remote_digest != change['remote_digest'] or
+                not exists(generated_file_name) or
+                _hash_file(generated_file_name) != change['generated_digest']):
+            drifted.append(change['remote'])
+    return drifted
+
+
+@task
+@with_validation
+def plan(directory=None, plan_file=None):
+    """
+    Save the changes that pushing would make to a plan file.
+
+    :param plan_file: path to the plan; defaults to ``plan.json`` in the base directory
+    """
+    plan_file = plan_file or get_plan_file(directory)
+
+    hosts = []
+    for conffiles in iter_generated_conffiles(directory):
+        status("Planning templates for '{environment}' and '{role}'",
+               environment=conffiles.environment,
+               role=conffiles.role)
+
+        conffiles.pull_remotes(directory)
+        conffiles.show_diffs(directory)
+        hosts.append(dict(host=conffiles.host, changes=conffiles.plan(directory)))
+
+    save_plan(plan_file, dict(version=PLAN_VERSION,
+                              environment=env.environmentdef.name,
+                              created=time.time(),
+                              hosts=hosts))
+
+    print(magenta('Saved plan to change {count} file(s) on {hosts} host(s) to {file_name}'
+                  .format(count=sum(len(host['changes']) for host in hosts),
+                          hosts=sum(1 for host in hosts if host['changes']),
+                          file_name=plan_file)))
+
+
+def _get_planned_hosts(plan_, file_name):
+    """
+    Return the host plans for the selected hosts, aborting if any of them
+    is not in the plan.
+    """
+    selected = set(host.host for host in iter_hosts())
+    unplanned = selected.difference(host_plan['host'] for host_plan in plan_['hosts'])
+    if unplanned:
+        abort("Hosts not in plan '{file_name}'; plan again: {hosts}"
+              .format(file_name=file_name, hosts=', '.join(sorted(unplanned))))
+    return [host_plan for host_plan in plan_['hosts'] if host_plan['host'] in selected]
+
+
+def _check_drift(directory, hosts, transports):
+    """
+    Abort if planned files changed since planning on any host.
+
+    All hosts are checked at the same time if the transports allow (see
+    :mod:`confab.multiplex`).
+    """
+    status('Checksumming remote files on {count} host(s)', count=len(hosts))
+    all_remote_files = checksums_all((transports[host],
+                                      [change['remote'] for change in changes])
+                                     for host, changes in hosts)
+
+    drifted = []
+    for (host, changes), remote_files in zip(hosts, all_remote_files):
+        host_generated_dir = _get_host_generated_dir(directory, host)
+        drifted.extend('{host}: {file_name}'.format(host=host, file_name=file_name)
+                       for file_name in _get_drifted(changes, remote_files, host_generated_dir))
+    if drifted:
+        abort('Files changed since planning; plan again:\n\t{files}'
+              .format(files='\n\t'.join(drifted)))
+
+
+def _push_hosts(directory, hosts, transports):
+    """
+    Push the planned files to each host in turn; if a host fails, abort
+    with the hosts that were and were not applied.
+    """
+    applied = []
+    for host, changes in hosts:
+        host_generated_dir = _get_host_generated_dir(directory, host)
+
+        try:
+            # fabric needs the host_string if we're calling from main()
+            with settings(host_string=host):
+                for change in changes:
+                    status('Pushing {file_name} to {host}',
+                           file_name=change['remote'],
+                           host=host)
+
+                _push_files(transports[host],
+                            [(join(host_generated_dir, change['name']), change['remote'])
+                             for change in changes])
+        except (Exception, SystemExit) as e:
+            # Fabric's abort() raises SystemExit, after printing its message
+            abort('Failed to apply the plan to {host}{error}\n'
+                  'Applied to: {applied}\n'
+                  'Not applied to: {remaining}'
+                  .format(host=host,
+                          error='' if isinstance(e, SystemExit) else ': {}'.format(e),
+                          applied=', '.join(applied) or 'none',
+                          remaining=', '.join(host_ for host_, _ in hosts
+                                              if host_ != host and host_ not in applied)))
+        applied.append(host)
+
+
+@task
+@with_validation
+def apply(directory=None, plan_file=None):
+    """
+    Push the changes saved in a plan file.
+
+    Only the selected hosts, which must all be in the plan, are changed.
+    The planned files are pushed only if neither their remote nor their
+    generated versions changed since planning, on any host; otherwise,
+    apply aborts before pushing. The files to push are then confirmed
+    once, unless ``options.assume_yes`` is set.
+
+    :param plan_file: path to the plan; defaults to ``plan.json`` in the base directory
+    """
+    plan_file = plan_file or get_plan_file(directory)
+    plan_ = load_plan(plan_file)
+
+    if plan_['environment'] != env.environmentdef.name:
+        abort("Plan is for environment '{planned}', not '{environment}'"
+              .format(planned=plan_['environment'], environment=env.environmentdef.name))
+
+    hosts = []
+    for host_plan in _get_planned_hosts(plan_, plan_file):
+        if host_plan['changes']:
+            hosts.append((host_plan['host'], host_plan['changes']))
+        else:
+            print(magenta('No configuration files to push for {host}'
+                          .format(host=host_plan['host'])))
+    if not hosts:
+        return
+
+    transports = dict((host, _make_transport(host)) for host, _ in hosts)
+    try:
+        _check_drift(directory, hosts, transports)
+
+        print(magenta('The following configuration files will be pushed:'))
+        print
+        for host, changes in hosts:
+            for change in changes:
+                print(magenta('\t{host}: {file_name}'.format(host=host,
+                                                             file_name=change['remote'])))
+
+        if options.assume_yes or confirm('Apply the plan to {count} host(s)?'
+                                         .format(count=len(hosts)),
+                                         default=False):
+            _push_hosts(directory, hosts, transports)
+    finally:
+        for transport in transports.itervalues():
+            transport.close()
@@ -6,18 +6,30 @@ from fabric.api import task
 from gusset.output import status
 from gusset.validation import with_validation
 
-from confab.iter import iter_conffiles
+from confab.iter import iter_host_conffiles, map_hosts
+from confab.options import options
+
+
+def _pull(conffiles):
+    status("Pulling remote templates for '{environment}' and '{role}'",
+           environment=conffiles.environment,
+           role=conffiles.role)
+
+    conffiles.pull()
 
 
 @task
 @with_validation
-def pull(directory=None):
+def pull(directory=None, parallel=None):
     """
     Pull remote configuration files.
+
+    :param parallel: number of hosts to pull from at a time; defaults to ``options.parallel``
     """
-    for conffiles in iter_conffiles(directory):
-        status("Pulling remote templates for '{environment}' and '{role}'",
-               environment=conffiles.environment,
-               role=conffiles.role)
+    parallel = int(parallel or options.parallel)
+    if parallel > 1:
+        list(map_hosts(_pull, parallel, directory))
+        return
 
-        conffiles.pull()
+    for conffiles in iter_host_conffiles(directory):
+        _pull(conffiles)
@@ -1,22 +1,43 @@
 """
 Push generated configuration files to remote :term:`host`.
 """
-from fabric.api import task
+from fabric.api import abort, task
 from gusset.output import status
 from gusset.validation import with_validation
 
-from confab.iter import iter_conffiles
+from confab.iter import iter_generated_conffiles, map_hosts
+from confab.options import options
+
+
+def _push(conffiles, directory=None):
+    status("Pushing templates for '{environment}' and '{role}'",
+           environment=conffiles.environment,
+           role=conffiles.role)
+
+    conffiles.push(directory)
 
 
 @task
 @with_validation
-def push(directory=None):
+def push(directory=None, parallel=None):
     """
     Push configuration files.
+
+    :param parallel: number of hosts to push to at a time; defaults to ``options.parallel``
     """
-    for conffiles in iter_conffiles(directory):
+    parallel = int(parallel or options.parallel)
+    if parallel > 1:
+        # output of parallel hosts is buffered, so there is no way to prompt
+        if not options.assume_yes:
+            abort("Pushing to several hosts at a time requires assuming yes (--yes)")
+        list(map_hosts(lambda conffiles: _push(conffiles, directory), parallel, directory))
+        return
+
+    # remote transfers for each host overlap with rendering for the next ones
+    for conffiles in iter_generated_conffiles(directory):
         status("Pushing templates for '{environment}' and '{role}'",
                environment=conffiles.environment,
                role=conffiles.role)
 
-        conffiles.push()
+        conffiles.pull_remotes(directory)
+        conffiles.push_diffs(directory)
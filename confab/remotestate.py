@@ -0,0 +1,79 @@
+"""
+Cache of the state of remote configuration files.
+
+The remote state records, per :term:`host`, the digest, mode and owner of
+every remote file copied into ``remotes_dir`` and when it was fetched. A
+later run with ``options.checksum_remotes`` probes remote checksums (a
+single command) and keeps the local copies of files whose remote digest is
+unchanged instead of fetching them again.
+"""
+import json
+import time
+from os.path import dirname, exists, join
+
+from confab.files import _atomic_replace, _ensure_dir, _hash_file
+from confab.manifest import make_entry, matches_entry
+from confab.options import options
+
+
+def get_remote_state_file(directory, host):
+    """
+    Return the path to the remote state of a host.
+    """
+    return join(directory,
+                options.get_cache_dir(),
+                'remotes',
+                host + '.json')
+
+
+def load_remote_state(file_name):
+    """
+    Load remote state; missing state is empty.
+    """
+    if not exists(file_name):
+        return {}
+    with open(file_name) as file_:
+        return json.load(file_)
+
+
+def save_remote_state(file_name, state):
+    """
+    Save remote state.
+    """
+    _ensure_dir(dirname(file_name))
+    with _atomic_replace(file_name) as tmp_name:
+        with open(tmp_name, 'w') as file_:
+            json.dump(state, file_, indent=2, sort_keys=True)
+
+
+def make_remote_entry(local_file_name, remote_file=None):
+    """
+    Create a remote state entry for the local copy of a remote file.
+
+    Without the state of the remote file (for files fetched without
+    checksums), the digest is that of the local copy and the remote mode
+    and owner are not recorded.
+
+    :param remote_file: a :class:`confab.transport.RemoteFile`
+    """
+    if remote_file is None:
+        entry = make_entry(local_file_name, _hash_file(local_file_name))
+        # the mode of the local copy is not the remote mode
+        del entry['mode']
+    else:
+        entry = make_entry(local_file_name, remote_file.digest)
+        entry.update(mode=remote_file.mode,
+                     owner=remote_file.owner)
+    entry['fetched'] = time.time()
+    return entry
+
+
+def is_cached(local_file_name, entry, remote_file):
+    """
+    Return whether the local copy of a remote file is current: the remote
+    digest is the one recorded and the local copy is unmodified since.
+    """
+    return (entry is not None and
+            remote_file is not None and
+            entry['digest'] == remote_file.digest and
+            matches_entry(local_file_name, entry))
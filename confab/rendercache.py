@@ -0,0 +1,231 @@
+"""
+Rendered configuration file content.
+
+Rendering a template is the most expensive part of handling a conffile, and
+the same content is needed to compute digests, generate files and show diffs.
+Rendered content is therefore kept for the run, bounded by
+``options.render_cache_size``; content larger than ``options.render_spill_size``
+is spilled to a temporary directory instead of being held in memory.
+
+Each :class:`~confab.conffiles.ConfFile` holds a reference to its content,
+which may be shared with other hosts through render deduplication. Spilled
+content is deleted once all of them are closed; content in memory stays in
+the cache for later renders until it is evicted.
+
+Templates are rendered as a stream of chunks that are encoded and hashed as
+they are produced, so rendering very large outputs needs memory for at most
+``options.render_spill_size`` bytes rather than several copies of the output.
+
+The cache is shared by the threads of :func:`confab.pipeline.pipeline`, so
+its bookkeeping is guarded by a lock; content obtained with
+:meth:`RenderCache.get` stays readable when another thread evicts it.
+"""
+import os
+from atexit import register
+from codecs import getincrementalencoder
+from collections import OrderedDict
+from hashlib import sha1
+from shutil import copyfileobj, rmtree
+from tempfile import mkdtemp, NamedTemporaryFile
+from threading import RLock
+
+from confab.options import options
+
+
+class Rendered(object):
+    """
+    Rendered content of a conffile and its digest.
+
+    The digest outlives the content, which may be evicted from the cache.
+    """
+    def __init__(self, digest, size, content=None, file_name=None):
+        self.digest = digest
+        self.size = size
+        self._content = content
+        self._file_name = file_name
+        self._references = 0
+
+    def is_available(self):
+        return self._content is not None or self._file_name is not None
+
+    def is_spilled(self):
+        return self._file_name is not None
+
+    def snapshot(self):
+        """
+        Return a copy of the content that eviction from the cache does not empty.
+        """
+        return Rendered(self.digest, self.size, self._content, self._file_name)
+
+    def read(self):
+        if self._file_name is not None:
+            with open(self._file_name, 'rb') as file_:
+                return file_.read()
+        return self._content
+
+    def write_to(self, file_name):
+        """
+        Write the content to a file.
+        """
+        with open(file_name, 'wb') as file_:
+            if self._file_name is not None:
+                with open(self._file_name, 'rb') as spilled:
+                    copyfileobj(spilled, file_)
+            else:
+                file_.write(self._content)
+
+    def spill(self, dir_name):
+        """
+        Move the content from memory to a file in ``dir_name``.
+        """
+        with NamedTemporaryFile(dir=dir_name, delete=False) as file_:
+            file_.write(self._content)
+        self._file_name = file_.name
+        self._content = None
+
+    def evict(self):
+        self._content = None
+
+    def close(self):
+        """
+        Delete spilled content.
+        """
+        if self._file_name is not None:
+            try:
+                os.remove(self._file_name)
+            except OSError:
+                pass
+            self._file_name = None
+
+
+class RenderCache(object):
+    """
+    Memory-bounded, least-recently-used cache of rendered content.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._spill_dir = None
+        self._lock = RLock()
+
+    def _get_spill_dir(self):
+        with self._lock:
+            if self._spill_dir is None:
+                self._spill_dir = mkdtemp(prefix='confab-')
+                register(rmtree, self._spill_dir, True)
+            return self._spill_dir
+
+    def set_spill_dir(self, dir_name):
+        """
+        Spill content to ``dir_name`` instead of a directory removed when the
+        process exits; the caller removes it.
+        """
+        with self._lock:
+            self._spill_dir = dir_name
+
+    def add(self, content):
+        """
+        Return a new :class:`Rendered` for content, evicting older content as needed.
+        """
+        rendered = Rendered(sha1(content).hexdigest(), len(content), content)
+
+        spill_size = options.render_spill_size
+        if spill_size is not None and rendered.size > spill_size:
+            rendered.spill(self._get_spill_dir())
+            return rendered
+
+        return self._add_in_memory(rendered)
+
+    def add_stream(self, chunks, encoding='utf-8'):
+        """
+        Return a new :class:`Rendered` for an iterable of unicode chunks.
+
+        Chunks are encoded and hashed incrementally; once the content exceeds
+        ``options.render_spill_size`` it is written to disk as it is produced.
+        """
+        encoder = getincrementalencoder(encoding)()
+        digest = sha1()
+        size = 0
+        parts = []
+        spilled = None
+        spill_size = options.render_spill_size
+
+        try:
+            for chunk in chunks:
+                data = encoder.encode(chunk)
+                digest.update(data)
+                size += len(data)
+                if spilled is not None:
+                    spilled.write(data)
+                    continue
+                parts.append(data)
+                if spill_size is not None and size > spill_size:
+                    spilled = NamedTemporaryFile(dir=self._get_spill_dir(), delete=False)
+                    spilled.writelines(parts)
+                    parts = []
+        finally:
+            if spilled is not None:
+                spilled.close()
+
+        if spilled is not None:
+            return Rendered(digest.hexdigest(), size, file_name=spilled.name)
+        return self._add_in_memory(Rendered(digest.hexdigest(), size, b''.join(parts)))
+
+    def _add_in_memory(self, rendered):
+        with self._lock:
+            self._entries[id(rendered)] = rendered
+            self._size += rendered.size
+
+            while self._size > options.render_cache_size and len(self._entries) > 1:
+                _, oldest = self._entries.popitem(last=False)
+                oldest.evict()
+                self._size -= oldest.size
+
+        return rendered
+
+    def acquire(self, rendered):
+        """
+        Add a reference to rendered content and return it.
+        """
+        with self._lock:
+            rendered._references += 1
+        return rendered
+
+    def release(self, rendered):
+        """
+        Remove a reference to rendered content, deleting spilled content once
+        there are none left.
+        """
+        with self._lock:
+            rendered._references -= 1
+            if rendered._references <= 0 and rendered.is_spilled():
+                rendered.close()
+
+    def get(self, rendered):
+        """
+        Return a :meth:`~Rendered.snapshot` of rendered content and mark it
+        as recently used, or return None if it was evicted.
+        """
+        with self._lock:
+            if not rendered.is_available():
+                return None
+            self.touch(rendered)
+            return rendered.snapshot()
+
+    def touch(self, rendered):
+        """
+        Mark rendered content as recently used.
+        """
+        with self._lock:
+            if id(rendered) in self._entries:
+                self._entries[id(rendered)] = self._entries.pop(id(rendered))
+
+    def clear(self):
+        with self._lock:
+            for rendered in self._entries.itervalues():
+                rendered.evict()
+            self._entries.clear()
+            self._size = 0
+
+
+render_cache = RenderCache()
@@ -0,0 +1,207 @@
+"""
+Tests for the remote agent and the agent transport.
+"""
+from os import chmod, listdir, makedirs, stat
+from os.path import exists, join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab import agent
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.loaders import PackageEnvironmentLoader
+from confab.options import Options
+from confab.transport import AgentTransport, LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestAgent(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.transport = LocalTransport(self.tmp_dir.path)
+        self.agent_transport = AgentTransport(self.transport)
+        makedirs(join(self.tmp_dir.path, 'etc'))
+        with open(join(self.tmp_dir.path, 'etc', 'foo'), 'w') as file_:
+            file_.write('foo\n')
+        chmod(join(self.tmp_dir.path, 'etc', 'foo'), 0640)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_run(self):
+        """
+        The agent carries out all operations of a manifest.
+        """
+        foo = join(self.tmp_dir.path, 'etc', 'foo')
+        bar = join(self.tmp_dir.path, 'etc', 'new', 'bar')
+
+        result = agent.run(dict(checksums=[foo],
+                                fetch=[foo],
+                                write=[dict(path=bar, mode=0600, content='YmFy')]))
+
+        eq_(['f1d2d2f924e986ac86fdf7b36c94bcdf32beec15', 0640], result['checksums'][foo][:2])
+        eq_('Zm9vCg==', result['fetch'][foo])
+        eq_([bar], result['written'])
+        eq_('bar', self.tmp_dir.read('etc/new/bar'))
+        eq_(0600, stat(bar).st_mode & 07777)
+
+    def test_write_failure(self):
+        """
+        Files are left as they were, without temporary files, if writing fails.
+        """
+        foo = join(self.tmp_dir.path, 'etc', 'foo')
+        with self.assertRaises(TypeError):
+            agent.write(foo, 'invalid mode', 'bar')
+
+        eq_(['foo'], listdir(join(self.tmp_dir.path, 'etc')))
+        eq_('foo', self.tmp_dir.read('etc/foo'))
+
+    def test_checksums(self):
+        """
+        Checksums are computed by the agent, uploaded once.
+        """
+        checksums = self.agent_transport.checksums(['/etc/foo', '/etc/missing'])
+        eq_(2, self.transport.calls)  # upload and run
+
+        eq_('f1d2d2f924e986ac86fdf7b36c94bcdf32beec15', checksums['/etc/foo'].digest)
+        eq_(0640, checksums['/etc/foo'].mode)
+        eq_(None, checksums['/etc/missing'])
+
+        self.agent_transport.checksums(['/etc/foo'])
+        eq_(3, self.transport.calls)
+
+    def test_fetch(self):
+        """
+        Files are fetched by the agent, with or without compression.
+        """
+        for compress in (False, True):
+            local_dir = join(self.tmp_dir.path, 'local{}'.format(compress))
+            eq_(set(['/etc/foo']),
+                self.agent_transport.fetch(['/etc/foo', '/etc/missing'], local_dir, compress))
+            eq_('foo', self.tmp_dir.read('local{}/etc/foo'.format(compress)))
+
+    def test_unexpected_output(self):
+        """
+        Output that is not a well-formed agent result aborts.
+        """
+        for output in ('Traceback (most recent call last):\n',
+                       '[]',
+                       '{"checksums": {"etc/foo": ["digest", 420, "root"]}}',
+                       '{"checksums": {}}'):
+            with patch.object(self.transport, 'run', return_value=output):
+                with patch('sys.stderr'):
+                    with self.assertRaises(SystemExit):
+                        self.agent_transport.checksums(['/etc/foo'])
+
+        with patch.object(self.transport, 'run', return_value='{"fetch": {"etc/foo": "Zm9v!"}}'):
+            with patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    self.agent_transport.fetch(['/etc/foo'], join(self.tmp_dir.path, 'local'))
+
+    def test_fetch_changed(self):
+        """
+        Checksums and files with unknown digests are returned by one command.
+        """
+        makedirs(join(self.tmp_dir.path, 'etc', 'sub'))
+        with open(join(self.tmp_dir.path, 'etc', 'sub', 'bar'), 'w') as file_:
+            file_.write('bar\n')
+
+        checksums, fetched = self.agent_transport.fetch_changed(
+            {'/etc/foo': ['f1d2d2f924e986ac86fdf7b36c94bcdf32beec15'],
+             '/etc/sub/bar': ['0000000000000000000000000000000000000000'],
+             '/etc/missing': []},
+            join(self.tmp_dir.path, 'local'))
+
+        eq_(2, self.transport.calls)  # upload and run
+        eq_(set(['/etc/sub/bar']), fetched)
+        eq_(None, checksums['/etc/missing'])
+        eq_('bar', self.tmp_dir.read('local/etc/sub/bar'))
+        ok_(not exists(join(self.tmp_dir.path, 'local', 'etc', 'foo')))
+
+    def test_push(self):
+        """
+        Files are written by the agent with their modes, creating directories.
+        """
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('new')
+        chmod(source, 0600)
+
+        for inline_size in (64 * 1024, 0):
+            self.transport.calls = 0
+            with patch('confab.transport._INLINE_MANIFEST_SIZE', inline_size):
+                self.agent_transport.push([(source, '/etc/foo'), (source, '/etc/new/bar')])
+
+            eq_('new', self.tmp_dir.read('etc/foo'))
+            eq_('new', self.tmp_dir.read('etc/new/bar'))
+            eq_(0600, stat(join(self.tmp_dir.path, 'etc', 'foo')).st_mode & 07777)
+
+        # the large manifest is uploaded first
+        eq_(2, self.transport.calls)
+
+    def test_push_large(self):
+        """
+        Large files are uploaded as they are and moved into place by the agent.
+        """
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('large')
+        chmod(source, 0600)
+
+        self.agent_transport._get_agent_path()
+        self.transport.calls = 0
+        with patch('confab.transport._INLINE_FILE_SIZE', 4):
+            with patch.object(self.agent_transport, 'call',
+                              wraps=self.agent_transport.call) as call:
+                self.agent_transport.push([(source, '/etc/foo')])
+
+        eq_(2, self.transport.calls)  # upload and run
+        entry = call.call_args[0][0]['write'][0]
+        ok_('content' not in entry)
+        ok_(not exists(entry['source']))
+        eq_('large', self.tmp_dir.read('etc/foo'))
+        eq_(0600, stat(join(self.tmp_dir.path, 'etc', 'foo')).st_mode & 07777)
+
+    def test_close(self):
+        """
+        The agent is removed from the host when the transport is closed.
+        """
+        self.agent_transport.checksums(['/etc/foo'])
+        agent_path = self.agent_transport._agent_path
+        ok_(exists(agent_path))
+
+        self.agent_transport.close()
+        ok_(not exists(agent_path))
+
+
+class TestAgentConfFiles(TestCase):
+
+    def test_diff(self):
+        """
+        With the agent, remote files are checksummed and fetched by one command.
+        """
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        conffiles = ConfFiles(settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(join(root, 'bar'))
+            with open(join(root, 'foo.txt'), 'w') as file_:
+                file_.write('foo\n')
+            with open(join(root, 'bar', 'bar.txt'), 'w') as file_:
+                file_.write('old\n')
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport, use_agent=True):
+                with patch('sys.stdout'):
+                    conffiles.diff(tmp_dir.path)
+                    conffiles.close()
+
+            eq_(3, transport.calls)  # upload, run and remove the agent
+            eq_('foo', tmp_dir.read('remotes/localhost/foo.txt'))
+            eq_('old', tmp_dir.read('remotes/localhost/bar/bar.txt'))
@@ -0,0 +1,89 @@
+"""
+Tests for render deduplication.
+"""
+from unittest import TestCase
+from jinja2 import Environment
+from mock import patch
+from nose.tools import eq_
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.dedup import RenderDeduplicator, find_paths, _value_signature, MISSING
+from confab.loaders import PackageEnvironmentLoader
+from confab.options import Options
+from confab.tests.utils import TempDir
+
+
+class TestPaths(TestCase):
+
+    def _paths(self, source):
+        return find_paths(Environment().parse(source))
+
+    def test_find_paths(self):
+        """
+        Constant lookups narrow paths; other uses read variables as a whole.
+        """
+        eq_(set([('foo', ('attr', 'bar'), ('item', 'baz'))]),
+            self._paths("{{ foo.bar['baz'] }}"))
+        eq_(set([('foo', ('attr', 'bar')), ('key',)]),
+            self._paths("{{ foo.bar[key] }}"))
+        eq_(set([('foo',), ('range',), ('x',)]),
+            self._paths("{% for x in range(3) %}{{ foo|join(x) }}{% endfor %}"))
+
+    def test_value_signature(self):
+        """
+        Paths follow Jinja's lookup rules.
+        """
+        data = {'foo': {'bar': 1, 'items': 2}}
+        eq_(('int', 1), _value_signature(data, ('foo', ('attr', 'bar'))))
+        eq_(MISSING, _value_signature(data, ('foo', ('attr', 'baz'))))
+        eq_(MISSING, _value_signature(data, ('bar',)))
+        eq_(('int', 2), _value_signature(data, ('foo', ('item', 'items'))))
+
+        # foo.items is the dict method, which reads all of foo
+        eq_(_value_signature(data, ('foo',)), _value_signature(data, ('foo', ('attr', 'items'))))
+
+
+class TestDedup(TestCase):
+
+    def setUp(self):
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1', 'host2',
+                                                                              'host3']},
+                                                     roledefs={'role': ['host1', 'host2',
+                                                                        'host3']}))
+        self.environment_loader = PackageEnvironmentLoader('confab.tests', 'templates/dedup')
+        self.deduplicator = RenderDeduplicator()
+
+    def _generate(self, tmp_dir, data):
+        with Options(dedup_renders=True):
+            for host_and_role in self.settings.for_env('any').all():
+                conffiles = ConfFiles(host_and_role,
+                                      self.environment_loader,
+                                      lambda component: dict(data[component.host],
+                                                             confab=dict(host=component.host)))
+                conffiles.generate(tmp_dir.path)
+
+    def test_dedup(self):
+        """
+        Renders are reused only for hosts with the same values for the paths read.
+        """
+        data = {
+            'host1': {'app': {'port': 80, 'debug': False, 'debug_level': 1, 'name': 'a'}},
+            'host2': {'app': {'port': 80, 'debug': False, 'debug_level': 1, 'name': 'b'}},
+            'host3': {'app': {'port': 80, 'debug': True, 'debug_level': 3, 'name': 'a'}},
+        }
+        with TempDir() as tmp_dir:
+            with patch('confab.conffiles.deduplicator', self.deduplicator):
+                self._generate(tmp_dir, data)
+
+            for host in ['host1', 'host2', 'host3']:
+                eq_('port=80', tmp_dir.read('generated/{}/shared.conf'.format(host)))
+                eq_('name=' + host, tmp_dir.read('generated/{}/host.conf'.format(host)))
+                eq_(data[host]['app']['name'], tmp_dir.read('generated/{}/include.conf'.format(host)))
+            eq_('off', tmp_dir.read('generated/host1/branch.conf'))
+            eq_('off', tmp_dir.read('generated/host2/branch.conf'))
+            eq_('3', tmp_dir.read('generated/host3/branch.conf'))
+
+        # shared.conf twice, branch.conf once and include.conf once
+        eq_(4, self.deduplicator.hits)
+        eq_(8, self.deduplicator.misses)
@@ -0,0 +1,67 @@
+"""
+Tests for template dependencies.
+"""
+from os.path import join
+from unittest import TestCase
+from nose.tools import eq_
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.dependencies import TemplateDependencies, DYNAMIC
+from confab.loaders import PackageEnvironmentLoader
+from confab.tests.utils import TempDir
+
+
+class TestDependencies(TestCase):
+
+    def setUp(self):
+        self.environment_loader = PackageEnvironmentLoader('confab.tests', 'templates/dependencies')
+        self.dependencies = TemplateDependencies.build(self.environment_loader, ['role'])
+
+    def test_references(self):
+        """
+        Includes, imports and extends are recorded, including for internal templates.
+        """
+        eq_(['_base.conf'], self.dependencies.references('role', 'etc/app.conf'))
+        eq_(['_header.conf'], self.dependencies.references('role', '_base.conf'))
+        eq_(['_macros.conf'], self.dependencies.references('role', 'etc/other.conf'))
+        eq_([DYNAMIC], self.dependencies.references('role', 'etc/dynamic.conf'))
+        eq_([], self.dependencies.references('role', 'etc/plain.conf'))
+
+    def test_affected(self):
+        """
+        Changes propagate transitively to generated templates only.
+        """
+        eq_(['etc/app.conf', 'etc/dynamic.conf'],
+            self.dependencies.affected('role', ['_header.conf']))
+        eq_(['etc/dynamic.conf', 'etc/other.conf'],
+            self.dependencies.affected('role', ['_macros.conf']))
+        # templates with dynamic references depend on everything
+        eq_(['etc/dynamic.conf', 'etc/plain.conf'],
+            self.dependencies.affected('role', ['etc/plain.conf']))
+        eq_([], self.dependencies.affected('other', ['_macros.conf']))
+
+    def test_save_and_load(self):
+        """
+        Dependency graphs can be persisted.
+        """
+        with TempDir() as tmp_dir:
+            file_name = join(tmp_dir.path, 'cache', 'dependencies.json')
+            self.dependencies.save(file_name)
+            loaded = TemplateDependencies.load(file_name)
+
+        eq_(self.dependencies.dependencies, loaded.dependencies)
+        eq_(['etc/app.conf', 'etc/dynamic.conf'], loaded.affected('role', ['_base.conf']))
+
+    def test_affected_conffiles(self):
+        """
+        ConfFiles can be narrowed to those affected by a change.
+        """
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host']},
+                                                roledefs={'role': ['host']}))
+        conffiles = ConfFiles(settings.for_env('any').all().next(),
+                              self.environment_loader,
+                              lambda _: {'foo': '_macros'})
+
+        affected = conffiles.affected_by(self.dependencies, 'role', ['_header.conf'])
+        eq_(['/etc/app.conf', '/etc/dynamic.conf'], sorted(c.remote for c in affected))
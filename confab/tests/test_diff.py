@@ -0,0 +1,140 @@
+"""
+Tests for diffs between remote and generated files.
+"""
+from hashlib import sha1
+from os.path import join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.conffiles import ConfFileDiff
+from confab.options import Options
+from confab.tests.utils import TempDir
+
+
+class TestConfFileDiff(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.remote = join(self.tmp_dir.path, 'remote')
+        self.generated = join(self.tmp_dir.path, 'generated')
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def _write(self, remote, generated):
+        with open(self.remote, 'wb') as file_:
+            file_.write(remote)
+        with open(self.generated, 'wb') as file_:
+            file_.write(generated)
+
+    def test_identical(self):
+        """
+        Identical files are compared by digest without computing a diff.
+        """
+        self._write('a\nb\n', 'a\nb\n')
+
+        with Options(diff=lambda *args, **kwargs: self.fail('diff computed')):
+            diff = ConfFileDiff(self.remote, self.generated, '/foo',
+                                generated_digest=sha1('a\nb\n').hexdigest())
+            ok_(not diff)
+            eq_([], diff.diff_lines)
+            with patch('sys.stdout') as mock_stdout:
+                diff.show()
+            ok_(not mock_stdout.write.called)
+
+    def test_changed(self):
+        """
+        Files with the same size but different content have a diff.
+        """
+        self._write('a\nb\n', 'a\nc\n')
+
+        diff = ConfFileDiff(self.remote, self.generated, '/foo')
+        ok_(diff)
+        eq_(['-b\n', '+c\n'], [line for line in diff.diff_lines
+                               if line[0] in '+-' and line[:3] not in ('---', '+++')])
+
+    def test_diff_lines_cached(self):
+        """
+        Diff lines are computed once per diff.
+        """
+        self._write('a\nb\n', 'a\nc\n')
+
+        diff = ConfFileDiff(self.remote, self.generated, '/foo')
+        lines = iter(['-b\n', '+c\n'])
+        with patch.object(diff, 'iter_diff_lines', return_value=lines) as mock_iter:
+            eq_(['-b\n', '+c\n'], diff.diff_lines)
+            eq_(['-b\n', '+c\n'], diff.diff_lines)
+        eq_(1, mock_iter.call_count)
+
+    def test_binary(self):
+        """
+        Binary files are compared by digest only.
+        """
+        self._write('\x00\x01', '\x00\x02')
+
+        with Options(diff=lambda *args, **kwargs: self.fail('diff computed')):
+            diff = ConfFileDiff(self.remote, self.generated, '/foo', binary=True)
+            ok_(diff)
+            with patch('sys.stdout') as mock_stdout:
+                diff.show()
+            lines = [args[0] for args, _ in mock_stdout.write.call_args_list if args[0].strip()]
+            eq_(1, len(lines))
+            ok_('Binary files differ' in lines[0])
+
+    def test_binary_content(self):
+        """
+        Files with binary content are not line-diffed, whatever their mime type.
+        """
+        self._write('text\n', 'text\x00\n')
+
+        with Options(diff=lambda *args, **kwargs: self.fail('diff computed')):
+            diff = ConfFileDiff(self.remote, self.generated, '/foo')
+            ok_(diff)
+            ok_(diff.binary)
+            eq_([], diff.diff_lines)
+
+    def test_latin1(self):
+        """
+        Text that is not valid UTF-8 is line-diffed, decoded as latin-1.
+        """
+        self._write('caf\xe9\nold\n', 'caf\xe9\nnew\n')
+
+        diff = ConfFileDiff(self.remote, self.generated, '/foo')
+        ok_(diff)
+        ok_(not diff.binary)
+        eq_([u' caf\xe9\n', u'-old\n', u'+new\n'], [line for line in diff.diff_lines
+                                                   if line[:3] not in ('---', '+++', '@@ ')])
+        with patch('sys.stdout') as mock_stdout:
+            diff.show()
+        ok_(any(u'caf\xe9'.encode('utf-8') in args[0]
+                for args, _ in mock_stdout.write.call_args_list))
+
+    def test_truncated(self):
+        """
+        Shown diffs are capped with a summary of the rest.
+        """
+        self._write(''.join('{}\n'.format(i) for i in range(10)),
+                    ''.join('{}\n'.format(i * 2) for i in range(10)))
+
+        with Options(max_diff_lines=3):
+            diff = ConfFileDiff(self.remote, self.generated, '/foo')
+            eq_(3, len(diff.diff_lines))
+            with patch('sys.stdout') as mock_stdout:
+                diff.show()
+
+        lines = [args[0] for args, _ in mock_stdout.write.call_args_list if args[0].strip()]
+        eq_(4, len(lines))
+        ok_('diff truncated' in lines[-1])
+
+    def test_missing(self):
+        """
+        Missing files are reported without comparing content.
+        """
+        with open(self.generated, 'w') as file_:
+            file_.write('a\n')
+
+        diff = ConfFileDiff(self.remote, self.generated, '/foo')
+        ok_(diff)
+        ok_(diff.missing_remote)
+        eq_([], diff.diff_lines)
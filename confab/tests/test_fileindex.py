@@ -0,0 +1,151 @@
+"""
+Tests for the template file index and mime types.
+"""
+from os import utime
+from os.path import join, dirname
+from unittest import TestCase
+from magic import Magic
+from mock import Mock, patch
+from nose.tools import eq_, ok_
+
+from confab.fileindex import FileIndex
+from confab.files import SNIFF_SIZE
+from confab.loaders import FileSystemEnvironmentLoader
+from confab.options import Options, _get_mime_type
+from confab.tests.utils import TempDir
+
+
+class TestFileIndex(TestCase):
+
+    def setUp(self):
+        self.index = FileIndex()
+
+    def _write(self, tmp_dir, file_name, content):
+        path = join(tmp_dir.path, file_name)
+        with open(path, 'wb') as file_:
+            file_.write(content)
+        return path
+
+    def test_text_and_binary(self):
+        """
+        Text and binary files are told apart from a prefix of their content.
+        """
+        with TempDir() as tmp_dir:
+            ok_(not self.index.is_binary(self._write(tmp_dir, 'text', 'foo = bar\n')))
+            ok_(not self.index.is_binary(self._write(tmp_dir, 'unicode', u'\xc5\xae'.encode('utf-8'))))
+            ok_(not self.index.is_binary(self._write(tmp_dir, 'empty', '')))
+            ok_(self.index.is_binary(self._write(tmp_dir, 'nul', 'foo\0bar')))
+            ok_(not self.index.is_binary(self._write(tmp_dir, 'latin1', 'caf\xe9\n')))
+        ok_(self.index.is_binary(join(dirname(__file__), 'templates/binary/role/test.png')))
+
+    def test_split_character(self):
+        """
+        A multi-byte character split by the sniff size is not mistaken for binary.
+        """
+        content = 'x' * (SNIFF_SIZE - 1) + u'\xc5'.encode('utf-8') + 'x'
+        with TempDir() as tmp_dir:
+            ok_(not self.index.is_binary(self._write(tmp_dir, 'split', content)))
+
+    def test_cached_by_stat(self):
+        """
+        Entries are cached until a file's size or modification time changes.
+        """
+        with TempDir() as tmp_dir:
+            path = self._write(tmp_dir, 'text', 'foo')
+
+            with patch('confab.fileindex._sniff_binary', return_value=False) as mock_sniff:
+                self.index.is_binary(path)
+                self.index.is_binary(path)
+                eq_(1, mock_sniff.call_count)
+
+                utime(path, (0, 0))
+                self.index.is_binary(path)
+                eq_(2, mock_sniff.call_count)
+
+    def test_mime_type(self):
+        """
+        Mime types from the default get_mime_type option are cached.
+        """
+        with TempDir() as tmp_dir:
+            path = self._write(tmp_dir, 'text', 'foo')
+
+            with patch('confab.fileindex._get_mime_type', return_value='text/plain') as get:
+                with Options(get_mime_type=get):
+                    eq_('text/plain', self.index.mime_type(path))
+                    eq_('text/plain', self.index.mime_type(path))
+            eq_(1, get.call_count)
+
+    def test_custom_mime_type(self):
+        """
+        Mime types from a custom get_mime_type option are not cached.
+        """
+        with TempDir() as tmp_dir:
+            path = self._write(tmp_dir, 'text', 'foo')
+
+            get_mime_type = Mock(return_value='text/x-custom')
+            with Options(get_mime_type=get_mime_type):
+                eq_('text/x-custom', self.index.mime_type(path))
+                eq_('text/x-custom', self.index.mime_type(path))
+            eq_(2, get_mime_type.call_count)
+            eq_([], self.index.dump())
+
+    def test_loader_binary(self):
+        """
+        The file system loader returns an empty template for binary files.
+        """
+        templates_dir = join(dirname(__file__), 'templates/binary')
+        environment = FileSystemEnvironmentLoader(templates_dir)('role')
+        template = environment.get_template('test.png')
+        eq_('', template.render())
+        eq_(join(templates_dir, 'role/test.png'), template.filename)
+
+    def test_save_and_load(self):
+        """
+        Entries persist between runs and are ignored once a file changes.
+        """
+        with TempDir() as tmp_dir:
+            path = self._write(tmp_dir, 'text', 'foo')
+            index_file = join(tmp_dir.path, 'cache', 'files.json')
+
+            self.index.is_binary(path)
+            self.index.save(index_file)
+
+            loaded = FileIndex()
+            loaded.load(index_file)
+            with patch('confab.fileindex._sniff_binary', return_value=False) as mock_sniff:
+                ok_(not loaded.is_binary(path))
+                eq_(0, mock_sniff.call_count)
+
+                utime(path, (0, 0))
+                loaded.is_binary(path)
+                eq_(1, mock_sniff.call_count)
+
+
+class TestMimeType(TestCase):
+
+    def test_same_as_libmagic(self):
+        """
+        Files with configuration suffixes get the same mime type as from libmagic.
+        """
+        contents = {
+            'app.conf': 'listen 80;\n',
+            'empty.conf': '',
+            'data.conf': '{"foo": "bar"}\n',
+            'list.conf': '["foo", "bar"]\n',
+            'binary.txt': '\x89PNG\r\n\x1a\n\0\0\0\rIHDR',
+            'app.properties': 'foo=bar\n',
+            'unicode.ini': u'[\xc5\xae]\nfoo = bar\n'.encode('utf-8'),
+            'markup.cfg': '<?xml version="1.0"?>\n<foo/>\n',
+            'control.conf': 'foo = bar\x01\x7f\n',
+            'image.txt': 'GIF89a\x01\x00\x01\x00',
+            'archive.conf': 'PK\x03\x04\x14\x00\x00\x00',
+            'program.cfg': 'MZ\x90\x00\x03\x00\x00\x00',
+            'mail.txt': 'Return-Path: <foo@example.com>\nReceived: from example.com\n\nfoo\n',
+        }
+        with TempDir() as tmp_dir:
+            for file_name, content in contents.iteritems():
+                path = join(tmp_dir.path, file_name)
+                with open(path, 'wb') as file_:
+                    file_.write(content)
+
+                eq_(Magic(mime=True).from_file(path), _get_mime_type(path), file_name)
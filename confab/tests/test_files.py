@@ -1,11 +1,12 @@
 """
 Tests for file operations.
 """
-from os.path import dirname, join
+from os.path import dirname, isdir, join
 from unittest import TestCase
 from nose.tools import eq_, ok_
 
-from confab.files import _import
+from confab.files import _ensure_dir, _files_equal, _import, CHUNK_SIZE
+from confab.tests.utils import TempDir
 
 
 class TestImport(TestCase):
@@ -33,3 +34,50 @@ class TestImport(TestCase):
             _import("broken", self.dir_name)
         # module_path was set: the module was found but had an import error
         eq_(join(self.dir_name, 'broken.py'), e.exception.module_path)
+
+
+class TestFilesEqual(TestCase):
+
+    def _compare(self, content, other_content):
+        with TempDir() as tmp_dir:
+            file_name = join(tmp_dir.path, 'file')
+            other_file_name = join(tmp_dir.path, 'other')
+            with open(file_name, 'wb') as file_:
+                file_.write(content)
+            with open(other_file_name, 'wb') as file_:
+                file_.write(other_content)
+            return _files_equal(file_name, other_file_name)
+
+    def test_equal(self):
+        content = '\x00\xff' * CHUNK_SIZE
+        ok_(self._compare(content, content))
+        ok_(self._compare('', ''))
+
+    def test_different(self):
+        content = '\x00' * (CHUNK_SIZE + 1)
+        ok_(not self._compare(content, content[:-1] + '\x01'))
+        ok_(not self._compare(content, content[:-1]))
+
+
+class TestEnsureDir(TestCase):
+
+    def test_existing(self):
+        """
+        Existing directories are accepted, even if created concurrently.
+        """
+        with TempDir() as tmp_dir:
+            dir_name = join(tmp_dir.path, 'foo', 'bar')
+            _ensure_dir(dir_name)
+            _ensure_dir(dir_name)
+            ok_(isdir(dir_name))
+
+    def test_file(self):
+        """
+        Existing files are not accepted as directories.
+        """
+        with TempDir() as tmp_dir:
+            file_name = join(tmp_dir.path, 'foo')
+            with open(file_name, 'w'):
+                pass
+            with self.assertRaises(OSError):
+                _ensure_dir(file_name)
@@ -3,18 +3,26 @@ Tests for template generation.
 """
 from unittest import TestCase
 from jinja2 import UndefinedError
-from os.path import join, dirname
+from os import stat
+from os.path import join, dirname, exists
 from nose.tools import eq_, ok_
 import filecmp
 
-from confab.conffiles import ConfFiles
+from confab.conffiles import ConfFiles, prepare_generated_dir
 from confab.definitions import Settings
 from confab.loaders import PackageEnvironmentLoader, FileSystemEnvironmentLoader
 from confab.data import DataLoader
+from confab.files import _ensure_dir
 from confab.options import Options
 from confab.tests.utils import TempDir
 
 
+def _write(file_name, content):
+    _ensure_dir(dirname(file_name))
+    with open(file_name, 'w') as file_:
+        file_.write(content)
+
+
 class TestGenerate(TestCase):
 
     def setUp(self):
@@ -154,3 +162,115 @@ class TestGenerate(TestCase):
             self.assertEquals('foo', tmp_dir.read('generated/host1/foo.txt'))
             self.assertEquals('bar', tmp_dir.read('generated/host1/bar.txt'))
             self.assertEquals('baz', tmp_dir.read('generated/host1/baz.conf'))
+
+    def test_incremental(self):
+        """
+        Regenerating leaves unchanged files alone, replaces changed files
+        and removes files that are no longer generated.
+        """
+        host_and_role = self.settings.for_env('any').all().next()
+        environment_loader = PackageEnvironmentLoader('confab.tests', 'templates/default')
+
+        with TempDir() as tmp_dir:
+            foo = join(tmp_dir.path, 'generated/localhost/foo.txt')
+            bar = join(tmp_dir.path, 'generated/localhost/bar/bar.txt')
+
+            ConfFiles(host_and_role,
+                      environment_loader,
+                      lambda _: {'bar': 'bar', 'foo': 'foo'}).generate(tmp_dir.path)
+            foo_stat, bar_stat = stat(foo), stat(bar)
+
+            ConfFiles(host_and_role,
+                      environment_loader,
+                      lambda _: {'bar': 'bar', 'foo': 'changed'}).generate(tmp_dir.path)
+
+            # unchanged file keeps its inode and mtime
+            eq_((bar_stat.st_ino, bar_stat.st_mtime), (stat(bar).st_ino, stat(bar).st_mtime))
+
+            # changed file is replaced
+            eq_('changed', tmp_dir.read('generated/localhost/foo.txt'))
+            ok_(foo_stat.st_ino != stat(foo).st_ino)
+
+            # renamed file is removed
+            ConfFiles(host_and_role,
+                      environment_loader,
+                      lambda _: {'bar': 'baz', 'foo': 'changed'}).generate(tmp_dir.path)
+            ok_(not exists(bar))
+            eq_('baz', tmp_dir.read('generated/localhost/baz/bar.txt'))
+
+            # directory left empty is removed
+            ok_(not exists(dirname(bar)))
+
+    def test_modified_generated_file(self):
+        """
+        Generated files modified outside of confab are regenerated.
+        """
+        conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+        with TempDir() as tmp_dir:
+            conffiles.generate(tmp_dir.path)
+            with open(join(tmp_dir.path, 'generated/localhost/foo.txt'), 'w') as file_:
+                file_.write('edited')
+
+            conffiles.generate(tmp_dir.path)
+            eq_('foo', tmp_dir.read('generated/localhost/foo.txt'))
+
+    def test_without_manifest(self):
+        """
+        Files generated before manifests existed are cleared once.
+        """
+        host_and_role = self.settings.for_env('any').all().next()
+
+        with TempDir() as tmp_dir:
+            _write(join(tmp_dir.path, 'generated/localhost/old/old.txt'), 'old')
+
+            ConfFiles(host_and_role,
+                      PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                      lambda _: {'bar': 'bar', 'foo': 'foo'}).generate(tmp_dir.path)
+
+            ok_(not exists(join(tmp_dir.path, 'generated/localhost/old')))
+            eq_('foo', tmp_dir.read('generated/localhost/foo.txt'))
+
+            # once there is a manifest, other files are left alone
+            _write(join(tmp_dir.path, 'generated/localhost/other.txt'), 'other')
+            ConfFiles(host_and_role,
+                      PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                      lambda _: {'bar': 'bar', 'foo': 'foo'}).generate(tmp_dir.path)
+            eq_('other', tmp_dir.read('generated/localhost/other.txt'))
+
+    def test_removed_role(self):
+        """
+        Files generated for a role that a host no longer has are removed.
+        """
+        self.settings.environmentdefs = {
+            'any': ['host1'],
+        }
+        self.settings.roledefs = {
+            'role1': ['host1'],
+            'role2': ['host1'],
+        }
+        self.settings.componentdefs = {
+            'role1': ['comp1'],
+            'role2': ['comp2'],
+        }
+        with TempDir() as tmp_dir:
+            _write(join(tmp_dir.path, 'generated/host1/old.txt'), 'old')
+
+            prepare_generated_dir(tmp_dir.path, 'host1', ['role1', 'role2'])
+            for host_and_role in self.settings.for_env('any').all():
+                ConfFiles(host_and_role,
+                          PackageEnvironmentLoader('confab.tests', 'templates/components'),
+                          DataLoader(join(dirname(__file__), 'data/components'))
+                          ).generate(tmp_dir.path)
+
+            ok_(not exists(join(tmp_dir.path, 'generated/host1/old.txt')))
+            eq_('foo', tmp_dir.read('generated/host1/foo.txt'))
+            eq_('bar', tmp_dir.read('generated/host1/bar/bar.txt'))
+
+            prepare_generated_dir(tmp_dir.path, 'host1', ['role2'])
+
+            ok_(not exists(join(tmp_dir.path, 'generated/host1/foo.txt')))
+            eq_('bar', tmp_dir.read('generated/host1/bar/bar.txt'))
+            ok_(not exists(join(tmp_dir.path, 'cache/manifests/host1/role1.json')))
@@ -0,0 +1,167 @@
+"""
+Tests for combining the configuration files of all roles of a host.
+"""
+from fabric.api import settings
+from os import makedirs
+from os.path import dirname, exists, join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.definitions import Settings
+from confab.diff import diff
+from confab.iter import iter_host_conffiles
+from confab.options import Options
+from confab.pull import pull
+from confab.push import push
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestHostConfFiles(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1']},
+                                                     roledefs={'a': ['host1'],
+                                                               'b': ['host1']}))
+        self.settings.directory = self.tmp_dir.path
+        makedirs(join(self.tmp_dir.path, 'data'))
+        makedirs(join(self.tmp_dir.path, 'root'))
+        self._write('templates/a/a.txt', 'a')
+        self._write('templates/a/common.txt', 'common')
+        self._write('templates/b/b.txt', 'b')
+        self._write('templates/b/common.txt', 'common')
+        self.transport = LocalTransport(join(self.tmp_dir.path, 'root'))
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def _write(self, file_name, content):
+        path = join(self.tmp_dir.path, file_name)
+        if not exists(dirname(path)):
+            makedirs(dirname(path))
+        with open(path, 'w') as file_:
+            file_.write(content)
+
+    def test_combined(self):
+        """
+        The conffiles of all roles are combined, with duplicates once.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            conffiles = list(iter_host_conffiles(self.tmp_dir.path))
+
+        eq_(1, len(conffiles))
+        eq_('a, b', conffiles[0].role)
+        eq_(['a.txt', 'common.txt', 'b.txt'], [conffile.name for conffile in conffiles[0].conffiles])
+        eq_(1, len(conffiles[0].duplicates))
+
+    def test_close_on_failure(self):
+        """
+        The transport is closed even if working on a host fails.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport):
+                with patch.object(self.transport, 'close') as close:
+                    with self.assertRaises(IOError):
+                        for conffiles in iter_host_conffiles(self.tmp_dir.path):
+                            conffiles._get_transport()
+                            raise IOError('broken')
+
+        eq_(1, close.call_count)
+
+    def test_pull(self):
+        """
+        All files of a host are pulled with one transfer.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport):
+                with patch('sys.stdout'):
+                    pull(self.tmp_dir.path)
+
+        eq_(1, self.transport.calls)
+
+    def test_push(self):
+        """
+        All changed files of a host are pushed at once.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport):
+                with patch('confab.conffiles.confirm', return_value=True) as mock_confirm:
+                    with patch('sys.stdout'):
+                        push(self.tmp_dir.path)
+
+        eq_(1, mock_confirm.call_count)
+        eq_(3, self.transport.calls)  # checksums, upload and extract
+        for name in ['a', 'b', 'common']:
+            eq_(name, self.tmp_dir.read('root/{}.txt'.format(name)))
+
+    def test_push_directory(self):
+        """
+        Files are generated and pulled into the directory pushed from, not the
+        directory of the settings.
+        """
+        self.settings.directory = join(self.tmp_dir.path, 'elsewhere')
+
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport, assume_yes=True):
+                with patch('sys.stdout'):
+                    push(self.tmp_dir.path)
+
+        for name in ['a', 'b', 'common']:
+            eq_(name, self.tmp_dir.read('root/{}.txt'.format(name)))
+            eq_(name, self.tmp_dir.read('generated/host1/{}.txt'.format(name)))
+        ok_(exists(join(self.tmp_dir.path, 'remotes', 'host1')))
+        ok_(not exists(join(self.tmp_dir.path, 'elsewhere')))
+
+    def test_conflict(self):
+        """
+        Files generated differently by two roles are an error when pushing.
+        """
+        self._write('templates/b/common.txt', 'different')
+
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport):
+                with patch('sys.stdout'):
+                    with patch('sys.stderr'):
+                        with self.assertRaises(SystemExit):
+                            push(self.tmp_dir.path)
+
+        eq_(1, self.transport.calls)  # checksums only
+        ok_(not exists(join(self.tmp_dir.path, 'root/common.txt')))
+
+    def test_conflict_diff(self):
+        """
+        Files generated differently by two roles are a warning when diffing.
+        """
+        self._write('templates/b/common.txt', 'different')
+
+        with settings(environmentdef=self.settings.for_env('any')):
+            with Options(get_transport=lambda host: self.transport):
+                with patch('confab.conffiles.warn') as mock_warn:
+                    with patch('sys.stdout'):
+                        diff(self.tmp_dir.path)
+
+        eq_(1, mock_warn.call_count)
+        ok_('common.txt' in mock_warn.call_args[0][0])
+
+    def test_conflict_first_role(self):
+        """
+        Files generated differently by two roles are generated and diffed
+        from the first role.
+        """
+        self._write('templates/b/common.txt', 'different')
+        self._write('root/common.txt', 'remote')
+
+        for checksum_remotes in (False, True):
+            with settings(environmentdef=self.settings.for_env('any')):
+                with Options(get_transport=lambda host: self.transport,
+                             checksum_remotes=checksum_remotes):
+                    with patch('confab.conffiles.warn'):
+                        with patch('sys.stdout') as mock_stdout:
+                            diff(self.tmp_dir.path)
+
+            eq_('common', self.tmp_dir.read('generated/host1/common.txt'))
+            output = ''.join(args[0] for args, _ in mock_stdout.write.call_args_list)
+            ok_('+common' in output)
+            ok_('different' not in output)
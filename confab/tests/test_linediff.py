@@ -0,0 +1,86 @@
+"""
+Tests for histogram line diffs.
+"""
+from difflib import unified_diff
+from random import Random
+from unittest import TestCase
+from nose.tools import eq_
+
+from confab.linediff import histogram_diff, histogram_matching_blocks
+
+
+def _patch(a, diff_lines):
+    """
+    Apply unified diff lines to a.
+    """
+    result = []
+    index = 0
+    for line in diff_lines:
+        if line.startswith(('---', '+++')):
+            continue
+        if line.startswith('@@'):
+            start = int(line.split()[1][1:].split(',')[0])
+            length = line.split()[1].split(',')[1:]
+            start = start if length == ['0'] else start - 1
+            result.extend(a[index:start])
+            index = start
+        elif line.startswith('+'):
+            result.append(line[1:])
+        else:
+            eq_(a[index], line[1:])
+            if line.startswith(' '):
+                result.append(line[1:])
+            index += 1
+    result.extend(a[index:])
+    return result
+
+
+class TestHistogramDiff(TestCase):
+
+    def test_same_as_difflib(self):
+        """
+        Simple changes produce the same diff as difflib.
+        """
+        a = ['one\n', 'two\n', 'three\n', 'four\n']
+        b = ['zero\n', 'one\n', 'tree\n', 'four\n']
+
+        eq_(list(unified_diff(a, b, 'remote', 'generated')),
+            list(histogram_diff(a, b, 'remote', 'generated')))
+
+    def test_identical(self):
+        """
+        Identical inputs have no diff.
+        """
+        a = ['same\n'] * 10
+        eq_([], list(histogram_diff(a, list(a))))
+        eq_([(0, 0, 10), (10, 10, 0)], histogram_matching_blocks(a, list(a)))
+
+    def test_random_edits(self):
+        """
+        Diffs of randomly edited inputs with many repeated lines apply cleanly.
+        """
+        random = Random(0)
+        for _ in range(500):
+            a = [random.choice('abcde') + '\n' for _ in range(random.randint(0, 40))]
+            b = list(a)
+            for _ in range(random.randint(0, 8)):
+                index = random.randint(0, len(b))
+                if random.random() < 0.5 and index < len(b):
+                    del b[index]
+                else:
+                    b.insert(index, random.choice('abcdef') + '\n')
+
+            for i, j, size in histogram_matching_blocks(a, b):
+                eq_(a[i:i + size], b[j:j + size])
+            eq_(b, _patch(a, list(histogram_diff(a, b))))
+
+    def test_scattered_edits(self):
+        """
+        Every line of many scattered edits is matched around them.
+        """
+        a = ['line {}\n'.format(i) for i in range(2000)]
+        b = [line if i % 2 else 'changed {}\n'.format(i) for i, line in enumerate(a)]
+
+        blocks = histogram_matching_blocks(a, b)
+        eq_(1000, sum(size for _, _, size in blocks))
+        eq_(b, _patch(a, list(histogram_diff(a, b))))
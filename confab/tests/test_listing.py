@@ -1,13 +1,15 @@
 """
 Test configuration file listing.
 """
-from jinja2 import UndefinedError
+from jinja2 import Environment, UndefinedError
+from mock import patch
 from nose.tools import eq_, ok_
 from unittest import TestCase
 from warnings import catch_warnings
 
-from confab.conffiles import ConfFiles
+from confab.conffiles import ConfFiles, _name_code, _render_name
 from confab.definitions import Settings
+from confab.jinja_filters import jinja_filters
 from confab.loaders import PackageEnvironmentLoader
 from confab.options import Options
 
@@ -110,3 +112,40 @@ class TestListing(TestCase):
 
                 eq_(0, len(conffiles.conffiles))
                 eq_(1, len(captured_warnings))
+
+    def test_name_rendering(self):
+        """
+        Plain names skip Jinja; templated names are compiled once.
+        """
+        environment = PackageEnvironmentLoader('confab.tests', 'templates/default')('role')
+        plain = environment.get_template('foo.txt')
+        template = environment.get_template('{{bar}}/bar.txt')
+        _name_code.clear()
+
+        with patch.object(Environment, 'compile', autospec=True,
+                          side_effect=Environment.compile) as compile_:
+            eq_(u'foo.txt', _render_name(plain, {}))
+            eq_(0, compile_.call_count)
+
+            eq_(u'bar/bar.txt', _render_name(template, {'bar': 'bar'}))
+            eq_(u'baz/bar.txt', _render_name(template, {'bar': 'baz'}))
+            eq_(1, compile_.call_count)
+
+    def test_name_rendering_hosts(self):
+        """
+        Templated names are compiled once for all hosts, though each host
+        has its own environment.
+        """
+        loader = PackageEnvironmentLoader('confab.tests', 'templates/default')
+        templates = []
+        for host in ('host1', 'host2'):
+            environment = loader('role')
+            jinja_filters.register(environment)
+            templates.append((host, environment.get_template('{{bar}}/bar.txt')))
+        _name_code.clear()
+
+        with patch.object(Environment, 'compile', autospec=True,
+                          side_effect=Environment.compile) as compile_:
+            for host, template in templates:
+                eq_(u'{}/bar.txt'.format(host), _render_name(template, {'bar': host}))
+            eq_(1, compile_.call_count)
@@ -0,0 +1,121 @@
+"""
+Tests for Jinja2 environment loading.
+"""
+from jinja2 import PackageLoader
+from os import makedirs, utime, walk
+from os.path import join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+import sys
+import zipfile
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.files import _is_archived
+from confab.loaders import (PackageEnvironmentLoader, FileSystemEnvironmentLoader,
+                            ConfabPackageLoader, _get_provider, get_provider)
+from confab.tests.utils import TempDir
+
+
+class TestPackageEnvironmentLoader(TestCase):
+
+    def setUp(self):
+        self.settings = Settings()
+        self.settings.environmentdefs = {
+            'any': ['localhost'],
+        }
+        self.settings.roledefs = {
+            'role': ['localhost'],
+        }
+
+    def _make_zipped_package(self, dir_name, package_name):
+        """
+        Create a zipped package with templates and put it on the path.
+        """
+        archive = join(dir_name, package_name + '.zip')
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr(package_name + '/__init__.py', '')
+            zip_file.writestr(package_name + '/templates/role/foo.txt', '{{foo}}')
+            zip_file.writestr(package_name + '/templates/role/{{bar}}/bar.txt', '{{bar}}')
+        sys.path.insert(0, archive)
+        self.addCleanup(sys.path.remove, archive)
+        self.addCleanup(sys.modules.pop, package_name, None)
+
+    def test_zipped_package(self):
+        """
+        Templates are read directly from zipped packages.
+        """
+        with TempDir() as tmp_dir:
+            self._make_zipped_package(tmp_dir.path, 'confab_zipped')
+
+            conffiles = ConfFiles(self.settings.for_env('any').all().next(),
+                                  PackageEnvironmentLoader('confab_zipped'),
+                                  lambda _: {'bar': 'bar', 'foo': 'foo'})
+            eq_(2, len(conffiles.conffiles))
+
+            for conffile in conffiles.conffiles:
+                ok_(_is_archived(conffile.template.filename))
+
+            conffiles.generate(tmp_dir.path)
+
+            eq_('foo', tmp_dir.read('generated/localhost/foo.txt'))
+            eq_('bar', tmp_dir.read('generated/localhost/bar/bar.txt'))
+
+    def test_cached_provider_and_listing(self):
+        """
+        Providers and template listings are computed once per package and path.
+        """
+        with TempDir() as tmp_dir:
+            self._make_zipped_package(tmp_dir.path, 'confab_zipped_cached')
+
+            with patch('confab.loaders.get_provider', wraps=get_provider) as mock_get_provider:
+                for _ in range(3):
+                    environment = PackageEnvironmentLoader('confab_zipped_cached')('role')
+                    ok_(isinstance(environment.loader, ConfabPackageLoader))
+                    eq_(['foo.txt', '{{bar}}/bar.txt'], environment.list_templates())
+
+                eq_(1, mock_get_provider.call_count)
+
+                with patch.object(PackageLoader, 'list_templates') as mock_list:
+                    environment.list_templates()
+                    eq_(0, mock_list.call_count)
+
+    def test_package_loader_init(self):
+        """
+        Loaders are initialized by Jinja's PackageLoader, with the cached provider.
+        """
+        with patch.object(PackageLoader, '__init__', autospec=True,
+                          side_effect=PackageLoader.__init__) as mock_init:
+            loader = ConfabPackageLoader('confab.tests', 'templates/default/role')
+
+        eq_(1, mock_init.call_count)
+        ok_(loader.provider is _get_provider('confab.tests'))
+        ok_(loader.filesystem_bound)
+        ok_(not loader.archived)
+        eq_(u'{{foo}}', loader.get_source(None, 'foo.txt')[0].strip())
+
+
+class TestFileSystemEnvironmentLoader(TestCase):
+
+    def test_cached_listing(self):
+        """
+        Template directories are walked again only after they change.
+        """
+        with TempDir() as tmp_dir:
+            makedirs(join(tmp_dir.path, 'role', 'etc'))
+            open(join(tmp_dir.path, 'role', 'etc', 'foo.txt'), 'w').close()
+
+            with patch('confab.loaders.walk', wraps=walk) as mock_walk:
+                for _ in range(3):
+                    environment = FileSystemEnvironmentLoader(tmp_dir.path)('role')
+                    eq_(['etc/foo.txt'], environment.list_templates())
+                eq_(1, mock_walk.call_count)
+
+                # adding a file changes the directory's mtime
+                open(join(tmp_dir.path, 'role', 'etc', 'bar.txt'), 'w').close()
+                utime(join(tmp_dir.path, 'role', 'etc'), (0, 0))
+
+                environment = FileSystemEnvironmentLoader(tmp_dir.path)('role')
+                eq_(['etc/bar.txt', 'etc/foo.txt'], environment.list_templates())
+                eq_(2, mock_walk.call_count)
@@ -0,0 +1,148 @@
+"""
+Tests for multiplexed remote commands.
+"""
+from os import makedirs, remove
+from os.path import join
+from timeit import default_timer
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.multiplex import Multiplexer, MultiplexedTransport, ProcessChannel, checksums_all
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestMultiplexer(TestCase):
+
+    def setUp(self):
+        self.multiplexer = Multiplexer(ProcessChannel)
+
+    def test_run_all(self):
+        """
+        Commands on several hosts run at the same time in one thread.
+        """
+        hosts = ['host{}'.format(index) for index in range(5)]
+
+        start = default_timer()
+        outputs = self.multiplexer.run_all(dict((host, ('sleep 0.5; echo {}'.format(host), None))
+                                                for host in hosts))
+
+        ok_(default_timer() - start < 1.5)
+        eq_(dict((host, host + '\n') for host in hosts), outputs)
+
+    def test_stdin(self):
+        """
+        Commands read their stdin.
+        """
+        eq_('foo', self.multiplexer.run('host', 'cat', 'foo'))
+
+    def test_large_output(self):
+        """
+        Output larger than pipe buffers is collected.
+        """
+        eq_(1024 * 1024, len(self.multiplexer.run('host', 'head -c 1048576 /dev/zero')))
+
+    def test_large_stdin(self):
+        """
+        Input larger than pipe buffers is fed while output is collected.
+        """
+        eq_(1024 * 1024, len(self.multiplexer.run('host',
+                                                  'head -c 1048576 /dev/zero; cat > /dev/null',
+                                                  'x' * 1024 * 1024)))
+
+    def test_unread_stdin(self):
+        """
+        Commands may exit without reading their input.
+        """
+        eq_('foo\n', self.multiplexer.run('host', 'echo foo', 'x' * 1024 * 1024))
+
+    def test_failure(self):
+        """
+        Failures on any host abort once all commands finished.
+        """
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self.multiplexer.run_all({'host1': ('true', None),
+                                          'host2': ('echo failed >&2; exit 1', None)})
+
+
+class TestMultiplexedTransport(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.multiplexer = Multiplexer(ProcessChannel)
+        self.transports = []
+        for host in ('host1', 'host2'):
+            root = join(self.tmp_dir.path, host)
+            makedirs(join(root, 'etc'))
+            with open(join(root, 'etc', 'foo'), 'w') as file_:
+                file_.write(host + '\n')
+            self.transports.append(MultiplexedTransport(host, self.multiplexer,
+                                                        use_sudo=False,
+                                                        root=root))
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_operations(self):
+        """
+        Transport operations run through the multiplexer.
+        """
+        transport = self.transports[0]
+        ok_(transport.exists('/etc/foo'))
+        eq_(None, transport.checksum('/etc/missing'))
+
+        eq_(set(['/etc/foo']), transport.fetch(['/etc/foo'], join(self.tmp_dir.path, 'local')))
+        eq_('host1', self.tmp_dir.read('local/etc/foo'))
+
+    def test_checksums_all(self):
+        """
+        Files on all hosts of a multiplexer are checksummed at the same time.
+        """
+        local_transport = LocalTransport(join(self.tmp_dir.path, 'host1'))
+
+        with patch.object(self.multiplexer, 'run_all', wraps=self.multiplexer.run_all) as run_all:
+            results = checksums_all([(self.transports[0], ['/etc/foo']),
+                                     (self.transports[1], ['/etc/foo', '/etc/missing']),
+                                     (local_transport, ['/etc/foo'])])
+
+        eq_(1, run_all.call_count)
+        eq_(1, local_transport.calls)
+        eq_(results[0]['/etc/foo'].digest, results[2]['/etc/foo'].digest)
+        ok_(results[0]['/etc/foo'].digest != results[1]['/etc/foo'].digest)
+        eq_(None, results[1]['/etc/missing'])
+
+    def test_sftp_session(self):
+        """
+        One SFTP session is used per transport and closed with it.
+        """
+        transport = self.transports[0]
+        with patch('confab.multiplex.connections') as connections:
+            transport.get('/etc/foo', join(self.tmp_dir.path, 'foo'))
+            transport.get('/etc/bar', join(self.tmp_dir.path, 'bar'))
+            transport.close()
+
+        eq_(1, connections['host1'].open_sftp.call_count)
+        sftp = connections['host1'].open_sftp.return_value
+        eq_(2, sftp.get.call_count)
+        eq_(1, sftp.close.call_count)
+
+    def test_upload(self):
+        """
+        Files are uploaded to new temporary files with unpredictable names.
+        """
+        transport = self.transports[0]
+        with patch('confab.multiplex.connections') as connections:
+            first = transport.upload(join(self.tmp_dir.path, 'host1', 'etc', 'foo'))
+            second = transport.upload(join(self.tmp_dir.path, 'host1', 'etc', 'foo'))
+
+        try:
+            ok_(first != second)
+            ok_('foo' not in first)
+            eq_([((join(self.tmp_dir.path, 'host1', 'etc', 'foo'), first),),
+                 ((join(self.tmp_dir.path, 'host1', 'etc', 'foo'), second),)],
+                [call[:1] for call in connections['host1'].open_sftp.return_value.put.call_args_list])
+        finally:
+            remove(first)
+            remove(second)
@@ -0,0 +1,166 @@
+"""
+Tests for parallel execution.
+"""
+from fabric.api import env, settings
+from os import makedirs
+from os.path import exists, join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.definitions import Settings
+from confab.fileindex import FileIndex, get_file_index_file
+from confab.generate import generate
+from confab.iter import map_hosts
+from confab.jinja_filters import JinjaFilters
+from confab.options import Options
+from confab.parallel import map_units
+from confab.pull import pull
+from confab.push import push
+from confab.rendercache import render_cache
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestMapUnits(TestCase):
+
+    def test_ordered_output(self):
+        """
+        Results and captured output follow the order of the units.
+        """
+        def func(unit):
+            print 'unit {}'.format(unit)
+            return unit * 2
+
+        with patch('sys.stdout') as mock_stdout:
+            results = list(map_units(func, range(5), 3))
+
+        eq_([(i, i * 2) for i in range(5)], results)
+        eq_(['unit {}\n'.format(i) for i in range(5)],
+            [args[0] for args, _ in mock_stdout.write.call_args_list])
+
+    def test_failures(self):
+        """
+        Failing units are reported and abort once all units have run.
+        """
+        def func(unit):
+            if unit == 1:
+                raise Exception('broken')
+            return unit
+
+        results = []
+        with patch('sys.stdout'), patch('sys.stderr') as mock_stderr:
+            with self.assertRaises(SystemExit):
+                for result in map_units(func, range(3), 2):
+                    results.append(result)
+
+        eq_([(0, 0), (2, 2)], results)
+        ok_('1 of 3 failed' in ''.join(args[0] for args, _ in mock_stderr.write.call_args_list))
+
+
+    def test_spill_dir(self):
+        """
+        Content spilled by workers is removed once all units have run.
+        """
+        def func(unit):
+            ok_(render_cache.add('spilled').is_spilled())
+            return render_cache._get_spill_dir()
+
+        with Options(render_spill_size=4):
+            spill_dirs = set(spill_dir for _, spill_dir in map_units(func, range(3), 2))
+
+        eq_(1, len(spill_dirs))
+        ok_(not exists(spill_dirs.pop()))
+
+
+class TestParallelGenerate(TestCase):
+
+    def test_generate(self):
+        """
+        Generating with several jobs produces the same files, using registered filters.
+        """
+        def shout(value):
+            return value.upper()
+
+        settings_ = Settings.load_from_dict(dict(environmentdefs={'any': ['host1', 'host2',
+                                                                          'host3']},
+                                                 roledefs={'role': ['host1', 'host2',
+                                                                    'host3']}))
+
+        with TempDir() as tmp_dir:
+            settings_.directory = tmp_dir.path
+            makedirs(join(tmp_dir.path, 'templates', 'role'))
+            makedirs(join(tmp_dir.path, 'data'))
+            with open(join(tmp_dir.path, 'templates', 'role', 'host.txt'), 'w') as file_:
+                file_.write('{{ confab.host|shout }}')
+
+            with settings(environmentdef=settings_.for_env('any')):
+                with JinjaFilters(shout):
+                    with patch('sys.stdout'):
+                        generate(tmp_dir.path, jobs=2)
+
+            for host in ['host1', 'host2', 'host3']:
+                eq_(host.upper(), tmp_dir.read('generated/{}/host.txt'.format(host)))
+
+            # properties computed in the workers are persisted
+            index = FileIndex()
+            index.load(get_file_index_file(tmp_dir.path))
+            ok_(join(tmp_dir.path, 'templates', 'role', 'host.txt') in
+                [file_name for file_name, _, _ in index.dump()])
+
+
+class TestParallelHosts(TestCase):
+
+    def setUp(self):
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1', 'host2',
+                                                                              'host3']},
+                                                     roledefs={'role': ['host1', 'host2',
+                                                                        'host3']}))
+
+    def test_pull(self):
+        """
+        Pulling from several hosts at a time fetches each host's files.
+        """
+        with TempDir() as tmp_dir:
+            self.settings.directory = tmp_dir.path
+            makedirs(join(tmp_dir.path, 'templates', 'role'))
+            makedirs(join(tmp_dir.path, 'data'))
+            with open(join(tmp_dir.path, 'templates', 'role', 'host.txt'), 'w') as file_:
+                file_.write('{{ confab.host }}')
+            for host in ['host1', 'host2', 'host3']:
+                makedirs(join(tmp_dir.path, 'roots', host))
+                with open(join(tmp_dir.path, 'roots', host, 'host.txt'), 'w') as file_:
+                    file_.write('remote ' + host)
+
+            get_transport = lambda host: LocalTransport(join(tmp_dir.path, 'roots', host))
+            with settings(environmentdef=self.settings.for_env('any')):
+                with Options(get_transport=get_transport):
+                    with patch('sys.stdout'):
+                        pull(tmp_dir.path, parallel=3)
+
+            for host in ['host1', 'host2', 'host3']:
+                eq_('remote ' + host, tmp_dir.read('remotes/{}/host.txt'.format(host)))
+
+    def test_no_prompts(self):
+        """
+        Workers abort instead of prompting.
+        """
+        with TempDir() as tmp_dir:
+            makedirs(join(tmp_dir.path, 'templates', 'role'))
+            makedirs(join(tmp_dir.path, 'data'))
+            with settings(environmentdef=self.settings.for_env('any')):
+                with patch('sys.stdout'):
+                    results = list(map_hosts(lambda conffiles: env.abort_on_prompts,
+                                             2,
+                                             tmp_dir.path))
+
+        eq_([('host1', True), ('host2', True), ('host3', True)], sorted(results))
+
+    def test_push_requires_yes(self):
+        """
+        Pushing to several hosts at a time cannot prompt.
+        """
+        with settings(environmentdef=self.settings.for_env('any')):
+            with patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    push(parallel=2)
@@ -0,0 +1,133 @@
+"""
+Tests for pipelined execution.
+"""
+import time
+from StringIO import StringIO
+from fabric.api import settings
+from os import makedirs
+from os.path import join
+from threading import Lock
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.definitions import Settings
+from confab.diff import diff
+from confab.options import Options
+from confab.pipeline import pipeline
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestPipeline(TestCase):
+
+    def test_order(self):
+        """
+        Results follow the order of the units through all stages.
+        """
+        results = list(pipeline(range(10), [lambda x: x + 1, lambda x: x * 2], 2))
+        eq_([(x + 1) * 2 for x in range(10)], results)
+
+    def test_overlap(self):
+        """
+        Stages work on different units at the same time.
+        """
+        def slow(x):
+            time.sleep(0.05)
+            return x
+
+        start = time.time()
+        for _ in pipeline(range(4), [slow], 1):
+            time.sleep(0.05)
+        ok_(time.time() - start < 0.35)
+
+    def test_bounded(self):
+        """
+        Stages run at most ``depth`` units ahead of the caller.
+        """
+        lock = Lock()
+        in_flight = [0, 0]
+
+        def stage(x):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            return x
+
+        for _ in pipeline(range(20), [stage], 2):
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+
+        # one in the caller, two queued and one in the stage
+        ok_(in_flight[1] <= 4)
+
+    def test_output(self):
+        """
+        Output of the stages is printed with its unit, not while the caller
+        works on an earlier one.
+        """
+        def stage(x):
+            print 'stage {}'.format(x)
+            return x
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            for x in pipeline(range(3), [stage], 2):
+                # let the stage run ahead
+                time.sleep(0.05)
+                print 'caller {}'.format(x)
+
+        eq_(''.join('stage {0}\ncaller {0}\n'.format(x) for x in range(3)),
+            mock_stdout.getvalue())
+
+    def test_failure(self):
+        """
+        Failures are raised in the calling thread and stop the pipeline.
+        """
+        calls = []
+
+        def stage(x):
+            calls.append(x)
+            if x == 2:
+                raise ValueError(x)
+            return x
+
+        results = []
+        with self.assertRaises(ValueError):
+            for result in pipeline(range(100), [stage], 1):
+                results.append(result)
+
+        eq_([0, 1], results)
+        ok_(len(calls) < 100)
+
+
+class TestPipelinedDiff(TestCase):
+
+    def test_diff(self):
+        """
+        Diffs of several hosts are computed through the pipeline.
+        """
+        hosts = ['host1', 'host2', 'host3']
+        settings_ = Settings.load_from_dict(dict(environmentdefs={'any': hosts},
+                                                 roledefs={'role': hosts}))
+
+        with TempDir() as tmp_dir:
+            settings_.directory = tmp_dir.path
+            makedirs(join(tmp_dir.path, 'templates', 'role'))
+            makedirs(join(tmp_dir.path, 'data'))
+            with open(join(tmp_dir.path, 'templates', 'role', 'host.txt'), 'w') as file_:
+                file_.write('{{ confab.host }}')
+            for host in hosts:
+                makedirs(join(tmp_dir.path, 'roots', host))
+                with open(join(tmp_dir.path, 'roots', host, 'host.txt'), 'w') as file_:
+                    file_.write('remote ' + host)
+
+            get_transport = lambda host: LocalTransport(join(tmp_dir.path, 'roots', host))
+            with settings(environmentdef=settings_.for_env('any')):
+                with Options(get_transport=get_transport):
+                    with patch('sys.stdout'):
+                        diff(tmp_dir.path)
+
+            for host in hosts:
+                eq_(host, tmp_dir.read('generated/{}/host.txt'.format(host)))
+                eq_('remote ' + host, tmp_dir.read('remotes/{}/host.txt'.format(host)))
@@ -0,0 +1,209 @@
+"""
+Tests for planning and applying configuration file changes.
+"""
+import json
+from os import makedirs
+from os.path import exists, join
+from unittest import TestCase
+from fabric.api import settings
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.definitions import Settings
+from confab.options import Options
+from confab.plan import apply, load_plan, plan
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestPlan(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1']},
+                                                     roledefs={'role': ['host1']}))
+        self.settings.directory = self.tmp_dir.path
+        makedirs(join(self.tmp_dir.path, 'data'))
+        makedirs(join(self.tmp_dir.path, 'templates', 'role'))
+        makedirs(join(self.tmp_dir.path, 'root'))
+        self._write('templates/role/foo.txt', 'new foo\n')
+        self._write('templates/role/bar.txt', 'bar\n')
+        self._write('root/foo.txt', 'old foo\n')
+        self._write('root/bar.txt', 'bar\n')
+        self.transport = LocalTransport(join(self.tmp_dir.path, 'root'))
+        self.plan_file = join(self.tmp_dir.path, 'plan.json')
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def _write(self, file_name, content):
+        with open(join(self.tmp_dir.path, file_name), 'w') as file_:
+            file_.write(content)
+
+    def _run(self, task, environment='any', **kwargs):
+        self.transport.calls = 0
+        kwargs.setdefault('assume_yes', True)
+        with settings(environmentdef=self.settings.for_env(environment)):
+            with Options(get_transport=lambda host: self.transport, **kwargs):
+                with patch('sys.stdout'):
+                    task(self.tmp_dir.path, self.plan_file)
+
+    def test_plan(self):
+        """
+        Plans record the digests and diffs of files to push.
+        """
+        self._run(plan)
+
+        with open(self.plan_file) as file_:
+            plan_ = json.load(file_)
+        eq_('any', plan_['environment'])
+        eq_(['host1'], [host['host'] for host in plan_['hosts']])
+        changes = plan_['hosts'][0]['changes']
+        eq_(['/foo.txt'], [change['remote'] for change in changes])
+        eq_('555f3a8d296c10cef97ecbfa31559a401630a8a1', changes[0]['remote_digest'])
+        ok_('-old foo\n' in changes[0]['diff'])
+        ok_('+new foo\n' in changes[0]['diff'])
+        # planning pushes nothing
+        eq_('old foo', self.tmp_dir.read('root/foo.txt'))
+
+    def test_apply(self):
+        """
+        Planned files are pushed after one checksum command, without generating.
+        """
+        self._run(plan)
+
+        with patch('confab.conffiles.ConfFiles.generate') as generate:
+            self._run(apply)
+
+        eq_(0, generate.call_count)
+        eq_(3, self.transport.calls)  # checksums, upload and extract
+        eq_('new foo', self.tmp_dir.read('root/foo.txt'))
+
+    def test_remote_drift(self):
+        """
+        Plans are not applied to hosts whose remote files changed since planning.
+        """
+        self._run(plan)
+        self._write('root/foo.txt', 'other foo\n')
+
+        with patch.object(self.transport, 'close') as close:
+            with patch('sys.stderr'):
+                with self.assertRaises(SystemExit):
+                    self._run(apply)
+
+        eq_(1, self.transport.calls)
+        eq_(1, close.call_count)
+        eq_('other foo', self.tmp_dir.read('root/foo.txt'))
+
+    def test_generated_drift(self):
+        """
+        Plans are not applied when generated files changed since planning.
+        """
+        self._run(plan)
+        self._write('generated/host1/foo.txt', 'regenerated foo\n')
+
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self._run(apply)
+
+        eq_('old foo', self.tmp_dir.read('root/foo.txt'))
+
+    def test_environment(self):
+        """
+        Plans are only applied to the environment they were made for.
+        """
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1'],
+                                                                      'other': ['host1']},
+                                                     roledefs={'role': ['host1']}))
+        self.settings.directory = self.tmp_dir.path
+        self._run(plan)
+
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self._run(apply, 'other')
+
+        eq_(0, self.transport.calls)
+
+    def test_confirm(self):
+        """
+        Applying a plan is confirmed once, unless assuming yes.
+        """
+        self._run(plan)
+
+        with patch('confab.plan.confirm', return_value=False) as confirm:
+            self._run(apply, assume_yes=False)
+
+        eq_(1, confirm.call_count)
+        eq_(1, self.transport.calls)  # checksums
+        eq_('old foo', self.tmp_dir.read('root/foo.txt'))
+
+
+class TestApplyHosts(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.settings = Settings.load_from_dict(dict(environmentdefs={'any': ['host1', 'host2',
+                                                                              'host3']},
+                                                     roledefs={'role': ['host1', 'host2',
+                                                                        'host3']}))
+        self.settings.directory = self.tmp_dir.path
+        makedirs(join(self.tmp_dir.path, 'data'))
+        makedirs(join(self.tmp_dir.path, 'templates', 'role'))
+        with open(join(self.tmp_dir.path, 'templates', 'role', 'host.txt'), 'w') as file_:
+            file_.write('{{ confab.host }}')
+        self.transports = {}
+        for host in ('host1', 'host2', 'host3'):
+            makedirs(join(self.tmp_dir.path, 'roots', host))
+            self.transports[host] = LocalTransport(join(self.tmp_dir.path, 'roots', host))
+        self.plan_file = join(self.tmp_dir.path, 'plan.json')
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def _run(self, task, environmentdef):
+        with settings(environmentdef=environmentdef):
+            with Options(get_transport=self.transports.get, assume_yes=True):
+                with patch('sys.stdout'):
+                    task(self.tmp_dir.path, self.plan_file)
+
+    def _pushed(self):
+        return [host for host in sorted(self.transports)
+                if exists(join(self.tmp_dir.path, 'roots', host, 'host.txt'))]
+
+    def test_selection(self):
+        """
+        Only the selected hosts of a plan are applied.
+        """
+        self._run(plan, self.settings.for_env('any'))
+        self._run(apply, self.settings.for_env('any').with_hosts('host2'))
+
+        eq_(['host2'], self._pushed())
+
+    def test_unplanned(self):
+        """
+        Plans are not applied to selected hosts they do not cover.
+        """
+        self._run(plan, self.settings.for_env('any').with_hosts('host1'))
+
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self._run(apply, self.settings.for_env('any'))
+
+        eq_([], self._pushed())
+
+    def test_failure(self):
+        """
+        A failure on one host reports the hosts already applied.
+        """
+        self._run(plan, self.settings.for_env('any'))
+        hosts = [host['host'] for host in load_plan(self.plan_file)['hosts']]
+
+        with patch.object(self.transports[hosts[1]], 'push', side_effect=IOError('broken')):
+            with patch('sys.stderr') as mock_stderr:
+                with self.assertRaises(SystemExit):
+                    self._run(apply, self.settings.for_env('any'))
+
+        eq_([hosts[0]], self._pushed())
+        message = ''.join(args[0] for args, _ in mock_stderr.write.call_args_list)
+        ok_('Applied to: {}\n'.format(hosts[0]) in message)
+        ok_('Not applied to: {}\n'.format(hosts[2]) in message)
@@ -0,0 +1,146 @@
+"""
+Tests for the cache of remote file state.
+"""
+import os
+from os import makedirs
+from os.path import exists, join
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.loaders import PackageEnvironmentLoader
+from confab.options import Options
+from confab.remotestate import get_remote_state_file, load_remote_state
+from confab.transport import LocalTransport
+from confab.tests.utils import TempDir
+
+
+class TestRemoteState(TestCase):
+
+    def setUp(self):
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        self.conffiles = ConfFiles(settings.for_env('any').all().next(),
+                                   PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                                   lambda _: {'bar': 'bar', 'foo': 'foo'})
+        self.tmp_dir = TempDir().__enter__()
+        self.root = join(self.tmp_dir.path, 'root')
+        makedirs(join(self.root, 'bar'))
+        self._write_remote('foo.txt', 'old foo\n')
+        self._write_remote('bar/bar.txt', 'bar\n')
+        self.transport = LocalTransport(self.root)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def _write_remote(self, name, content):
+        with open(join(self.root, name), 'w') as file_:
+            file_.write(content)
+
+    def _diff(self, **kwargs):
+        self.transport.calls = 0
+        kwargs.setdefault('checksum_remotes', True)
+        with Options(get_transport=lambda host: self.transport, **kwargs):
+            with patch.object(self.transport, 'fetch', wraps=self.transport.fetch) as fetch:
+                with patch('sys.stdout'):
+                    self.conffiles.diff(self.tmp_dir.path)
+        return [args[0] for args, _ in fetch.call_args_list]
+
+    def test_state(self):
+        """
+        Digests, metadata and fetch times of remote files are recorded.
+        """
+        self._diff()
+
+        state = load_remote_state(get_remote_state_file(self.tmp_dir.path, 'localhost'))
+        eq_(['/bar/bar.txt', '/foo.txt'], sorted(state))
+        eq_('e242ed3bffccdf271b7fbaf34ed72d089537b42f', state['/bar/bar.txt']['digest'])
+        eq_(os.stat(join(self.root, 'foo.txt')).st_mode & 0777, state['/foo.txt']['mode'])
+        ok_(state['/foo.txt']['fetched'])
+
+    def test_unchanged(self):
+        """
+        Remote files are not fetched again while their checksums are unchanged.
+        """
+        eq_([['/foo.txt']], self._diff())
+
+        eq_([], self._diff())
+        eq_(1, self.transport.calls)
+        eq_('old foo', self.tmp_dir.read('remotes/localhost/foo.txt'))
+
+    def test_changed(self):
+        """
+        Remote files are fetched again when their checksums change.
+        """
+        self._diff()
+        self._write_remote('foo.txt', 'new foo\n')
+
+        eq_([['/foo.txt']], self._diff())
+        eq_('new foo', self.tmp_dir.read('remotes/localhost/foo.txt'))
+
+    def test_removed(self):
+        """
+        Local copies of removed remote files are removed.
+        """
+        self._diff()
+        os.remove(join(self.root, 'foo.txt'))
+
+        eq_([], self._diff())
+        ok_(not exists(join(self.tmp_dir.path, 'remotes', 'localhost', 'foo.txt')))
+        ok_('/foo.txt' not in load_remote_state(get_remote_state_file(self.tmp_dir.path,
+                                                                      'localhost')))
+
+    def test_modified_locally(self):
+        """
+        Local copies modified since they were fetched are fetched again.
+        """
+        self._diff()
+        with open(join(self.tmp_dir.path, 'remotes', 'localhost', 'foo.txt'), 'w') as file_:
+            file_.write('edited\n')
+
+        eq_([['/foo.txt']], self._diff())
+        eq_('old foo', self.tmp_dir.read('remotes/localhost/foo.txt'))
+
+    def test_pull(self):
+        """
+        Files pulled in full are not fetched again by a diff.
+        """
+        with Options(get_transport=lambda host: self.transport):
+            with patch('sys.stdout'):
+                self.conffiles.pull(self.tmp_dir.path)
+
+        eq_([], self._diff())
+
+        # the checksum probe records the remote mode of cached copies
+        state = load_remote_state(get_remote_state_file(self.tmp_dir.path, 'localhost'))
+        eq_(os.stat(join(self.root, 'foo.txt')).st_mode & 0777, state['/foo.txt']['mode'])
+
+    def test_pull_state(self):
+        """
+        Full pulls record digests, but not remote modes and owners.
+        """
+        with Options(get_transport=lambda host: self.transport):
+            with patch('sys.stdout'):
+                self.conffiles.pull(self.tmp_dir.path)
+
+        state = load_remote_state(get_remote_state_file(self.tmp_dir.path, 'localhost'))
+        eq_('e242ed3bffccdf271b7fbaf34ed72d089537b42f', state['/bar/bar.txt']['digest'])
+        ok_('mode' not in state['/bar/bar.txt'])
+        ok_('owner' not in state['/bar/bar.txt'])
+
+    def test_disabled(self):
+        """
+        Without the cache, changed remote files are fetched every time.
+        """
+        self._diff(cache_remotes=False)
+
+        eq_([['/foo.txt']], self._diff(cache_remotes=False))
+
+    def test_without_checksums(self):
+        """
+        Without checksums, all remote files are fetched with one command.
+        """
+        eq_([['/foo.txt', '/bar/bar.txt']], self._diff(checksum_remotes=False))
+        eq_(1, self.transport.calls)
@@ -0,0 +1,190 @@
+"""
+Tests for rendered content caching.
+"""
+from hashlib import sha1
+from os.path import exists, join
+from threading import Thread
+from unittest import TestCase
+from mock import patch
+from nose.tools import eq_, ok_
+
+from confab.conffiles import ConfFiles
+from confab.definitions import Settings
+from confab.loaders import PackageEnvironmentLoader
+from confab.options import Options
+from confab.rendercache import RenderCache
+from confab.tests.utils import TempDir
+
+
+class TestRenderCache(TestCase):
+
+    def setUp(self):
+        self.cache = RenderCache()
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def test_eviction(self):
+        """
+        Least recently used content is evicted beyond the cache size; digests remain.
+        """
+        with Options(render_cache_size=10):
+            first = self.cache.add('x' * 6)
+            second = self.cache.add('y' * 6)
+
+            ok_(not first.is_available())
+            eq_(sha1('x' * 6).hexdigest(), first.digest)
+            eq_('y' * 6, second.read())
+
+            self.cache.touch(second)
+            third = self.cache.add('z' * 4)
+            ok_(second.is_available())
+            ok_(third.is_available())
+
+    def test_spill(self):
+        """
+        Large content is kept on disk rather than in memory.
+        """
+        with Options(render_spill_size=4):
+            rendered = self.cache.add('spilled')
+            eq_('spilled', rendered.read())
+
+            with TempDir() as tmp_dir:
+                rendered.write_to(join(tmp_dir.path, 'out'))
+                eq_('spilled', tmp_dir.read('out'))
+
+    def test_stream(self):
+        """
+        Streamed chunks are encoded and hashed incrementally.
+        """
+        chunks = [u'caf', u'\xe9', u'\n']
+        content = u''.join(chunks).encode('utf-8')
+
+        rendered = self.cache.add_stream(iter(chunks))
+        eq_(sha1(content).hexdigest(), rendered.digest)
+        eq_(len(content), rendered.size)
+        eq_(content, rendered.read())
+
+    def test_stream_spill(self):
+        """
+        Streamed content is written to disk once it exceeds the spill size.
+        """
+        chunks = [u'x' * 3] * 5
+
+        with Options(render_spill_size=4):
+            rendered = self.cache.add_stream(iter(chunks))
+            eq_(None, rendered._content)
+            eq_('x' * 15, rendered.read())
+            eq_(sha1('x' * 15).hexdigest(), rendered.digest)
+
+    def test_release_spilled(self):
+        """
+        Spilled content is deleted once its last reference is released.
+        """
+        with Options(render_spill_size=4):
+            rendered = self.cache.acquire(self.cache.acquire(self.cache.add('spilled')))
+            file_name = rendered._file_name
+
+            self.cache.release(rendered)
+            ok_(exists(file_name))
+            self.cache.release(rendered)
+            ok_(not exists(file_name))
+            ok_(not rendered.is_available())
+
+    def test_release_in_memory(self):
+        """
+        Released content in memory remains cached for later renders.
+        """
+        rendered = self.cache.acquire(self.cache.add('cached'))
+        self.cache.release(rendered)
+        eq_('cached', rendered.read())
+
+    def test_get_after_eviction(self):
+        """
+        Content obtained before it is evicted remains readable.
+        """
+        with Options(render_cache_size=10):
+            rendered = self.cache.add('x' * 6)
+            snapshot = self.cache.get(rendered)
+            self.cache.add('y' * 6)
+
+            ok_(not rendered.is_available())
+            eq_(None, self.cache.get(rendered))
+            eq_('x' * 6, snapshot.read())
+
+    def test_threads(self):
+        """
+        Content can be added and used from several threads at once.
+        """
+        errors = []
+
+        def work(name):
+            try:
+                for i in range(200):
+                    rendered = self.cache.add('{}{}'.format(name, i) * 10)
+                    self.cache.touch(rendered)
+                    self.cache.get(rendered)
+            except Exception as error:
+                errors.append(error)
+
+        with Options(render_cache_size=1000):
+            threads = [Thread(target=work, args=(name,)) for name in 'abcd']
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            eq_([], errors)
+            ok_(self.cache._size <= 1000)
+            eq_(self.cache._size, sum(rendered.size
+                                      for rendered in self.cache._entries.itervalues()))
+
+
+class TestRenderOnce(TestCase):
+
+    def setUp(self):
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        self.conffiles = ConfFiles(settings.for_env('any').all().next(),
+                                   PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                                   lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+    def test_hexdigest_then_generate(self):
+        """
+        Hashing and generating a conffile render it once.
+        """
+        conffile = next(c for c in self.conffiles.conffiles if c.name == 'foo.txt')
+
+        with patch.object(conffile.template, 'generate', wraps=conffile.template.generate) as render:
+            digest = conffile.hexdigest()
+            with TempDir() as tmp_dir:
+                conffile.generate(tmp_dir.path)
+                eq_('foo', tmp_dir.read('foo.txt'))
+                with open(join(tmp_dir.path, 'foo.txt'), 'rb') as file_:
+                    eq_(sha1(file_.read()).hexdigest(), digest)
+            eq_(1, render.call_count)
+
+    def test_rerender_after_eviction(self):
+        """
+        Evicted content is rendered again when needed.
+        """
+        with Options(render_cache_size=0):
+            for conffile in self.conffiles.conffiles:
+                conffile.hexdigest()
+            with TempDir() as tmp_dir:
+                self.conffiles.generate(tmp_dir.path)
+                eq_('foo', tmp_dir.read('generated/localhost/foo.txt'))
+                eq_('bar', tmp_dir.read('generated/localhost/bar/bar.txt'))
+
+    def test_close_deletes_spilled(self):
+        """
+        Closing conffiles deletes their spilled content.
+        """
+        with Options(render_spill_size=0):
+            conffile = next(c for c in self.conffiles.conffiles if c.name == 'foo.txt')
+            conffile.hexdigest()
+            file_name = conffile._rendered._file_name
+            ok_(exists(file_name))
+
+            self.conffiles.close()
+            ok_(not exists(file_name))
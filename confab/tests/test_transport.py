@@ -0,0 +1,442 @@
+"""
+Tests for transports and checksum-based diffs.
+"""
+from os import chmod, chown, getuid, listdir, makedirs, stat, symlink, utime
+from os.path import exists, getsize, join
+from unittest import TestCase
+from mock import patch
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_, ok_
+
+from confab.conffiles import ConfFiles, _push_files
+from confab.definitions import Settings
+from confab.loaders import PackageEnvironmentLoader
+from confab.options import Options
+from confab.transport import (_APPLY_DELTA_SCRIPT, _BLOCK_HEADER, FabricTransport,
+                              LocalTransport)
+from confab.tests.utils import TempDir
+
+
+class TestLocalTransport(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = TempDir().__enter__()
+        self.transport = LocalTransport(self.tmp_dir.path)
+
+    def tearDown(self):
+        self.tmp_dir.__exit__(None, None, None)
+
+    def test_checksums(self):
+        """
+        Checksums report digest, mode and owner of present files in one command.
+        """
+        makedirs(join(self.tmp_dir.path, 'etc'))
+        with open(join(self.tmp_dir.path, 'etc', 'a b.conf'), 'w') as file_:
+            file_.write('foo\n')
+        chmod(join(self.tmp_dir.path, 'etc', 'a b.conf'), 0640)
+
+        checksums = self.transport.checksums(['/etc/a b.conf', '/etc/missing'])
+
+        eq_(1, self.transport.calls)
+        eq_(None, checksums['/etc/missing'])
+        eq_('f1d2d2f924e986ac86fdf7b36c94bcdf32beec15', checksums['/etc/a b.conf'].digest)
+        eq_(0640, checksums['/etc/a b.conf'].mode)
+
+    def test_files(self):
+        """
+        Files can be created, checked and fetched.
+        """
+        ok_(not self.transport.exists('/etc/foo'))
+        self.transport.mkdir('/etc')
+
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('foo')
+        self.transport.put(source, '/etc/foo')
+        ok_(self.transport.exists('/etc/foo'))
+
+        self.transport.get('/etc/foo', join(self.tmp_dir.path, 'copy', 'foo'))
+        eq_('foo', self.tmp_dir.read('copy/foo'))
+
+    def test_fetch(self):
+        """
+        Files are fetched with one command, with or without compression.
+        """
+        makedirs(join(self.tmp_dir.path, 'etc', 'sub'))
+        with open(join(self.tmp_dir.path, 'etc', 'foo'), 'w') as file_:
+            file_.write('foo')
+        with open(join(self.tmp_dir.path, 'etc', 'sub', 'bar'), 'w') as file_:
+            file_.write('\x00bar')
+
+        for compress in (False, True):
+            self.transport.calls = 0
+            local_dir = join(self.tmp_dir.path, 'local{}'.format(compress))
+            fetched = self.transport.fetch(['/etc/foo', '/etc/sub/bar', '/etc/missing'],
+                                           local_dir,
+                                           compress)
+
+            eq_(1, self.transport.calls)
+            eq_(set(['/etc/foo', '/etc/sub/bar']), fetched)
+            eq_('foo', self.tmp_dir.read('local{}/etc/foo'.format(compress)))
+            with open(join(local_dir, 'etc', 'sub', 'bar'), 'rb') as file_:
+                eq_('\x00bar', file_.read())
+            ok_(not exists(join(local_dir, 'etc', 'missing')))
+
+    def test_symlink(self):
+        """
+        Symbolic links are checksummed and fetched as the files they point to.
+        """
+        makedirs(join(self.tmp_dir.path, 'etc'))
+        with open(join(self.tmp_dir.path, 'etc', 'target'), 'w') as file_:
+            file_.write('foo\n')
+        chmod(join(self.tmp_dir.path, 'etc', 'target'), 0640)
+        symlink('target', join(self.tmp_dir.path, 'etc', 'link'))
+
+        checksums = self.transport.checksums(['/etc/link'])
+        eq_('f1d2d2f924e986ac86fdf7b36c94bcdf32beec15', checksums['/etc/link'].digest)
+        eq_(0640, checksums['/etc/link'].mode)
+
+        local_dir = join(self.tmp_dir.path, 'local')
+        eq_(set(['/etc/link']), self.transport.fetch(['/etc/link'], local_dir))
+        eq_('foo', self.tmp_dir.read('local/etc/link'))
+
+    def test_fetch_missing(self):
+        """
+        Fetching only missing files fetches nothing.
+        """
+        eq_(set(), self.transport.fetch(['/etc/missing'], join(self.tmp_dir.path, 'local')))
+
+    def test_unexpected_output(self):
+        """
+        Garbled checksum and fetch output aborts rather than being misread.
+        """
+        for output in ('f1d2d2f924e986ac86fdf7b36c94bcdf32beec15 640\n',
+                       'sudo: warning\n',
+                       'not-a-digest 640 root\n'):
+            with patch.object(self.transport, 'run', return_value=output):
+                with patch('sys.stderr'):
+                    with self.assertRaises(SystemExit):
+                        self.transport.checksums(['/etc/foo'])
+
+        for output in ('Zm9vCg=\n', 'Zm9v!Cg==\n', 'Zm9vCg==\nZm9v\n', 'Zm9vCg===\n'):
+            with patch.object(self.transport, 'run', return_value=output):
+                with patch('sys.stderr'):
+                    with self.assertRaises(SystemExit):
+                        self.transport.fetch(['/etc/foo'], join(self.tmp_dir.path, 'local'))
+
+    def test_push(self):
+        """
+        Files are pushed as one archive, preserving modes and creating directories.
+        """
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('foo')
+        chmod(source, 0600)
+        utime(source, (0, 0))
+        makedirs(join(self.tmp_dir.path, 'etc'))
+        with open(join(self.tmp_dir.path, 'etc', 'foo'), 'w') as file_:
+            file_.write('old')
+
+        for compress in (False, True):
+            self.transport.calls = 0
+            self.transport.push([(source, '/etc/foo'), (source, '/etc/new/bar')], compress)
+
+            eq_(2, self.transport.calls)  # upload and extract
+            eq_('foo', self.tmp_dir.read('etc/foo'))
+            eq_('foo', self.tmp_dir.read('etc/new/bar'))
+            eq_(0600, stat(join(self.tmp_dir.path, 'etc', 'new', 'bar')).st_mode & 07777)
+            # modification times are those of the push
+            ok_(stat(join(self.tmp_dir.path, 'etc', 'foo')).st_mtime > 0)
+
+    def test_block_digests(self):
+        """
+        Block digests of remote files are computed remotely.
+        """
+        with open(join(self.tmp_dir.path, 'foo'), 'w') as file_:
+            file_.write('foo\nfoo\nbar')
+
+        eq_((11, ['f1d2d2f924e986ac86fdf7b36c94bcdf32beec15',
+                  'f1d2d2f924e986ac86fdf7b36c94bcdf32beec15',
+                  '62cdb7020ff920e5aa642c3d4066950dd1f01f4d']),
+            self.transport.block_digests('/foo', 4))
+        eq_(None, self.transport.block_digests('/missing', 4))
+
+    def _push_delta(self, old, new):
+        with open(join(self.tmp_dir.path, 'remote'), 'w') as file_:
+            file_.write(old)
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write(new)
+        chmod(source, 0600)
+
+        uploaded = []
+
+        def upload(local_path):
+            uploaded.append(getsize(local_path))
+            return LocalTransport.upload(self.transport, local_path)
+
+        with patch.object(self.transport, 'upload', upload):
+            ok_(self.transport.push_delta(source, '/remote', 4))
+
+        eq_(new, self.tmp_dir.read('remote'))
+        eq_(0600, stat(join(self.tmp_dir.path, 'remote')).st_mode & 07777)
+        eq_(3, self.transport.calls)  # block digests, upload and apply
+        return uploaded[0]
+
+    def test_push_delta(self):
+        """
+        Only changed and added blocks are uploaded and patched in place.
+        """
+        # one changed block and one added block, each with a 12 byte header
+        eq_(24 + 8, self._push_delta('aaaabbbbccccdddd', 'aaaaBBBBccccddddeeee'))
+
+    def test_push_delta_shorter(self):
+        """
+        Remote files are truncated to the length of the local file.
+        """
+        eq_(12 + 2, self._push_delta('aaaabbbbccccdddd', 'aaaabbbbcc'))
+
+    def test_push_delta_missing(self):
+        """
+        Missing remote files are not pushed as deltas.
+        """
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('foo')
+
+        ok_(not self.transport.push_delta(source, '/missing', 4))
+        eq_(1, self.transport.calls)
+        ok_(not exists(join(self.tmp_dir.path, 'missing')))
+
+    def test_push_delta_no_python(self):
+        """
+        Files are not pushed as deltas to hosts without Python.
+        """
+        with open(join(self.tmp_dir.path, 'remote'), 'w') as file_:
+            file_.write('old')
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('new')
+
+        with patch('confab.transport._FIND_PYTHON', 'python=; '):
+            ok_(not self.transport.push_delta(source, '/remote', 4))
+            with Options(delta_threshold=0):
+                _push_files(self.transport, [(source, '/remote')])
+
+        eq_('new', self.tmp_dir.read('remote'))
+
+    def test_push_delta_mismatch(self):
+        """
+        Deltas are applied to a copy, so that a failed verification leaves the file intact.
+        """
+        with open(join(self.tmp_dir.path, 'remote'), 'w') as file_:
+            file_.write('aaaabbbb')
+        delta = join(self.tmp_dir.path, 'delta')
+        with open(delta, 'wb') as file_:
+            file_.write(_BLOCK_HEADER.pack(0, 4) + 'AAAA')
+
+        with patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                self.transport._run_python(_APPLY_DELTA_SCRIPT, delta, 'remote', '8', '644',
+                                           '0' * 40)
+
+        eq_('aaaabbbb', self.tmp_dir.read('remote'))
+        eq_(['remote'], listdir(self.tmp_dir.path))
+
+    def test_push_owner(self):
+        """
+        Pushed archives and deltas both keep the owner of existing files.
+        """
+        if getuid() != 0:
+            raise SkipTest('changing owners requires root')
+
+        source = join(self.tmp_dir.path, 'source')
+        with open(source, 'w') as file_:
+            file_.write('aaaaBBBB')
+        for name in ('archived', 'delta'):
+            with open(join(self.tmp_dir.path, name), 'w') as file_:
+                file_.write('aaaabbbb')
+            chown(join(self.tmp_dir.path, name), 1, 2)
+
+        self.transport.push([(source, '/archived'), (source, '/new')])
+        ok_(self.transport.push_delta(source, '/delta', 4))
+
+        for name in ('archived', 'delta'):
+            eq_('aaaaBBBB', self.tmp_dir.read(name))
+            eq_((1, 2), (stat(join(self.tmp_dir.path, name)).st_uid,
+                         stat(join(self.tmp_dir.path, name)).st_gid))
+        eq_(0, stat(join(self.tmp_dir.path, 'new')).st_uid)
+
+
+class TestPull(TestCase):
+
+    def test_pull(self):
+        """
+        All remote files of a host are pulled with one command.
+        """
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        conffiles = ConfFiles(settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(root)
+            with open(join(root, 'foo.txt'), 'w') as file_:
+                file_.write('remote foo\n')
+            makedirs(join(tmp_dir.path, 'remotes', 'localhost', 'bar'))
+            with open(join(tmp_dir.path, 'remotes', 'localhost', 'bar', 'bar.txt'), 'w') as file_:
+                file_.write('stale\n')
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport):
+                with patch('sys.stdout'):
+                    conffiles.pull(tmp_dir.path)
+
+            eq_(1, transport.calls)
+            eq_('remote foo', tmp_dir.read('remotes/localhost/foo.txt'))
+            ok_(not exists(join(tmp_dir.path, 'remotes', 'localhost', 'bar', 'bar.txt')))
+
+
+class TestChecksumDiff(TestCase):
+
+    def setUp(self):
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        self.conffiles = ConfFiles(settings.for_env('any').all().next(),
+                                   PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                                   lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+    def test_pull_changed(self):
+        """
+        Only remote files whose checksums differ are fetched.
+        """
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(join(root, 'bar'))
+            with open(join(root, 'foo.txt'), 'w') as file_:
+                file_.write('foo\n')
+            with open(join(root, 'bar', 'bar.txt'), 'w') as file_:
+                file_.write('old\n')
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport, checksum_remotes=True):
+                with patch.object(transport, 'fetch', wraps=transport.fetch) as fetch:
+                    with patch('sys.stdout'):
+                        self.conffiles.diff(tmp_dir.path)
+
+            eq_(1, fetch.call_count)
+            eq_(['/bar/bar.txt'], fetch.call_args[0][0])
+            eq_(2, transport.calls)
+            eq_('foo', tmp_dir.read('remotes/localhost/foo.txt'))
+            eq_('old', tmp_dir.read('remotes/localhost/bar/bar.txt'))
+
+    def test_symlink(self):
+        """
+        Remote files that are symbolic links are compared by their content.
+        """
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(join(root, 'bar'))
+            with open(join(root, 'foo.target'), 'w') as file_:
+                file_.write('foo\n')
+            symlink('foo.target', join(root, 'foo.txt'))
+            with open(join(root, 'bar', 'bar.target'), 'w') as file_:
+                file_.write('old\n')
+            symlink('bar.target', join(root, 'bar', 'bar.txt'))
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport, checksum_remotes=True):
+                with patch('sys.stdout'):
+                    self.conffiles.diff(tmp_dir.path)
+
+            ok_(self.conffiles.remote_files['/foo.txt'] is not None)
+            eq_('foo', tmp_dir.read('remotes/localhost/foo.txt'))
+            eq_('old', tmp_dir.read('remotes/localhost/bar/bar.txt'))
+
+    def test_missing(self):
+        """
+        Missing remote files are not fetched and have no local copy.
+        """
+        with TempDir() as tmp_dir:
+            transport = LocalTransport(tmp_dir.path)
+
+            with Options(get_transport=lambda host: transport, checksum_remotes=True):
+                with patch('sys.stdout'):
+                    self.conffiles.diff(tmp_dir.path)
+
+            eq_(1, transport.calls)
+            eq_(None, self.conffiles.remote_files['/foo.txt'])
+            ok_(not exists(join(tmp_dir.path, 'remotes/localhost/foo.txt')))
+
+
+class TestPush(TestCase):
+
+    def test_push(self):
+        """
+        Changed files of a host are pushed with one upload and one command.
+        """
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        conffiles = ConfFiles(settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(root)
+            with open(join(root, 'foo.txt'), 'w') as file_:
+                file_.write('old\n')
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport, assume_yes=True):
+                with patch('sys.stdout'):
+                    conffiles.push(tmp_dir.path)
+
+            eq_(3, transport.calls)  # fetch, upload and extract
+            eq_('foo', tmp_dir.read('root/foo.txt'))
+            eq_('bar', tmp_dir.read('root/bar/bar.txt'))
+
+    def test_push_delta(self):
+        """
+        Large files that exist remotely are pushed as block deltas.
+        """
+        settings = Settings.load_from_dict(dict(environmentdefs={'any': ['localhost']},
+                                                roledefs={'role': ['localhost']}))
+        conffiles = ConfFiles(settings.for_env('any').all().next(),
+                              PackageEnvironmentLoader('confab.tests', 'templates/default'),
+                              lambda _: {'bar': 'bar', 'foo': 'foo'})
+
+        with TempDir() as tmp_dir:
+            root = join(tmp_dir.path, 'root')
+            makedirs(root)
+            with open(join(root, 'foo.txt'), 'w') as file_:
+                file_.write('old\n')
+            transport = LocalTransport(root)
+
+            with Options(get_transport=lambda host: transport,
+                         assume_yes=True,
+                         delta_threshold=1,
+                         delta_block_size=2):
+                with patch.object(transport, 'push', wraps=transport.push) as push:
+                    with patch('sys.stdout'):
+                        conffiles.push(tmp_dir.path)
+
+            # bar.txt is missing remotely, so is pushed whole
+            eq_([(join(tmp_dir.path, 'generated', 'localhost', 'bar', 'bar.txt'),
+                  '/bar/bar.txt')],
+                push.call_args[0][0])
+            eq_('foo', tmp_dir.read('root/foo.txt'))
+            eq_('bar', tmp_dir.read('root/bar/bar.txt'))
+
+
+class TestFabricTransport(TestCase):
+
+    def test_run(self):
+        """
+        Commands run without a pty, so that stderr is kept out of the output.
+        """
+        with patch('confab.transport.sudo', return_value='output') as sudo:
+            eq_('output', FabricTransport('host').run('true'))
+        sudo.assert_called_once_with('true', pty=False, combine_stderr=False)
@@ -0,0 +1,672 @@
+"""
+Transports for remote configuration files.
+
+A transport runs commands on and transfers files to and from one
+:term:`host`. Operations on managed paths (checksums, existence and
+directories) are built from a few primitives, so that they can be batched
+into as few remote commands as possible.
+
+Large files that already exist remotely can be updated with block deltas:
+the remote side hashes the file in fixed-size blocks and only the blocks
+that differ are uploaded and patched into a copy that replaces the file.
+The remote halves of this are small Python scripts; on hosts without a
+``python3`` or ``python``, files are pushed whole instead.
+
+:class:`FabricTransport` is the default and operates on a host through
+Fabric (by default, on Fabric's current ``env.host_string``).
+:class:`LocalTransport` is a stand-in that operates on a local directory,
+for tests and benchmarks. :class:`AgentTransport` wraps either, running
+checksums, fetches and pushes through :mod:`confab.agent`.
+"""
+import base64
+import json
+import os
+import re
+import shutil
+import string
+import struct
+import tarfile
+import time
+import zlib
+from base64 import b64decode, b64encode
+from cStringIO import StringIO
+from hashlib import sha1
+from collections import namedtuple
+from os.path import dirname, join
+from pipes import quote
+from tempfile import TemporaryFile, mkstemp
+from subprocess import PIPE, Popen
+
+from fabric.api import abort, get, hide, put, run, settings, sudo
+
+from confab.files import _clear_file, _ensure_dir
+
+
+# State of a remote file: the sha1 hex digest of its content, its permission
+# bits and its owner.
+RemoteFile = namedtuple('RemoteFile', ['digest', 'mode', 'owner'])
+
+# Shell code selecting a Python interpreter as $python, which is empty if
+# there is none.
+_FIND_PYTHON = ('python=; '
+                'for candidate in python3 python; do '
+                'if command -v $candidate > /dev/null; then python=$candidate; break; fi; '
+                'done; ')
+
+# Output of remote Python scripts on hosts without Python.
+_NO_PYTHON = 'confab: no python'
+
+# Creates an unpredictable temporary file for an upload and prints its path.
+_MKTEMP = 'mktemp /tmp/confab-XXXXXXXXXX'
+
+# Characters of base64 data, other than padding.
+_BASE64_ALPHABET = string.ascii_letters + string.digits + '+/'
+
+# A sha1 hex digest.
+_DIGEST = re.compile(r'\A[0-9a-f]{40}\Z')
+
+# A line of checksum output: digest, mode and owner, or dashes for a missing file.
+_CHECKSUM_LINE = re.compile(r'\A(?:[0-9a-f]{40} [0-7]+ \S+|- - -)\Z')
+
+# Header of each block of a delta: its offset and length.
+_BLOCK_HEADER = struct.Struct('>QI')
+
+# Prints the size and the sha1 digest of each block of an existing file.
+# Remote scripts run under Python 2 or 3.
+_BLOCK_DIGESTS_SCRIPT = """
+import hashlib, os, sys
+path, block_size = sys.argv[1], int(sys.argv[2])
+if os.path.isfile(path):
+    with open(path, 'rb') as file_:
+        sys.stdout.write('%d\\n' % os.fstat(file_.fileno()).st_size)
+        for block in iter(lambda: file_.read(block_size), b''):
+            sys.stdout.write(hashlib.sha1(block).hexdigest() + '\\n')
+"""
+
+# Writes the blocks of a delta into a copy of a file, truncates it to its
+# new size, sets its mode, verifies its digest and only then replaces the
+# file with it, so that a failure leaves the file as it was.
+_APPLY_DELTA_SCRIPT = """
+import hashlib, os, shutil, struct, sys, tempfile
+delta, path, size, mode, digest = sys.argv[1:]
+header = struct.Struct('>QI')
+handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.confab-')
+try:
+    try:
+        with os.fdopen(handle, 'wb') as file_:
+            with open(path, 'rb') as original:
+                shutil.copyfileobj(original, file_)
+        with open(delta, 'rb') as delta_file:
+            with open(tmp_path, 'r+b') as file_:
+                while True:
+                    data = delta_file.read(header.size)
+                    if not data:
+                        break
+                    offset, length = header.unpack(data)
+                    file_.seek(offset)
+                    file_.write(delta_file.read(length))
+                file_.truncate(int(size))
+    finally:
+        os.remove(delta)
+    stat_ = os.stat(path)
+    os.chown(tmp_path, stat_.st_uid, stat_.st_gid)
+    os.chmod(tmp_path, int(mode, 8))
+    hash_ = hashlib.sha1()
+    with open(tmp_path, 'rb') as file_:
+        for chunk in iter(lambda: file_.read(1024 * 1024), b''):
+            hash_.update(chunk)
+    if hash_.hexdigest() != digest:
+        sys.exit('Digest mismatch after applying delta to %s' % path)
+    os.rename(tmp_path, path)
+except BaseException:
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    raise
+"""
+
+
+def _check_base64(data, what):
+    """
+    Abort unless data is base64: groups of four base64 characters, possibly
+    split over lines, with padding only at the end.
+
+    The decoders skip anything else, so truncated or garbled output would
+    otherwise be decoded silently.
+    """
+    try:
+        data = str(data)
+    except UnicodeError:
+        abort('Unexpected {what} output: not base64'.format(what=what))
+    data = data.rstrip()
+    unpadded = data.rstrip('=')
+    if (len(data) - len(unpadded) > 2 or
+            unpadded.translate(None, _BASE64_ALPHABET + '\r\n') or
+            (len(data) - data.count('\n') - data.count('\r')) % 4):
+        abort('Unexpected {what} output: not base64'.format(what=what))
+
+
+class Transport(object):
+    """
+    Base class for transports.
+
+    Subclasses implement the primitives :meth:`run`, :meth:`get`,
+    :meth:`put` and :meth:`upload`. Confab only uses the operations built on
+    them, which subclasses may override to carry them out differently:
+    :meth:`exists` and :meth:`mkdir`, :meth:`checksum` and :meth:`checksums`,
+    :meth:`fetch` and :meth:`fetch_changed` to read files, :meth:`push` and
+    :meth:`push_delta` to write them, and :meth:`close`.
+
+    Remote paths are absolute; commands run from :attr:`root` with paths
+    relative to it.
+    """
+    root = '/'
+
+    def run(self, command):
+        """
+        Run a shell command with elevated privileges and return its output.
+        """
+        raise NotImplementedError('run')
+
+    def get(self, remote_path, local_path):
+        """
+        Download a remote file.
+        """
+        raise NotImplementedError('get')
+
+    def put(self, local_path, remote_path):
+        """
+        Upload a file with elevated privileges, preserving its mode.
+        """
+        raise NotImplementedError('put')
+
+    def upload(self, local_path):
+        """
+        Upload a file to a temporary remote location and return its path.
+        """
+        raise NotImplementedError('upload')
+
+    def _relative(self, remote_path):
+        return quote(remote_path.lstrip('/') or '.')
+
+    def _command(self, command):
+        return 'cd {root} && {command}'.format(root=quote(self.root), command=command)
+
+    def _run_python(self, script, *args):
+        """
+        Run a Python script remotely and return its output, or None if the
+        host has no Python.
+        """
+        output = self.run(self._command(_FIND_PYTHON +
+                                        'if [ -z "$python" ]; then echo {no_python}; '
+                                        'else "$python" -c {script} {args}; fi'
+                                        .format(no_python=quote(_NO_PYTHON),
+                                                script=quote(script),
+                                                args=' '.join(args))))
+        if output.strip() == _NO_PYTHON:
+            return None
+        return output
+
+    def close(self):
+        """
+        Release any remote resources held by the transport.
+        """
+
+    def exists(self, remote_path):
+        """
+        Return whether a remote file exists.
+        """
+        output = self.run(self._command('if [ -e {path} ]; then echo yes; fi'
+                                        .format(path=self._relative(remote_path))))
+        return output.strip() == 'yes'
+
+    def mkdir(self, remote_path):
+        """
+        Create a remote directory and its parents.
+        """
+        self.run(self._command('mkdir -p {path}'.format(path=self._relative(remote_path))))
+
+    def checksum(self, remote_path):
+        """
+        Return the state of a remote file as a :class:`RemoteFile`, or None
+        if it does not exist.
+        """
+        return self.checksums([remote_path])[remote_path]
+
+    def checksums(self, remote_paths):
+        """
+        Return the state of remote files with one command, as a dictionary
+        of :class:`RemoteFile` (or None for missing files) by path.
+        """
+        remote_paths = list(remote_paths)
+        if not remote_paths:
+            return {}
+        return self._parse_checksums(remote_paths,
+                                     self.run(self._checksums_command(remote_paths)))
+
+    def _checksums_command(self, remote_paths):
+        # symbolic links are followed, as by sha1sum, fetch and the agent
+        return self._command('for path in {paths}; do '
+                             'if [ -f "$path" ]; then '
+                             'echo "$(sha1sum < "$path" | cut -c1-40) $(stat -L -c \'%a %U\' "$path")"; '
+                             'else echo "- - -"; fi; '
+                             'done'.format(paths=' '.join(map(self._relative, remote_paths))))
+
+    def _parse_checksums(self, remote_paths, output):
+        lines = output.splitlines()
+        if (len(lines) != len(remote_paths) or
+                not all(_CHECKSUM_LINE.match(line) for line in lines)):
+            abort('Unexpected checksum output: {output}'.format(output='\n'.join(lines)))
+
+        checksums = {}
+        for remote_path, line in zip(remote_paths, lines):
+            digest, mode, owner = line.split()
+            checksums[remote_path] = (None if digest == '-'
+                                      else RemoteFile(digest, int(mode, 8), owner))
+        return checksums
+
+    def fetch(self, remote_paths, directory, compress=False):
+        """
+        Download remote files into a local directory with one command, as a
+        (base64 encoded, optionally compressed) tar stream.
+
+        Files keep their paths relative to the root; symbolic links are
+        fetched as the files they point to. Returns the paths of the files
+        that exist remotely.
+        """
+        remote_paths = list(remote_paths)
+        if not remote_paths:
+            return set()
+
+        script = ('set --; '
+                  'for path in {paths}; do '
+                  'if [ -f "$path" ]; then set -- "$@" "$path"; fi; '
+                  'done; '
+                  'if [ $# -gt 0 ]; then tar -ch{compress}f - -- "$@" | base64; fi'
+                  ).format(paths=' '.join(map(self._relative, remote_paths)),
+                           compress='z' if compress else '')
+        output = self.run(self._command(script))
+        if not output.strip():
+            return set()
+        _check_base64(output, 'fetch')
+
+        wanted = dict((remote_path.lstrip('/'), remote_path) for remote_path in remote_paths)
+        fetched = set()
+        # the archive is decoded to disk rather than held in memory
+        with TemporaryFile(prefix='confab-') as archive:
+            base64.decode(StringIO(output), archive)
+            del output
+            archive.seek(0)
+            with tarfile.open(fileobj=archive, mode='r:*') as tar:
+                for member in tar:
+                    # only extract requested files, whatever the archive contains
+                    if not member.isfile() or member.name not in wanted:
+                        continue
+                    local_path = join(directory, member.name)
+                    _ensure_dir(dirname(local_path))
+                    with open(local_path, 'wb') as local_file:
+                        shutil.copyfileobj(tar.extractfile(member), local_file)
+                    fetched.add(wanted[member.name])
+        return fetched
+
+    def fetch_changed(self, known_digests, directory, compress=False):
+        """
+        Return the state of remote files, as :meth:`checksums`, and the paths
+        of the files downloaded (as :meth:`fetch`) because their digest is
+        not among their known digests.
+
+        :param known_digests: lists of digests by remote path
+        """
+        checksums = self.checksums(known_digests)
+        changed = [remote_path for remote_path in known_digests
+                   if checksums[remote_path] is not None and
+                   checksums[remote_path].digest not in known_digests[remote_path]]
+        if not changed:
+            return checksums, set()
+        return checksums, self.fetch(changed, directory, compress)
+
+    def push(self, files, compress=False):
+        """
+        Upload local files to their remote paths as one archive, applied with
+        one elevated command. Modes are preserved and missing directories are
+        created. Files that already exist keep their owner and group, as with
+        :meth:`push_delta` and the agent; new files belong to the elevated
+        user.
+
+        :param files: ``(local_path, remote_path)`` pairs
+        """
+        files = list(files)
+        if not files:
+            return
+
+        handle, archive_name = mkstemp(prefix='confab-', suffix='.tar')
+        os.close(handle)
+        try:
+            with tarfile.open(archive_name, 'w:gz' if compress else 'w') as tar:
+                for local_path, remote_path in files:
+                    tar.add(local_path, arcname=remote_path.lstrip('/'), recursive=False)
+            remote_archive_name = self.upload(archive_name)
+        finally:
+            _clear_file(archive_name)
+
+        # files take the time of the push, like files put one at a time
+        self.run(self._command('set --; '
+                               'for path in {paths}; do '
+                               'if [ -f "$path" ]; then '
+                               'set -- "$@" "$path" "$(stat -L -c %u:%g "$path")"; fi; '
+                               'done; '
+                               'tar -x{compress}mpf {archive} --no-same-owner; '
+                               'status=$?; rm -f {archive}; '
+                               'while [ $status -eq 0 ] && [ $# -gt 0 ]; do '
+                               'chown "$2" "$1" || status=$?; shift 2; '
+                               'done; '
+                               'exit $status'
+                               .format(paths=' '.join(self._relative(remote_path)
+                                                      for _, remote_path in files),
+                                       compress='z' if compress else '',
+                                       archive=quote(remote_archive_name))))
+
+    def block_digests(self, remote_path, block_size):
+        """
+        Return the size of a remote file and the sha1 hex digests of its
+        fixed-size blocks, computed remotely, or None if it does not exist or
+        the host has no Python.
+        """
+        output = self._run_python(_BLOCK_DIGESTS_SCRIPT,
+                                  self._relative(remote_path),
+                                  str(block_size))
+        lines = output.split() if output is not None else []
+        if not lines:
+            return None
+        return int(lines[0]), lines[1:]
+
+    def push_delta(self, local_path, remote_path, block_size):
+        """
+        Update an existing remote file, uploading only the blocks that
+        differ from the local file. A copy of the remote file is patched,
+        takes the local file's mode and replaces the file once its digest
+        is verified.
+
+        Returns False, without uploading anything, if the remote file does
+        not exist or the host has no Python.
+        """
+        remote = self.block_digests(remote_path, block_size)
+        if remote is None:
+            return False
+        _, remote_digests = remote
+
+        handle, delta_name = mkstemp(prefix='confab-', suffix='.delta')
+        os.close(handle)
+        try:
+            digest = sha1()
+            with open(local_path, 'rb') as local_file:
+                with open(delta_name, 'wb') as delta_file:
+                    for index, block in enumerate(iter(lambda: local_file.read(block_size),
+                                                       b'')):
+                        digest.update(block)
+                        if (index >= len(remote_digests) or
+                                sha1(block).hexdigest() != remote_digests[index]):
+                            delta_file.write(_BLOCK_HEADER.pack(index * block_size,
+                                                                len(block)))
+                            delta_file.write(block)
+            remote_delta_name = self.upload(delta_name)
+        finally:
+            _clear_file(delta_name)
+
+        if self._run_python(_APPLY_DELTA_SCRIPT,
+                            quote(remote_delta_name),
+                            self._relative(remote_path),
+                            str(os.path.getsize(local_path)),
+                            '{:o}'.format(os.stat(local_path).st_mode & 07777),
+                            digest.hexdigest()) is None:
+            abort('No Python found on the host to apply a delta to {path}'
+                  .format(path=remote_path))
+        return True
+
+
+# Agent manifests up to this size are passed in the command; larger ones are
+# uploaded first.
+_INLINE_MANIFEST_SIZE = 64 * 1024
+
+# Files pushed through the agent up to this size are sent in its manifest;
+# larger ones are uploaded as they are, rather than held in memory encoded.
+_INLINE_FILE_SIZE = 1024 * 1024
+
+
+class AgentTransport(Transport):
+    """
+    Transport that runs checksums, fetches and pushes through
+    :mod:`confab.agent`, each as a single elevated command.
+
+    The agent is uploaded on first use and removed by :meth:`close`. Other
+    operations, and the commands and transfers of the agent itself, go
+    through the wrapped transport.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.root = transport.root
+        self._agent_path = None
+
+    def run(self, command):
+        return self.transport.run(command)
+
+    def get(self, remote_path, local_path):
+        self.transport.get(remote_path, local_path)
+
+    def put(self, local_path, remote_path):
+        self.transport.put(local_path, remote_path)
+
+    def upload(self, local_path):
+        return self.transport.upload(local_path)
+
+    def close(self):
+        if self._agent_path is not None:
+            self.run('rm -f {agent}'.format(agent=quote(self._agent_path)))
+            self._agent_path = None
+        self.transport.close()
+
+    def _upload_temporary(self, write, prefix, suffix):
+        """
+        Upload a temporary file with content written by ``write``.
+        """
+        handle, file_name = mkstemp(prefix=prefix, suffix=suffix)
+        try:
+            with os.fdopen(handle, 'wb') as file_:
+                write(file_)
+            return self.upload(file_name)
+        finally:
+            _clear_file(file_name)
+
+    def _get_agent_path(self):
+        if self._agent_path is None:
+            with open(join(dirname(__file__), 'agent.py'), 'rb') as agent_file:
+                self._agent_path = self._upload_temporary(
+                    lambda file_: shutil.copyfileobj(agent_file, file_), 'confab-agent-', '.py')
+        return self._agent_path
+
+    def call(self, manifest):
+        """
+        Run the agent with a manifest (see :mod:`confab.agent`) and return
+        its result.
+        """
+        agent = quote(self._get_agent_path())
+        data = json.dumps(manifest)
+        if len(data) <= _INLINE_MANIFEST_SIZE:
+            command = 'printf %s {data} | "$python" {agent}'.format(data=quote(data),
+                                                                     agent=agent)
+        else:
+            manifest_path = quote(self._upload_temporary(lambda file_: file_.write(data),
+                                                         'confab-', '.json'))
+            command = ('"$python" {agent} < {manifest}; '
+                       'status=$?; rm -f {manifest}; exit $status'
+                       .format(agent=agent, manifest=manifest_path))
+        output = self.run(self._command(_FIND_PYTHON + command))
+        try:
+            result = json.loads(output)
+        except ValueError:
+            result = None
+        if not isinstance(result, dict):
+            abort('Unexpected agent output: {output}'.format(output=output[:1024]))
+        return result
+
+    def _checksums(self, remote_paths, result):
+        states = result.get('checksums')
+        if not isinstance(states, dict):
+            abort('Unexpected agent output: no checksums')
+
+        checksums = {}
+        for remote_path in remote_paths:
+            state = states.get(remote_path.lstrip('/'), ())
+            if state is None:
+                checksums[remote_path] = None
+            elif (isinstance(state, list) and len(state) == 3 and
+                    isinstance(state[0], basestring) and _DIGEST.match(state[0]) and
+                    isinstance(state[1], int) and
+                    isinstance(state[2], basestring)):
+                checksums[remote_path] = RemoteFile(*state)
+            else:
+                abort('Unexpected agent checksum for {path}: {state}'.format(path=remote_path,
+                                                                          state=state))
+        return checksums
+
+    def _fetched(self, remote_paths, directory, compress, result):
+        fetched = set()
+        contents = result.get('fetch')
+        if not isinstance(contents, dict):
+            abort('Unexpected agent output: no fetched files')
+        for remote_path in remote_paths:
+            content = contents.get(remote_path.lstrip('/'))
+            if content is None:
+                continue
+            _check_base64(content, 'agent fetch')
+            content = b64decode(content)
+            local_path = join(directory, remote_path.lstrip('/'))
+            _ensure_dir(dirname(local_path))
+            with open(local_path, 'wb') as local_file:
+                local_file.write(zlib.decompress(content) if compress else content)
+            fetched.add(remote_path)
+        return fetched
+
+    def checksums(self, remote_paths):
+        remote_paths = list(remote_paths)
+        if not remote_paths:
+            return {}
+
+        result = self.call(dict(checksums=[remote_path.lstrip('/') for remote_path in remote_paths]))
+        return self._checksums(remote_paths, result)
+
+    def fetch(self, remote_paths, directory, compress=False):
+        remote_paths = list(remote_paths)
+        if not remote_paths:
+            return set()
+
+        result = self.call(dict(fetch=[remote_path.lstrip('/') for remote_path in remote_paths],
+                                compress=compress))
+        return self._fetched(remote_paths, directory, compress, result)
+
+    def fetch_changed(self, known_digests, directory, compress=False):
+        if not known_digests:
+            return {}, set()
+
+        result = self.call(dict(fetch_changed=dict((remote_path.lstrip('/'), digests)
+                                                   for remote_path, digests
+                                                   in known_digests.items()),
+                                compress=compress))
+        return (self._checksums(known_digests, result),
+                self._fetched(known_digests, directory, compress, result))
+
+    def push(self, files, compress=False):
+        files = list(files)
+        if not files:
+            return
+
+        entries = []
+        for local_path, remote_path in files:
+            entry = dict(path=remote_path.lstrip('/'),
+                         mode=os.stat(local_path).st_mode & 07777)
+            if os.path.getsize(local_path) > _INLINE_FILE_SIZE:
+                # the agent moves the upload into place and removes it
+                entry['source'] = self.upload(local_path)
+            else:
+                with open(local_path, 'rb') as local_file:
+                    content = local_file.read()
+                entry['content'] = b64encode(zlib.compress(content) if compress else content)
+            entries.append(entry)
+        self.call(dict(write=entries, compress=compress))
+
+
+class FabricTransport(Transport):
+    """
+    Transport for a host through Fabric, using ``sudo``.
+
+    Without a host, operates on Fabric's current ``env.host_string``.
+    """
+    def __init__(self, host=None):
+        self.host = host
+
+    def _settings(self):
+        return settings(host_string=self.host) if self.host else settings()
+
+    def run(self, command):
+        # without a pty, stderr and prompts stay out of the output
+        with self._settings(), hide('stdout'):
+            return sudo(command, pty=False, combine_stderr=False)
+
+    def get(self, remote_path, local_path):
+        with self._settings():
+            get(remote_path, local_path)
+
+    def put(self, local_path, remote_path):
+        with self._settings():
+            put(local_path, remote_path, use_sudo=True, mirror_local_mode=True)
+
+    def upload(self, local_path):
+        # created without sudo, so that the connecting user can write to it
+        with self._settings(), hide('stdout'):
+            remote_path = run(_MKTEMP).strip()
+            return put(local_path, remote_path)[0]
+
+
+class LocalTransport(Transport):
+    """
+    Transport for a local directory standing in for a host's root.
+
+    An optional ``latency`` (in seconds) is added to every operation to
+    simulate a network round-trip.
+    """
+    def __init__(self, root, latency=0):
+        self.root = root
+        self.latency = latency
+        self.calls = 0
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _local(self, remote_path):
+        return join(self.root, remote_path.lstrip('/'))
+
+    def run(self, command):
+        self._round_trip()
+        process = Popen(['sh', '-c', command], stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
+        if process.returncode:
+            abort('Command failed: {command}\n{stderr}'.format(command=command, stderr=stderr))
+        return stdout
+
+    def get(self, remote_path, local_path):
+        self._round_trip()
+        _ensure_dir(dirname(local_path))
+        shutil.copyfile(self._local(remote_path), local_path)
+
+    def put(self, local_path, remote_path):
+        self._round_trip()
+        _ensure_dir(dirname(self._local(remote_path)))
+        shutil.copy(local_path, self._local(remote_path))
+
+    def upload(self, local_path):
+        self._round_trip()
+        handle, remote_path = mkstemp(prefix='confab-upload-')
+        os.close(handle)
+        shutil.copyfile(local_path, remote_path)
+        return remote_path